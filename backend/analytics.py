@@ -0,0 +1,248 @@
+"""Pre-aggregated analytics for signups and contact messages.
+
+Dashboards ask "how many signups / contact messages per day", which would
+otherwise be an aggregation over every raw document. Instead each write is
+counted into rollup documents in ``analytics_rollups``, one per metric,
+granularity (minute, hour, day) and bucket start::
+
+    {"_id": "signups:day:2026-10-17T00:00:00", "metric": "signups",
+     "granularity": "day", "bucket": datetime(2026, 10, 17),
+     "counts": {"total": 42}}
+
+A query then reads one document per bucket, however many users or messages
+there are.
+
+Routes call ``RollupRecorder.record()``, which only adds to an in-memory
+counter. A background task flushes the counters every ``flush_interval``
+with one unordered ``bulk_write`` of ``$inc`` upserts. Counts are exact
+across workers because ``$inc`` is atomic. A flush that fails, even
+partway, is retried with the same flush id, and each rollup applies a
+given flush once (``AnalyticsRepository.increment``). A crash loses at
+most one flush interval, and ``python cli.py backfill-analytics`` rebuilds
+the rollups from the raw collections (also covering users loaded with
+``import-users``).
+
+Metrics:
+
+- ``signups``: users by ``created_at``
+- ``contact_messages``: messages by ``created_at``
+- ``contact_processed``: background processing outcomes (``done``,
+  ``failed``) by ``processed_at`` / ``failed_at``
+
+Minute and hour buckets carry an ``expires_at`` for the TTL index; day
+buckets are kept.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from repository import naive_utc
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_ENABLED = os.environ.get('ANALYTICS_ENABLED', 'true').lower() == 'true'
+ANALYTICS_FLUSH_INTERVAL_MS = int(os.environ.get('ANALYTICS_FLUSH_INTERVAL_MS', '1000'))
+ANALYTICS_MINUTE_RETENTION_DAYS = float(os.environ.get('ANALYTICS_MINUTE_RETENTION_DAYS', '7'))
+ANALYTICS_HOUR_RETENTION_DAYS = float(os.environ.get('ANALYTICS_HOUR_RETENTION_DAYS', '90'))
+ANALYTICS_MAX_BUCKETS = int(os.environ.get('ANALYTICS_MAX_BUCKETS', '1500'))
+
+METRICS = ("signups", "contact_messages", "contact_processed")
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+RETENTION = {
+    "minute": timedelta(days=ANALYTICS_MINUTE_RETENTION_DAYS),
+    "hour": timedelta(days=ANALYTICS_HOUR_RETENTION_DAYS),
+}
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    """Start of the ``granularity`` bucket holding ``at`` (naive UTC)"""
+    if granularity == "minute":
+        return at.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_id(metric: str, granularity: str, bucket: datetime) -> str:
+    return f"{metric}:{granularity}:{bucket.isoformat()}"
+
+
+def add_counts(counts: Counter, metric: str, at: datetime, field: str = "total", count: int = 1):
+    """Count ``count`` events of ``metric`` at ``at`` into every granularity"""
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(at, granularity)
+        counts[(metric, granularity, bucket, "total")] += count
+        if field != "total":
+            counts[(metric, granularity, bucket, field)] += count
+
+
+def rollup_updates(counts: Counter) -> List[dict]:
+    """One ``{"_id", "inc", "fields"}`` update per rollup document touched by ``counts``"""
+    updates: Dict[str, dict] = {}
+    for (metric, granularity, bucket, field), count in counts.items():
+        _id = rollup_id(metric, granularity, bucket)
+        update = updates.get(_id)
+        if update is None:
+            fields = {"metric": metric, "granularity": granularity, "bucket": bucket}
+            if granularity in RETENTION:
+                fields["expires_at"] = bucket + RETENTION[granularity]
+            update = updates[_id] = {"_id": _id, "inc": {}, "fields": fields}
+        update["inc"][f"counts.{field}"] = count
+    return list(updates.values())
+
+
+class RollupRecorder:
+    """Counts events in memory and flushes them as ``$inc`` upserts"""
+
+    def __init__(self, repository_getter, flush_interval: float = ANALYTICS_FLUSH_INTERVAL_MS / 1000.0):
+        self.repository_getter = repository_getter
+        self.flush_interval = flush_interval
+        self.pending: Counter = Counter()
+        # A flush that failed, with its id, retried before newer counts
+        self.unflushed: Optional[Tuple[str, Counter]] = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    def record(self, metric: str, field: str = "total", count: int = 1, at: Optional[datetime] = None):
+        """Count ``count`` events of ``metric``; never waits on the database"""
+        if count:
+            add_counts(self.pending, metric, at or datetime.utcnow(), field, count)
+
+    async def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush what is left"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+        try:
+            while self.unflushed or self.pending:
+                await self.flush()
+        except Exception as e:
+            logger.error("Dropping %d unflushed analytics counters: %s", self.pending_count(), e)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                # Kept in unflushed; retried with the same id on the next tick
+                logger.error("Analytics flush failed: %s", e)
+
+    async def flush(self):
+        """Write the failed flush if there is one, otherwise the pending counters"""
+        if self.unflushed is None:
+            if not self.pending:
+                return
+            self.unflushed = (uuid.uuid4().hex[:16], self.pending)
+            self.pending = Counter()
+        flush_id, counts = self.unflushed
+        try:
+            await self.repository_getter().increment(rollup_updates(counts), flush_id)
+        except Exception:
+            self.failed_flushes += 1
+            raise
+        self.unflushed = None
+        self.flushes += 1
+
+    def pending_count(self) -> int:
+        return len(self.pending) + (len(self.unflushed[1]) if self.unflushed else 0)
+
+    def stats(self):
+        return {"pending": self.pending_count(), "flushes": self.flushes, "failed_flushes": self.failed_flushes}
+
+
+def series_range(granularity: str, since: Optional[datetime], until: Optional[datetime],
+                 default_buckets: int = 30) -> Tuple[datetime, datetime]:
+    """``[since, until)`` widened to whole buckets; the last ``default_buckets`` up to now by default"""
+    step = GRANULARITIES[granularity]
+    until = naive_utc(until) if until else datetime.utcnow()
+    end = bucket_start(until, granularity)
+    until = end if end == until else end + step
+    since = bucket_start(naive_utc(since), granularity) if since else until - step * default_buckets
+    if since >= until:
+        raise ValueError("since must be before until")
+    if (until - since) / step > ANALYTICS_MAX_BUCKETS:
+        raise ValueError(f"At most {ANALYTICS_MAX_BUCKETS} buckets per query; use a coarser granularity")
+    return since, until
+
+
+async def read_series(repository, metric: str, granularity: str, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> dict:
+    """Counts per bucket for ``metric``, with empty buckets filled in as zero"""
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    since, until = series_range(granularity, since, until)
+    documents = {
+        document["bucket"]: document.get("counts", {})
+        for document in await repository.find_range(metric, granularity, since, until)
+    }
+    buckets = []
+    totals: Counter = Counter()
+    bucket, step = since, GRANULARITIES[granularity]
+    while bucket < until:
+        counts = {"total": 0, **documents.get(bucket, {})}
+        totals.update(counts)
+        buckets.append({"bucket": bucket, **counts})
+        bucket += step
+    return {
+        "metric": metric,
+        "granularity": granularity,
+        "since": since,
+        "until": until,
+        "buckets": buckets,
+        "totals": dict(totals),
+    }
+
+
+async def backfill(data, since: Optional[datetime] = None) -> Dict[str, int]:
+    """Rebuild every rollup from the raw collections, from ``since`` (a day boundary) on.
+
+    Reads each raw document's timestamp once and replaces the affected
+    rollups. Writes counted by a running API while this runs can be lost
+    from the rebuilt buckets; run it when traffic is low.
+    """
+    since = bucket_start(naive_utc(since), "day") if since else None
+    counts: Counter = Counter()
+    events: Counter = Counter()
+    sources = [
+        ("signups", "total", data.users, "created_at", {}),
+        ("contact_messages", "total", data.contact_messages, "created_at", {}),
+        ("contact_processed", "done", data.contact_messages, "processed_at", {"status": "done"}),
+        ("contact_processed", "failed", data.contact_messages, "failed_at", {"status": "failed"}),
+    ]
+    for metric, field, repository, timestamp_field, query in sources:
+        async for at in repository.timestamps(timestamp_field, query, since):
+            add_counts(counts, metric, at, field)
+            events[metric] += 1
+    now = datetime.utcnow()
+    documents = [
+        {"_id": update["_id"], **update["fields"],
+         "counts": {name.split(".", 1)[1]: count for name, count in update["inc"].items()}}
+        for update in rollup_updates(counts)
+        # Buckets already past their retention would only be removed again by the TTL index
+        if update["fields"].get("expires_at", now) >= now
+    ]
+    await data.analytics.replace(METRICS, since, documents)
+    return dict(events)
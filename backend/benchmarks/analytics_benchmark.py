@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Daily contact message counts: raw collection vs pre-aggregated rollups.
+
+Seeds ``--messages`` contact messages spread over ``--days`` days, builds
+the rollups with ``analytics.backfill``, then times the 30-day daily series
+both ways: a ``$group`` aggregation over the raw messages (what a dashboard
+would run without rollups) and ``analytics.read_series`` (one document per
+bucket). Repeat with growing ``--messages`` to see the raw query grow with
+the collection while the rollup read stays flat::
+
+    python benchmarks/analytics_benchmark.py --messages 20000
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/analytics_benchmark.py --messages 1000000
+
+Runs on the mongomock stand-in unless ``MONGO_URL`` is set.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+
+async def timed(operation, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await operation()
+    return (time.perf_counter() - started) / repeat
+
+
+async def main(args):
+    from analytics import backfill, read_series
+    from indexes import ensure_indexes
+    from repository import DataLayer
+
+    data = DataLayer(os.environ.get("MONGO_URL", "mongomock://"), args.db)
+    await data.connect()
+    await ensure_indexes(data.db)
+    try:
+        now = datetime.utcnow()
+        for start in range(0, args.messages, 5000):
+            await data.contact_messages.insert_many([
+                {"id": str(uuid.uuid4()), "name": "Bench", "email": "bench@example.com", "message": "Benchmark",
+                 "status": "new", "created_at": now - timedelta(seconds=random.uniform(0, args.days * 86400))}
+                for _ in range(start, min(args.messages, start + 5000))
+            ])
+        started = time.perf_counter()
+        await backfill(data)
+        print(f"{args.messages} messages over {args.days} days; backfill {time.perf_counter() - started:.2f} s")
+
+        since = now - timedelta(days=30)
+
+        async def raw():
+            pipeline = [
+                {"$match": {"created_at": {"$gte": since}}},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                            "count": {"$sum": 1}}},
+            ]
+            return await data.db.contact_messages.aggregate(pipeline).to_list(length=None)
+
+        async def rollups():
+            return await read_series(data.analytics, "contact_messages", "day", since, now)
+
+        raw_counts = {row["_id"]: row["count"] for row in await raw()}
+        series = await rollups()
+        by_day = {bucket["bucket"].strftime("%Y-%m-%d"): bucket["total"] for bucket in series["buckets"]}
+        assert all(by_day.get(day) == count for day, count in raw_counts.items()), "rollups disagree with raw counts"
+
+        raw_seconds = await timed(raw, args.repeat)
+        rollup_seconds = await timed(rollups, args.repeat)
+        print(f"{'raw $group':<16} {raw_seconds * 1000:>10.2f} ms")
+        print(f"{'rollups':<16} {rollup_seconds * 1000:>10.2f} ms  ({raw_seconds / rollup_seconds:.0f}x faster)")
+    finally:
+        await data.client.drop_database(args.db)
+        await data.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", default="xgen_cloud_analytics_bench")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Cold start: time from process launch to the first successful ``/api/services``.
+
+Starts a fresh ``uvicorn server:app`` process ``--runs`` times, polls
+``--path`` every few milliseconds until it answers 200, and reports the
+distribution of launch-to-first-response times. The total covers
+interpreter start, imports, the startup event (database connect, index
+creation) and the first request::
+
+    python benchmarks/coldstart_benchmark.py --runs 10
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/coldstart_benchmark.py
+
+Runs on the mongomock stand-in unless ``MONGO_URL`` is set.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import BACKEND_DIR
+from harness import free_port
+
+
+def cold_start(args) -> float:
+    port = free_port()
+    env = {**os.environ, "MONGO_URL": os.environ.get("MONGO_URL", "mongomock://")}
+    url = f"http://127.0.0.1:{port}{args.path}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", args.app, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + args.timeout
+        while time.perf_counter() < deadline:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                pass
+            if server.poll() is not None:
+                raise SystemExit(f"Server exited with {server.returncode}")
+            time.sleep(args.poll_ms / 1000)
+        raise SystemExit(f"No 200 from {url} within {args.timeout} s")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(args):
+    timings = [cold_start(args) for _ in range(args.runs)]
+    ms = sorted(t * 1000 for t in timings)
+    print(f"{args.app} -> first 200 from {args.path}, {args.runs} runs")
+    print(f"min {ms[0]:.0f} ms  median {statistics.median(ms):.0f} ms  max {ms[-1]:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--app", default="server:app")
+    parser.add_argument("--path", default="/api/services")
+    parser.add_argument("--poll-ms", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    main(parser.parse_args())
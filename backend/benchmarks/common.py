@@ -0,0 +1,63 @@
+"""Shared helpers for the backend benchmark scripts."""
+import asyncio
+import os
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of ``samples``"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles (milliseconds) for one run"""
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def print_report(title: str, stats: Dict[str, float]):
+    print(
+        f"{title:<32} {stats['requests']:>7} req  {stats['rps']:>9.1f} req/s  "
+        f"p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  "
+        f"p99 {stats['p99_ms']:>8.2f} ms"
+    )
+
+
+async def run_concurrent(
+    operation: Callable[[int], Awaitable[None]], total: int, concurrency: int
+) -> Dict[str, float]:
+    """Run ``operation(i)`` ``total`` times with ``concurrency`` callers in flight"""
+    latencies: List[float] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            await operation(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def asgi_client(app):
+    """httpx client that calls the ASGI ``app`` in-process"""
+    import httpx
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
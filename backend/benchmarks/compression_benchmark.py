@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Bytes saved versus CPU cost of response compression.
+
+For representative payloads (the services catalog, a profile, an admin page
+of contact messages and a CSV export chunk) reports, per installed encoding,
+the compressed size and the CPU time to compress one body. Then it calls
+an ASGI endpoint serving the catalog directly (no HTTP client) with and
+without ``CompressionMiddleware`` to show the per-request overhead, first
+with the compressed-body cache and then without it::
+
+    python benchmarks/compression_benchmark.py --iterations 2000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import time
+import uuid
+from datetime import datetime
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+
+def contact_messages(count: int):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Sender {i}",
+            "email": f"sender{i}@example.com",
+            "message": f"Hello, I would like to know more about your services (request {i}).",
+            "status": "new",
+            "created_at": datetime(2024, 1, 1, 12, 0, i % 60).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def payloads():
+    from catalog import services_response
+
+    messages = contact_messages(500)
+    export = io.StringIO()
+    writer = csv.DictWriter(export, fieldnames=list(messages[0]))
+    writer.writeheader()
+    writer.writerows(messages)
+    profile = {"id": str(uuid.uuid4()), "name": "Bench User", "email": "bench@example.com",
+               "created_at": datetime.utcnow().isoformat()}
+    return {
+        "services catalog": services_response.body,
+        "profile": json.dumps(profile).encode(),
+        "admin page (50)": json.dumps({"items": messages[:50], "next_cursor": "x" * 40}).encode(),
+        "csv export (500)": export.getvalue().encode(),
+    }
+
+
+def compress_cost(encoder_class, body: bytes, iterations: int):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        encoder = encoder_class()
+        compressed = encoder.compress(body) + encoder.finish()
+    return len(compressed), (time.perf_counter() - started) / iterations
+
+
+async def per_request(app, headers, iterations: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/api/services", "headers": headers}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / iterations
+
+
+async def main(args):
+    from catalog import services_response
+    from compression import CompressionMiddleware, available_encoders
+
+    encoders = available_encoders()
+    print(f"{'payload':<18} {'encoding':<8} {'bytes':>8} {'saved':>7} {'us/body':>9}")
+    for name, body in payloads().items():
+        print(f"{name:<18} {'identity':<8} {len(body):>8} {'':>7} {'':>9}")
+        for coding, encoder_class in encoders.items():
+            size, seconds = compress_cost(encoder_class, body, args.iterations)
+            print(f"{'':<18} {coding:<8} {size:>8} {1 - size / len(body):>6.0%} {seconds * 1e6:>9.1f}")
+
+    async def catalog(scope, receive, send):
+        await send({
+            "type": "http.response.start", "status": 200,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"etag", services_response.etag.encode())],
+        })
+        await send({"type": "http.response.body", "body": services_response.body})
+
+    print(f"\n{'catalog request':<34} {'us/request':>10}")
+    bare = await per_request(catalog, [], args.iterations)
+    print(f"{'no middleware':<34} {bare * 1e6:>10.2f}")
+    for coding in encoders:
+        headers = [(b"accept-encoding", coding.encode())]
+        cached = await per_request(CompressionMiddleware(catalog, min_size=0), headers, args.iterations)
+        uncached = await per_request(CompressionMiddleware(catalog, min_size=0, cache_size=0), headers, args.iterations)
+        print(f"{coding + ', cached compressed body':<34} {cached * 1e6:>10.2f}")
+        print(f"{coding + ', compressed per request':<34} {uncached * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Contact message processing throughput by worker concurrency.
+
+Seeds ``--messages`` new contact messages and drains them with
+``ContactProcessor`` at 1, 2, 4, ... up to ``--max-concurrency`` workers.
+The handler sleeps ``--handler-ms`` to stand in for a notification or CRM
+call, and fails a ``--fail-rate`` fraction of attempts so that retries and
+backoff are part of the measurement::
+
+    python benchmarks/contact_worker_benchmark.py --messages 2000 --handler-ms 20
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/contact_worker_benchmark.py
+
+Runs on the mongomock stand-in unless ``MONGO_URL`` is set.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+
+async def measure(concurrency: int, args) -> dict:
+    from indexes import ensure_indexes
+    from repository import DataLayer
+    from contact_worker import ContactProcessor
+
+    async def handler(message):
+        await asyncio.sleep(args.handler_ms / 1000)
+        if random.random() < args.fail_rate:
+            raise RuntimeError("injected failure")
+
+    data = DataLayer(os.environ.get("MONGO_URL", "mongomock://"), args.db)
+    await data.connect()
+    await ensure_indexes(data.db)
+    now = datetime.utcnow()
+    await data.contact_messages.insert_many([
+        {"id": str(uuid.uuid4()), "name": f"Bench {i}", "email": f"bench.{i}@example.com",
+         "message": "Benchmark message", "created_at": now, "status": "new"}
+        for i in range(args.messages)
+    ])
+    processor = ContactProcessor(
+        lambda: data.contact_messages, handler, concurrency=concurrency,
+        max_attempts=args.max_attempts, backoff=0.01, max_backoff=0.1, poll_interval=0.01,
+    )
+    collection = data.db.contact_messages
+    started = time.perf_counter()
+    await processor.start()
+    try:
+        while await collection.count_documents({"status": {"$in": ["new", "processing"]}}):
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+    finally:
+        await processor.stop()
+        await data.client.drop_database(args.db)
+        await data.close()
+    return {**processor.stats(), "seconds": elapsed, "per_second": args.messages / elapsed}
+
+
+async def main(args):
+    print(f"{args.messages} messages, handler {args.handler_ms} ms, {args.fail_rate:.0%} of attempts fail")
+    print(f"{'workers':>7} {'msgs/s':>9} {'speedup':>8} {'seconds':>8} {'done':>6} {'retried':>8} {'failed':>7}")
+    base = None
+    concurrency = 1
+    while concurrency <= args.max_concurrency:
+        result = await measure(concurrency, args)
+        base = base or result["per_second"]
+        print(f"{concurrency:>7} {result['per_second']:>9.1f} {result['per_second'] / base:>7.2f}x "
+              f"{result['seconds']:>8.2f} {result['done']:>6} {result['retried']:>8} {result['failed']:>7}")
+        concurrency *= 2
+
+
+if __name__ == "__main__":
+    # Injected failures would log a warning per retry
+    logging.getLogger("contact_worker").setLevel(logging.CRITICAL)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--handler-ms", type=float, default=20.0)
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--db", default="xgen_cloud_worker_bench")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Local load-testing harness for the Xgen Cloud API.
+
+Runs a weighted mix of register, login, profile, contact and services
+requests from many concurrent async clients and reports RPS and
+p50/p95/p99 of successful requests per scenario. Requests shed by the
+server (429/503 from rate limiting or hash pool admission control) are
+counted separately as ``rejected``; any other error status counts as an
+error. The app runs in-process (``--target inprocess``, the default) or in
+a local uvicorn subprocess (``--target uvicorn``), on the mongomock
+stand-in unless ``MONGO_URL`` points at a real server. ``--url`` targets an
+already running server instead.
+
+Results can be written as JSON and compared against a baseline file; the run
+exits non-zero when any scenario's p99 rises, or its RPS drops, by more than
+the baseline's tolerance, or when errors appear that the baseline did not
+have. Scenarios with fewer than ``MIN_SAMPLES`` successful requests are not
+compared on latency or RPS::
+
+    python benchmarks/harness.py --duration 20 --concurrency 50
+    python benchmarks/harness.py --baseline benchmarks/baseline.json
+    python benchmarks/harness.py --write-baseline benchmarks/baseline.json
+
+Baselines are host-specific: regenerate one on the machine that runs the
+comparison. A run whose target, concurrency or duration differs from the
+baseline's is not compared; it exits with status 2.
+
+Passwords are hashed at ``BCRYPT_ROUNDS=4`` unless set, so that the run
+measures the API rather than bcrypt. The run ends on its deadline; requests
+still running then are cancelled and reported as ``unfinished``.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+from common import BACKEND_DIR, summarize
+
+SCENARIOS = ("register", "login", "profile", "contact", "services")
+DEFAULT_MIX = "register=1,login=2,profile=10,contact=3,services=20"
+PASSWORD = "BenchPassword1!"
+SHED_STATUSES = (429, 503)
+SHED_BACKOFF = 0.05  # seconds a client waits after being shed, so rejections do not spin
+MIN_SAMPLES = 20
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario in --mix: {name}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def harness_environment() -> Dict[str, str]:
+    """Settings applied to the app under test unless already set"""
+    return {
+        "MONGO_URL": os.environ.get("MONGO_URL", "mongomock://"),
+        # The load comes from one address; throttling would measure the limiter
+        "RATE_LIMIT_ENABLED": os.environ.get("RATE_LIMIT_ENABLED", "false"),
+        # At production cost (a few hashes per core per second) register and login
+        # would get too few samples to compare; BCRYPT_ROUNDS=12 measures that cost
+        "BCRYPT_ROUNDS": os.environ.get("BCRYPT_ROUNDS", "4"),
+    }
+
+
+class Workload:
+    def __init__(self, client, weights: Dict[str, int], seed: int):
+        self.client = client
+        self.names = list(weights)
+        self.weights = [weights[name] for name in self.names]
+        self.random = random.Random(seed)
+        self.users: List[dict] = []
+        self.latencies: Dict[str, List[float]] = {name: [] for name in self.names}
+        self.rejected: Dict[str, int] = {name: 0 for name in self.names}
+        self.errors: Dict[str, int] = {name: 0 for name in self.names}
+        self.unfinished: Dict[str, int] = {name: 0 for name in self.names}
+
+    async def setup(self, users: int):
+        for _ in range(users):
+            response = await self.register()
+            response.raise_for_status()
+
+    async def register(self):
+        email = f"bench.{uuid.uuid4().hex[:12]}@example.com"
+        response = await self.client.post(
+            "/api/register", json={"name": "Bench User", "email": email, "password": PASSWORD}
+        )
+        if response.status_code == 200:
+            self.users.append({"email": email, "token": response.json()["access_token"]})
+        return response
+
+    async def login(self):
+        user = self.random.choice(self.users)
+        return await self.client.post("/api/login", json={"email": user["email"], "password": PASSWORD})
+
+    async def profile(self):
+        user = self.random.choice(self.users)
+        return await self.client.get(
+            "/api/profile", headers={"Authorization": f"Bearer {user['token']}"}
+        )
+
+    async def contact(self):
+        return await self.client.post(
+            "/api/contact",
+            json={"name": "Bench", "email": "bench@example.com", "message": "Benchmark message"},
+        )
+
+    async def services(self):
+        return await self.client.get("/api/services")
+
+    async def run(self, concurrency: int, duration: float):
+        """Send requests until ``duration`` is up; requests still running then are cancelled as ``unfinished``"""
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = self.random.choices(self.names, self.weights)[0]
+                started = time.perf_counter()
+                try:
+                    response = await getattr(self, name)()
+                except asyncio.CancelledError:
+                    self.unfinished[name] += 1
+                    raise
+                elapsed = time.perf_counter() - started
+                if response.status_code < 400:
+                    self.latencies[name].append(elapsed)
+                elif response.status_code in SHED_STATUSES:
+                    self.rejected[name] += 1
+                    await asyncio.sleep(SHED_BACKOFF)
+                else:
+                    self.errors[name] += 1
+                # In-process, a response can complete without the app ever
+                # awaiting; yield so the workers cannot starve the event loop
+                await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        _, pending = await asyncio.wait(workers, timeout=duration)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return min(time.perf_counter() - started, duration)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def target_client(args):
+    import httpx
+
+    timeout = httpx.Timeout(60.0)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            yield client
+        return
+
+    os.environ.update(harness_environment())
+    if args.target == "inprocess":
+        import server
+
+        async with server.app.router.lifespan_context(server.app):
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+                yield client
+        return
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=os.environ.copy(),
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+            for _ in range(100):
+                with contextlib.suppress(httpx.TransportError):
+                    if (await client.get("/")).status_code == 200:
+                        break
+                await asyncio.sleep(0.1)
+            else:
+                raise SystemExit("uvicorn did not start")
+            yield client
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+# Settings a run must share with its baseline for the numbers to be comparable
+COMPARED_SETTINGS = ("target", "concurrency", "duration")
+
+
+def setting_mismatches(results: dict, baseline: dict) -> List[str]:
+    """Settings of ``results`` that differ from those ``baseline`` was recorded with"""
+    return [
+        f"{name} is {results[name]!r}, baseline was recorded with {baseline[name]!r}"
+        for name in COMPARED_SETTINGS
+        if name in baseline and results[name] != baseline[name]
+    ]
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """Regressions of ``results`` against ``baseline``, as messages"""
+    tolerance = baseline.get("tolerance", 0.25)
+    failures = []
+    for name, expected in baseline["scenarios"].items():
+        actual = results["scenarios"].get(name)
+        if actual is None:
+            continue
+        if actual["errors"] > expected.get("errors", 0):
+            failures.append(f"{name}: {actual['errors']} errors, baseline had {expected.get('errors', 0)}")
+        if actual["requests"] < MIN_SAMPLES or expected["requests"] < MIN_SAMPLES:
+            continue
+        if actual["p99_ms"] > expected["p99_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p99 {actual['p99_ms']:.2f} ms > baseline {expected['p99_ms']:.2f} ms")
+        if actual["rps"] < expected["rps"] * (1 - tolerance):
+            failures.append(f"{name}: {actual['rps']:.1f} req/s < baseline {expected['rps']:.1f} req/s")
+    return failures
+
+
+async def main(args) -> int:
+    async with target_client(args) as client:
+        workload = Workload(client, parse_mix(args.mix), args.seed)
+        await workload.setup(args.users)
+        elapsed = await workload.run(args.concurrency, args.duration)
+
+    results = {
+        "target": args.url or args.target,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "scenarios": {},
+    }
+    all_latencies = []
+    print(f"{'scenario':<10} {'ok':>8} {'rejected':>8} {'errors':>7} {'unfinished':>10} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, latencies in workload.latencies.items():
+        stats = summarize(latencies, elapsed)
+        stats["rejected"] = workload.rejected[name]
+        stats["errors"] = workload.errors[name]
+        stats["unfinished"] = workload.unfinished[name]
+        results["scenarios"][name] = stats
+        all_latencies.extend(latencies)
+        print(f"{name:<10} {stats['requests']:>8} {stats['rejected']:>8} {stats['errors']:>7} "
+              f"{stats['unfinished']:>10} {stats['rps']:>9.1f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    results["total"] = summarize(all_latencies, elapsed)
+    total = results["total"]
+    print(f"{'total':<10} {total['requests']:>8} {'':>8} {'':>7} {'':>10} {total['rps']:>9.1f} "
+          f"{total['p50_ms']:>9.2f} {total['p95_ms']:>9.2f} {total['p99_ms']:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump({"tolerance": args.tolerance, **results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.write_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatches = setting_mismatches(results, baseline)
+        if mismatches:
+            for mismatch in mismatches:
+                print(f"NOT COMPARED {mismatch}")
+            return 2
+        failures = compare(results, baseline)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--url", help="benchmark an already running server instead")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--users", type=int, default=5, help="users registered before the run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="fail on regressions against this file")
+    parser.add_argument("--write-baseline", help="write results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    sys.exit(asyncio.run(main(parser.parse_args())))
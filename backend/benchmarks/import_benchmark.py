@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Bulk user import throughput by number of hashing processes.
+
+Generates ``--rows`` NDJSON users and imports them with ``UserImporter``
+using 1, 2, 4, ... up to ``--max-workers`` hashing processes, reporting
+rows/sec and the split between hashing and inserts. Hashing uses the
+configured scheme and cost, so set ``BCRYPT_ROUNDS`` to match production::
+
+    BCRYPT_ROUNDS=12 python benchmarks/import_benchmark.py --rows 2000
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/import_benchmark.py
+
+Runs on the mongomock stand-in unless ``MONGO_URL`` is set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import uuid
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+
+async def ndjson(rows: int, chunk_rows: int = 500):
+    run = uuid.uuid4().hex[:8]
+    for start in range(0, rows, chunk_rows):
+        lines = [
+            json.dumps({"name": f"User {i}", "email": f"import.{run}.{i}@example.com", "password": f"Password{i}!"})
+            for i in range(start, min(rows, start + chunk_rows))
+        ]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def measure(workers: int, args) -> dict:
+    from indexes import ensure_indexes
+    from repository import DataLayer
+    from user_import import UserImporter
+
+    data = DataLayer(os.environ.get("MONGO_URL", "mongomock://"), args.db)
+    await data.connect()
+    await ensure_indexes(data.db)
+    importer = UserImporter(data.users, chunk_size=args.chunk_size, workers=workers)
+    try:
+        # Start the worker processes before timing
+        await importer.hash_passwords(["warm up"] * workers)
+        report = await importer.run(ndjson(args.rows))
+    finally:
+        importer.shutdown()
+        await data.client.drop_database(args.db)
+        await data.close()
+    return report.as_dict()
+
+
+async def main(args):
+    print(f"{args.rows} rows, chunks of {args.chunk_size}")
+    print(f"{'workers':>7} {'rows/s':>9} {'speedup':>8} {'hash s':>8} {'insert s':>9} {'inserted':>9}")
+    base = None
+    workers = 1
+    while workers <= args.max_workers:
+        result = await measure(workers, args)
+        base = base or result["rows_per_second"]
+        print(f"{workers:>7} {result['rows_per_second']:>9.1f} {result['rows_per_second'] / base:>7.2f}x "
+              f"{result['hash_seconds']:>8.2f} {result['insert_seconds']:>9.2f} {result['inserted']:>9}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--db", default="xgen_cloud_import_bench")
+    asyncio.run(main(parser.parse_args()))
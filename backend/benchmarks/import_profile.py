@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Import-time profile of the API process.
+
+Runs ``python -X importtime -c "import server"`` in a fresh interpreter and
+summarizes where the time goes: the total, the slowest modules by
+cumulative time (including what they import), and self time grouped by
+top-level package::
+
+    python benchmarks/import_profile.py --top 20
+    python benchmarks/import_profile.py --module tokens
+
+With ``--runs`` greater than one, the run with the median total is shown.
+"""
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import List, Tuple
+
+from common import BACKEND_DIR
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def profile(module: str) -> List[Tuple[int, int, int, str]]:
+    """``(self_us, cumulative_us, depth, name)`` per imported module, in import order"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            rows.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return rows
+
+
+def main(args):
+    runs = sorted((profile(args.module) for _ in range(args.runs)), key=lambda rows: sum(r[0] for r in rows))
+    rows = runs[len(runs) // 2]
+    target = next((r for r in rows if r[3] == args.module and r[2] == 0), None)
+    total = sum(r[0] for r in rows)
+    print(f"import {args.module}: {total / 1000:.1f} ms total, "
+          f"{target[1] / 1000 if target else 0:.1f} ms in the {args.module} tree, {len(rows)} modules")
+
+    print(f"\n{'slowest modules (cumulative)':<48} {'cum ms':>8} {'self ms':>8}")
+    for self_us, cumulative, depth, name in sorted(rows, key=lambda r: -r[1])[:args.top]:
+        indent = min(depth, 4)
+        print(f"{'  ' * indent}{name:<{48 - 2 * indent}} {cumulative / 1000:>8.1f} {self_us / 1000:>8.1f}")
+
+    packages = defaultdict(int)
+    for self_us, _, _, name in rows:
+        packages[name.split(".")[0]] += self_us
+    print(f"\n{'self time by package':<48} {'ms':>8} {'share':>8}")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<48} {self_us / 1000:>8.1f} {self_us / total:>8.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    main(parser.parse_args())
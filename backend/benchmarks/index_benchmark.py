@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Email lookup latency on a large ``users`` collection, with and without indexes.
+
+Seeds a scratch database with ``--users`` documents shaped like the ones
+``register_user`` writes, times ``find_one({"email": ...})`` as a collection
+scan, then creates the declared indexes and times the same lookups again.
+Needs a real MongoDB server (mongomock has no query planner)::
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/index_benchmark.py --users 1000000
+
+The scratch database (``--db``) is dropped at the end.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime
+
+from common import percentile
+
+BATCH_SIZE = 10000
+
+
+async def seed(collection, total: int):
+    now = datetime.utcnow()
+    for start in range(0, total, BATCH_SIZE):
+        await collection.insert_many([
+            {
+                "id": str(uuid.uuid4()),
+                "name": f"User {i}",
+                "email": f"user{i}@example.com",
+                "password": "$2b$12$" + "x" * 53,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(start, min(start + BATCH_SIZE, total))
+        ], ordered=False)
+
+
+async def time_lookups(collection, total: int, lookups: int):
+    latencies = []
+    for _ in range(lookups):
+        email = f"user{random.randrange(total)}@example.com"
+        started = time.perf_counter()
+        await collection.find_one({"email": email})
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(title, latencies):
+    print(
+        f"{title:<16} p50 {percentile(latencies, 50) * 1000:>9.3f} ms  "
+        f"p99 {percentile(latencies, 99) * 1000:>9.3f} ms"
+    )
+
+
+async def main(args):
+    from indexes import INDEXES, ensure_indexes
+    from repository import create_client
+
+    client = create_client(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db]
+    try:
+        await db.users.drop()
+        print(f"Seeding {args.users:,} users...")
+        started = time.perf_counter()
+        await seed(db.users, args.users)
+        print(f"Seeded in {time.perf_counter() - started:.1f} s")
+
+        report("no index", await time_lookups(db.users, args.users, args.scan_lookups))
+        started = time.perf_counter()
+        await ensure_indexes(db, {"users": INDEXES["users"]})
+        print(f"Indexes built in {time.perf_counter() - started:.1f} s")
+        report("email_unique", await time_lookups(db.users, args.users, args.lookups))
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--scan-lookups", type=int, default=20)
+    parser.add_argument("--db", default="xgen_cloud_index_bench")
+    asyncio.run(main(parser.parse_args()))
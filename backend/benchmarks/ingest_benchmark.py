@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Contact message ingestion throughput: one insert per message vs write-behind.
+
+Offers messages at fixed rates (1k-10k msgs/sec by default) for a few
+seconds each and reports the rate actually sustained, plus how long callers
+waited. ``direct`` awaits one ``insert_one`` per message, bounded by the
+driver pool size, as ``submit_contact_message`` does by default;
+``buffered`` goes through ``ingest.BufferedIngest``. ``--db-latency-ms``
+adds a round-trip delay to each database call::
+
+    python benchmarks/ingest_benchmark.py --db-latency-ms 2
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/ingest_benchmark.py
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+
+from common import print_report, summarize
+
+
+class DelayedMessages:
+    """Contact message repository with an added round-trip delay"""
+
+    def __init__(self, inner, latency: float):
+        self.inner = inner
+        self.latency = latency
+
+    async def insert(self, message):
+        await asyncio.sleep(self.latency)
+        return await self.inner.insert(message)
+
+    async def insert_many(self, messages, write_concern=None):
+        await asyncio.sleep(self.latency)
+        return await self.inner.insert_many(messages, write_concern=write_concern)
+
+
+def make_message(i: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "name": "Bench",
+        "email": "bench@example.com",
+        "message": f"Ingestion benchmark message {i}",
+        "created_at": datetime.utcnow(),
+        "status": "new",
+    }
+
+
+async def offer(rate: int, seconds: float, handle) -> dict:
+    """Start ``handle(i)`` ``rate`` times a second; returns caller latency stats"""
+    latencies = []
+    tasks = []
+    interval = 1.0 / rate
+    started = time.perf_counter()
+
+    async def timed(i, scheduled):
+        await handle(i)
+        latencies.append(time.perf_counter() - scheduled)
+
+    for i in range(int(rate * seconds)):
+        scheduled = started + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed(i, scheduled)))
+    await asyncio.gather(*tasks)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def main(args):
+    from ingest import BufferedIngest
+    from repository import DataLayer, MONGO_MAX_POOL_SIZE
+
+    data = DataLayer(os.environ.get("MONGO_URL", "mongomock://"), args.db)
+    await data.connect()
+    messages = DelayedMessages(data.contact_messages, args.db_latency_ms / 1000.0)
+    pool = asyncio.Semaphore(MONGO_MAX_POOL_SIZE)
+
+    async def direct(i):
+        async with pool:
+            await messages.insert(make_message(i))
+
+    try:
+        for rate in args.rates:
+            await data.db.contact_messages.delete_many({})
+            stats = await offer(rate, args.seconds, direct)
+            print_report(f"direct   @ {rate:>6} msgs/s", stats)
+
+            await data.db.contact_messages.delete_many({})
+            ingest = BufferedIngest(lambda: messages, batch_size=args.batch_size)
+            await ingest.start()
+
+            async def buffered(i):
+                ingest.submit(make_message(i))
+
+            started = time.perf_counter()
+            stats = await offer(rate, args.seconds, buffered)
+            await ingest.stop()
+            elapsed = time.perf_counter() - started
+            print_report(f"buffered @ {rate:>6} msgs/s", stats)
+            written = await data.db.contact_messages.count_documents({})
+            print(f"{'':<32} {written} written in {ingest.batches} batches, "
+                  f"{written / elapsed:,.0f} msgs/s including final flush")
+    finally:
+        await data.client.drop_database(args.db)
+        await data.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--db", default="xgen_cloud_ingest_bench")
+    asyncio.run(main(parser.parse_args()))
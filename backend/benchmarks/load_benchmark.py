@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Concurrent load benchmark for the API routes that hit the database.
+
+Drives ``server.app`` in-process with many concurrent clients and reports
+p50/p95/p99 latency, plus the latency of a cheap ``GET /`` probe fired on a
+fixed schedule alongside the load (measured from its scheduled start, so time
+spent waiting for a blocked event loop is counted). ``--blocking`` swaps the
+async data layer for the old synchronous pymongo calls made directly on the
+event loop, so both sides of the change can be measured against the same
+database::
+
+    MONGO_URL=mongomock:// python benchmarks/load_benchmark.py --db-latency-ms 5
+    MONGO_URL=mongomock:// python benchmarks/load_benchmark.py --db-latency-ms 5 --blocking
+
+``--db-latency-ms`` adds a fixed delay to every database call (awaited in
+async mode, ``time.sleep`` in blocking mode) to stand in for a remote server.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+from common import asgi_client, print_report, run_concurrent, summarize
+
+
+class DelayedRepository:
+    """Wraps a repository and delays each awaited call by ``latency`` seconds"""
+
+    def __init__(self, inner, latency: float, blocking: bool):
+        self.inner = inner
+        self.latency = latency
+        self.blocking = blocking
+
+    def __getattr__(self, name):
+        method = getattr(self.inner, name)
+
+        async def call(*args, **kwargs):
+            if self.blocking:
+                time.sleep(self.latency)
+            else:
+                await asyncio.sleep(self.latency)
+            return await method(*args, **kwargs)
+
+        return call
+
+
+class BlockingRepository:
+    """Exposes a synchronous pymongo collection through the async repository API.
+
+    The pymongo call runs on the event loop thread, which is what the routes
+    did before the async data layer.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def find_by_email(self, email):
+        return self.collection.find_one({"email": email})
+
+    async def insert(self, document):
+        return self.collection.insert_one(document)
+
+
+async def probe(client, interval: float, stop: asyncio.Event):
+    """Hit ``GET /`` every ``interval`` seconds until ``stop`` is set"""
+    latencies = []
+    started = time.perf_counter()
+    scheduled = started
+    while not stop.is_set():
+        scheduled += interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        (await client.get("/")).raise_for_status()
+        latencies.append(time.perf_counter() - scheduled)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def blocking_database(url: str):
+    if url.startswith("mongomock://"):
+        import mongomock
+        return mongomock.MongoClient().xgen_cloud
+    from pymongo import MongoClient
+    return MongoClient(url).xgen_cloud
+
+
+async def main(args):
+    import server
+
+    await server.data.connect()
+    if args.blocking:
+        database = blocking_database(server.MONGO_URL)
+        server.data.users = BlockingRepository(database.users)
+        server.data.contact_messages = BlockingRepository(database.contact_messages)
+    if args.db_latency_ms:
+        latency = args.db_latency_ms / 1000.0
+        server.data.users = DelayedRepository(server.data.users, latency, args.blocking)
+        server.data.contact_messages = DelayedRepository(
+            server.data.contact_messages, latency, args.blocking
+        )
+
+    mode = "blocking pymongo" if args.blocking else "async data layer"
+    print(f"{mode}, concurrency {args.concurrency}, db latency {args.db_latency_ms} ms")
+
+    async with asgi_client(server.app) as client:
+        email = f"bench.{uuid.uuid4().hex[:8]}@example.com"
+        response = await client.post(
+            "/api/register", json={"name": "Bench", "email": email, "password": "BenchPassword1!"}
+        )
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        async def profile(i):
+            (await client.get("/api/profile", headers=headers)).raise_for_status()
+
+        async def contact(i):
+            response = await client.post(
+                "/api/contact",
+                json={"name": "Bench", "email": email, "message": f"Load test message {i}"},
+            )
+            response.raise_for_status()
+
+        for title, operation in (("GET /api/profile", profile), ("POST /api/contact", contact)):
+            stop = asyncio.Event()
+            probing = asyncio.create_task(probe(client, args.probe_interval_ms / 1000.0, stop))
+            print_report(title, await run_concurrent(operation, args.requests, args.concurrency))
+            stop.set()
+            print_report("  GET / (probe during load)", await probing)
+
+    await server.data.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0)
+    parser.add_argument("--probe-interval-ms", type=float, default=10.0)
+    parser.add_argument("--blocking", action="store_true")
+    os.environ.setdefault("MONGO_URL", "mongomock://")
+    asyncio.run(main(parser.parse_args()))
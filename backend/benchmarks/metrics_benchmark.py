@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Per-request cost of the metrics instrumentation.
+
+Calls a trivial ASGI app directly (no HTTP client, no network) with and
+without ``MetricsMiddleware`` and reports the difference per request, plus
+the cost of a single histogram observation::
+
+    python benchmarks/metrics_benchmark.py --requests 200000
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+
+async def endpoint(scope, receive, send):
+    scope["route"] = ROUTE
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+ROUTE = SimpleNamespace(path="/api/services")
+SCOPE = {"type": "http", "method": "GET", "path": "/api/services"}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def per_request(app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+async def main(args):
+    from metrics import Histogram, MetricsMiddleware
+
+    bare = await per_request(endpoint, args.requests)
+    instrumented = await per_request(MetricsMiddleware(endpoint), args.requests)
+    print(f"{'bare ASGI app':<24} {bare * 1e6:8.2f} us/request")
+    print(f"{'with MetricsMiddleware':<24} {instrumented * 1e6:8.2f} us/request")
+    print(f"{'middleware overhead':<24} {(instrumented - bare) * 1e6:8.2f} us/request")
+
+    child = Histogram("bench_seconds", "benchmark", ("operation",)).labels("op")
+    started = time.perf_counter()
+    for i in range(args.requests):
+        child.observe(i * 1e-6)
+    print(f"{'histogram observe':<24} {(time.perf_counter() - started) / args.requests * 1e9:8.0f} ns")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Event loop throughput with the loop watchdog and during a sampling profile.
+
+Runs a CPU-bound coroutine workload (JSON encoding a small document and
+yielding to the loop) bare, with ``LoopLagMonitor`` plus ``LoopWatchdog``
+running as they do in the API, and while ``profiling.profile`` samples the
+loop thread at ``--interval-ms``::
+
+    python benchmarks/profiling_benchmark.py --iterations 200000
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+DOCUMENT = {"id": "4f2c", "name": "Bench User", "email": "bench@example.com", "tags": ["a", "b", "c"], "n": 42}
+
+
+async def workload(iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        json.dumps(DOCUMENT)
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    return (time.perf_counter() - started) / iterations
+
+
+async def main(args):
+    from health import LoopLagMonitor
+    from profiling import LoopWatchdog, profile
+
+    await workload(args.iterations // 10)  # warm up
+    bare = await workload(args.iterations)
+    print(f"{'bare loop':<28} {bare * 1e6:8.3f} us/iteration")
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    watchdog = LoopWatchdog(monitor)
+    watchdog.start()
+    try:
+        watched = await workload(args.iterations)
+        print(f"{'watchdog on':<28} {watched * 1e6:8.3f} us/iteration  ({(watched / bare - 1) * 100:+.1f}%)")
+        # A profile long enough to cover the whole run
+        seconds = bare * args.iterations * 2 + 0.2
+        sampling = asyncio.create_task(profile(seconds, args.interval_ms / 1000, [threading.get_ident()]))
+        await asyncio.sleep(0.1)
+        profiled = await workload(args.iterations)
+        result = await sampling
+        print(f"{'sampling every %g ms' % args.interval_ms:<28} {profiled * 1e6:8.3f} us/iteration  "
+              f"({(profiled / bare - 1) * 100:+.1f}%, {result.samples} samples)")
+    finally:
+        watchdog.stop()
+        await monitor.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
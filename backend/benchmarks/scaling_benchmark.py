@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Throughput scaling of ``cli.py serve`` from 1 to N worker processes.
+
+For each worker count, starts the server on a free port, drives it with
+``--clients`` load-generating processes (so the client is not the
+bottleneck) and reports requests/sec and p50/p99 for ``--path``::
+
+    python benchmarks/scaling_benchmark.py --max-workers 8 --clients 4
+
+Uses the mongomock stand-in unless ``MONGO_URL`` is set; with mongomock
+every worker has its own in-memory database, so only stateless paths give
+meaningful numbers.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import BACKEND_DIR, summarize
+from harness import free_port
+
+
+def client_process(url: str, duration: float, concurrency: int, results):
+    import httpx
+
+    async def run():
+        latencies = []
+        deadline = time.perf_counter() + duration
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+
+            async def worker():
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    response = await client.get(url)
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies
+
+    results.put(asyncio.run(run()))
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not start")
+
+
+def measure(workers: int, args) -> dict:
+    port = free_port()
+    env = {**os.environ, "MONGO_URL": os.environ.get("MONGO_URL", "mongomock://")}
+    server = subprocess.Popen(
+        [sys.executable, "cli.py", "serve", "--workers", str(workers), "--port", str(port),
+         "--host", "127.0.0.1", "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{args.path}"
+        wait_until_up(url)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=client_process, args=(url, args.duration, args.concurrency, results)
+            )
+            for _ in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for client in clients:
+            client.start()
+        latencies = []
+        for _ in clients:
+            latencies.extend(results.get())
+        for client in clients:
+            client.join()
+        return summarize(latencies, time.perf_counter() - started)
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+def main(args):
+    print(f"{args.path}, {args.clients} client processes x {args.concurrency} connections")
+    print(f"{'workers':>7} {'req/s':>10} {'speedup':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    base = None
+    workers = 1
+    while workers <= args.max_workers:
+        stats = measure(workers, args)
+        base = base or stats["rps"]
+        print(f"{workers:>7} {stats['rps']:>10.1f} {stats['rps'] / base:>7.2f}x "
+              f"{stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clients", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--concurrency", type=int, default=32, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--path", default="/api/services")
+    main(parser.parse_args())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Per-endpoint cost of building the JSON response body.
+
+For the profile and login/register payloads, compares the default path
+(pydantic model, ``response_model`` validation and ``jsonable_encoder`` via
+FastAPI's ``serialize_response``, then ``JSONResponse``) with the
+``FAST_RESPONSES`` path (a plain dict rendered by ``FastJSONResponse``),
+using orjson and the standard library fallback::
+
+    python benchmarks/serialization_benchmark.py --iterations 50000
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+os.environ.setdefault("MONGO_URL", "mongomock://")
+
+USER = {
+    "id": str(uuid.uuid4()),
+    "name": "Bench User",
+    "email": "bench.user@example.com",
+    "created_at": datetime.utcnow(),
+}
+TOKEN = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." + "x" * 120 + "." + "y" * 43
+
+
+def route_field(app, path: str):
+    return next(route.response_field for route in app.routes if getattr(route, "path", None) == path)
+
+
+async def per_call(build, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await build()
+    return (time.perf_counter() - started) / iterations
+
+
+async def main(args):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    import responses
+    import server
+
+    endpoints = {
+        "/api/profile": (lambda: server.User(**server.public_user(USER)), lambda: server.public_user(USER)),
+        "/api/login": (
+            lambda: server.Token(access_token=TOKEN, token_type="bearer", user=server.User(**server.public_user(USER))),
+            lambda: {"access_token": TOKEN, "token_type": "bearer", "user": server.public_user(USER)},
+        ),
+    }
+    orjson = responses.orjson
+
+    print(f"{'endpoint':<14} {'variant':<22} {'us/response':>12} {'speedup':>8}")
+    for path, (build_model, build_dict) in endpoints.items():
+        field = route_field(server.app, path)
+
+        async def default():
+            content = await serialize_response(field=field, response_content=build_model())
+            return JSONResponse(content).body
+
+        async def fast():
+            return responses.FastJSONResponse(build_dict()).body
+
+        baseline = await per_call(default, args.iterations)
+        print(f"{path:<14} {'model + JSONResponse':<22} {baseline * 1e6:>12.2f} {'1.00x':>8}")
+        for name, module in (("orjson", orjson), ("stdlib json", None)):
+            if name == "orjson" and orjson is None:
+                print(f"{path:<14} {'orjson':<22} {'not installed':>12}")
+                continue
+            responses.orjson = module
+            cost = await per_call(fast, args.iterations)
+            print(f"{path:<14} {'fast, ' + name:<22} {cost * 1e6:>12.2f} {baseline / cost:>7.2f}x")
+        responses.orjson = orjson
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=50000)
+    asyncio.run(main(parser.parse_args()))
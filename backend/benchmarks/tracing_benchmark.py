@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Per-request cost of tracing.
+
+Calls a trivial ASGI app that opens three child spans (no HTTP client, no
+network) bare, behind ``TracingMiddleware`` with tracing disabled, with
+requests not sampled, and with every request sampled into an exporter that
+discards the spans::
+
+    python benchmarks/tracing_benchmark.py --requests 100000
+"""
+import argparse
+import asyncio
+import time
+
+import common  # noqa: F401  (puts the backend on sys.path)
+
+SCOPE = {"type": "http", "method": "GET", "path": "/api/profile", "headers": [(b"accept", b"*/*")]}
+
+
+class DiscardExporter:
+    def export(self, spans):
+        pass
+
+    def close(self):
+        pass
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def per_request(app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(SCOPE), receive, send)
+    return (time.perf_counter() - started) / requests
+
+
+async def main(args):
+    from tracing import Tracer, TracingMiddleware, tracer
+
+    async def endpoint(scope, receive, send):
+        with tracer.span("mongo.find_one", collection="users"):
+            pass
+        with tracer.span("jwt.decode"):
+            pass
+        with tracer.span("serialize"):
+            body = b"{}"
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+    bare = await per_request(endpoint, args.requests)
+    print(f"{'bare ASGI app':<28} {bare * 1e6:8.2f} us/request")
+    for name, instance in (
+        ("tracing disabled", Tracer(None)),
+        ("not sampled", Tracer(DiscardExporter(), sample_rate=0.0)),
+        ("every request sampled", Tracer(DiscardExporter(), sample_rate=1.0)),
+    ):
+        cost = await per_request(TracingMiddleware(endpoint, instance), args.requests)
+        print(f"{name:<28} {cost * 1e6:8.2f} us/request  (+{(cost - bare) * 1e6:.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,207 @@
+"""Deadlines and a circuit breaker for database calls.
+
+Every repository operation runs inside ``breaker.call(operation)`` (through
+``repository.timed``). The call gets a deadline: ``MONGO_OPERATION_TIMEOUT_MS``
+by default, or a per-operation override from ``MONGO_OPERATION_TIMEOUTS_MS``
+such as ``"insert_many=30000,bulk_write=30000"``. A call past its deadline
+raises ``DeadlineExceeded`` instead of holding the request until the
+driver gives up.
+
+The breaker counts the outcomes:
+
+- closed: calls go through. ``failure_threshold`` consecutive failures
+  (deadlines, connection errors, server-side timeouts) open it.
+- open: calls fail at once with ``CircuitOpen`` for ``reset_timeout``
+  seconds, so requests do not pile up on a database that is not
+  answering. Routes turn both errors into 503 with ``Retry-After``.
+- half-open: after ``reset_timeout`` up to ``half_open_max`` calls are let
+  through as probes. A successful probe closes the breaker; a failed one
+  opens it again.
+
+Errors the database returns deliberately (duplicate keys, validation)
+show that it is up, so they count as successes. The deadline only stops
+the request from waiting: the driver thread running the operation is
+bounded by ``MONGO_SOCKET_TIMEOUT_MS``.
+"""
+import asyncio
+import contextlib
+import logging
+import math
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from metrics import DB_CALLS_REJECTED, DB_CIRCUIT_TRANSITIONS, DB_DEADLINES_EXCEEDED
+
+logger = logging.getLogger(__name__)
+
+DB_BREAKER_ENABLED = os.environ.get('DB_BREAKER_ENABLED', 'true').lower() == 'true'
+DB_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('DB_BREAKER_FAILURE_THRESHOLD', '5'))
+DB_BREAKER_RESET_SECONDS = float(os.environ.get('DB_BREAKER_RESET_SECONDS', '10'))
+DB_BREAKER_HALF_OPEN_MAX = int(os.environ.get('DB_BREAKER_HALF_OPEN_MAX', '1'))
+MONGO_OPERATION_TIMEOUT_MS = int(os.environ.get('MONGO_OPERATION_TIMEOUT_MS', '2000'))
+MONGO_OPERATION_TIMEOUTS_MS = os.environ.get(
+    'MONGO_OPERATION_TIMEOUTS_MS', 'insert_many=30000,bulk_write=30000,delete_many=30000,update_many=30000'
+)
+
+# The 503 detail for every request that fails this way
+DATABASE_UNAVAILABLE = "Database unavailable, please retry shortly"
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class DatabaseUnavailable(Exception):
+    """The database call was not made or not finished; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(DatabaseUnavailable):
+    """Raised without calling the database while the breaker is open"""
+
+
+class DeadlineExceeded(DatabaseUnavailable):
+    """Raised when a call runs past its deadline"""
+
+
+def parse_timeouts(spec: str) -> Dict[str, float]:
+    """Seconds per operation from ``"operation=ms,..."``"""
+    timeouts = {}
+    for item in spec.split(","):
+        if item.strip():
+            operation, ms = item.split("=", 1)
+            timeouts[operation.strip()] = int(ms) / 1000.0
+    return timeouts
+
+
+def is_failure(error: BaseException) -> bool:
+    """Whether ``error`` says the database is unreachable or too slow"""
+    # Only reached once a call has failed, so the driver is loaded by then
+    from pymongo.errors import ConnectionFailure, PyMongoError
+
+    if isinstance(error, (TimeoutError, ConnectionFailure)):
+        return True
+    return isinstance(error, PyMongoError) and error.timeout
+
+
+class CircuitBreaker:
+    """Per-call deadlines plus a closed / open / half-open breaker"""
+
+    def __init__(self, name: str, failure_threshold: int = DB_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = DB_BREAKER_RESET_SECONDS, half_open_max: int = DB_BREAKER_HALF_OPEN_MAX,
+                 timeout: float = MONGO_OPERATION_TIMEOUT_MS / 1000.0,
+                 timeouts: Optional[Dict[str, float]] = None, enabled: bool = DB_BREAKER_ENABLED,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.timeout = timeout
+        self.timeouts = timeouts if timeouts is not None else parse_timeouts(MONGO_OPERATION_TIMEOUTS_MS)
+        self.enabled = enabled
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+
+    def timeout_for(self, operation: str) -> Optional[float]:
+        timeout = self.timeouts.get(operation, self.timeout)
+        return timeout if timeout > 0 else None
+
+    def retry_after(self) -> float:
+        return max(1.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def before_call(self) -> bool:
+        """Admit a call or raise ``CircuitOpen``; True if the call is a half-open probe"""
+        if not self.enabled:
+            return False
+        if self.state == OPEN:
+            if self.clock() < self.opened_at + self.reset_timeout:
+                self.reject()
+            self.transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= self.half_open_max:
+                self.reject()
+            self.probes += 1
+            return True
+        return False
+
+    def reject(self):
+        self.rejected += 1
+        DB_CALLS_REJECTED.inc()
+        raise CircuitOpen(f"Database circuit {self.name} is open", self.retry_after())
+
+    def end_probe(self):
+        # Probes admitted before a reopen may finish after the count was reset
+        self.probes = max(0, self.probes - 1)
+
+    def on_success(self, probe: bool):
+        self.failures = 0
+        if probe:
+            self.end_probe()
+            if self.state == HALF_OPEN:
+                self.transition(CLOSED)
+
+    def on_failure(self, probe: bool):
+        self.failures += 1
+        if probe:
+            self.end_probe()
+        if self.enabled and (self.state == HALF_OPEN or self.failures >= self.failure_threshold):
+            if self.state != OPEN:
+                self.transition(OPEN)
+            self.opened_at = self.clock()
+
+    def transition(self, state: str):
+        if state == OPEN:
+            logger.warning("Database circuit %s opened after %d failures; failing fast for %.0f s",
+                           self.name, self.failures, self.reset_timeout)
+        elif state == CLOSED:
+            logger.info("Database circuit %s closed", self.name)
+        self.state = state
+        if state != HALF_OPEN:
+            self.probes = 0
+        DB_CIRCUIT_TRANSITIONS.labels(state).inc()
+
+    @contextlib.asynccontextmanager
+    async def call(self, operation: str):
+        """Run the body as one database call under the breaker and its deadline"""
+        probe = self.before_call()
+        timeout = self.timeout_for(operation)
+        try:
+            async with asyncio.timeout(timeout):
+                yield
+        except TimeoutError as e:
+            self.on_failure(probe)
+            if timeout is None:
+                raise
+            DB_DEADLINES_EXCEEDED.labels(operation).inc()
+            raise DeadlineExceeded(f"Database {operation} exceeded its {timeout:.1f} s deadline") from e
+        except asyncio.CancelledError:
+            # No verdict; free the probe slot
+            if probe:
+                self.end_probe()
+            raise
+        except Exception as e:
+            if is_failure(e):
+                self.on_failure(probe)
+            else:
+                self.on_success(probe)
+            raise
+        else:
+            self.on_success(probe)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+            "retry_after": math.ceil(self.retry_after()) if self.state == OPEN else None,
+        }
+
+
+breaker = CircuitBreaker("mongo")
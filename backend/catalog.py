@@ -0,0 +1,67 @@
+"""Static catalog responses (services and partners).
+
+The catalog only changes between deploys, so it is read from
+``catalog.json`` once and each response body is serialized to bytes once,
+together with a strong ETag. Requests whose ``If-None-Match`` matches get a
+304 without any JSON encoding.
+"""
+import hashlib
+import json
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+
+CATALOG_PATH = os.environ.get(
+    'CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.json')
+)
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', '300'))
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an ``If-None-Match`` header value matches ``etag`` (weak comparison)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class PrecomputedJSON:
+    """A JSON body serialized once, served with ETag and Cache-Control"""
+
+    def __init__(self, content, max_age: int = CATALOG_MAX_AGE):
+        # Same encoding as FastAPI's JSONResponse
+        self.body = json.dumps(
+            content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        self.etag = etag_for(self.body)
+        self.headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={max_age}",
+        }
+
+    def response(self, request: Request) -> Response:
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=self.headers)
+        return Response(content=self.body, media_type="application/json", headers=self.headers)
+
+
+def load_catalog(path: str = CATALOG_PATH) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+catalog = load_catalog()
+services_response = PrecomputedJSON({"services": catalog["services"]})
+partners_response = PrecomputedJSON({"partners": catalog["partners"]})
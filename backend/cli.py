@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Command line entry point for the Xgen Cloud API.
+
+``serve`` runs the API under uvicorn with one pre-forked worker per core by
+default::
+
+    python cli.py serve --workers 4 --port 8001
+
+Each worker is a fresh process that imports ``server`` and opens its own
+database client in the startup event, so no driver state is shared across a
+fork. All workers must sign tokens with the same key: ``SECRET_KEY`` is used
+when set, otherwise ``--secret-key-file`` (created on first use), otherwise
+one key is generated in the supervisor and handed to every worker.
+
+On SIGTERM uvicorn stops accepting connections and lets in-flight requests
+finish for up to ``--graceful-timeout`` seconds before the shutdown hooks
+run (which also flush buffered contact messages).
+
+``calibrate`` measures password verify latency on this host and prints the
+hashing settings that reach a target::
+
+    python cli.py calibrate --scheme bcrypt --target-ms 250
+
+``import-users`` bulk-loads users from an NDJSON file (``-`` for stdin),
+hashing on every core::
+
+    MONGO_URL=mongodb://localhost:27017 python cli.py import-users users.ndjson
+
+``contact-worker`` processes stored contact messages outside the API
+process, until SIGINT or SIGTERM::
+
+    CONTACT_WORKER_HANDLER=log python cli.py contact-worker --concurrency 8
+
+``backfill-analytics`` rebuilds the analytics rollups from the users and
+contact messages collections, optionally only from a given day on::
+
+    python cli.py backfill-analytics --since 2026-01-01
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import secrets
+import sys
+from datetime import datetime
+from typing import Optional
+
+import typer
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+cli = typer.Typer(help="Xgen Cloud API commands", no_args_is_help=True)
+
+
+@cli.callback()
+def main():
+    """Xgen Cloud API commands"""
+
+
+def default_workers() -> int:
+    return int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def resolve_loop(loop: str) -> str:
+    if loop == "auto":
+        return "uvloop" if _available("uvloop") else "asyncio"
+    return loop
+
+
+def resolve_http(http: str) -> str:
+    if http == "auto":
+        return "httptools" if _available("httptools") else "h11"
+    return http
+
+
+def shared_secret_key(secret_key_file: Optional[str]) -> str:
+    """The signing key every worker will use, exported as ``SECRET_KEY``"""
+    key = os.environ.get("SECRET_KEY")
+    if not key and secret_key_file:
+        if os.path.exists(secret_key_file):
+            with open(secret_key_file) as f:
+                key = f.read().strip()
+        else:
+            key = secrets.token_urlsafe(32)
+            fd = os.open(secret_key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(key + "\n")
+    if not key:
+        key = secrets.token_urlsafe(32)
+        logger.warning(
+            "SECRET_KEY is not set; generated a key for this run only. "
+            "Issued tokens will stop validating after a restart."
+        )
+    os.environ["SECRET_KEY"] = key
+    return key
+
+
+@cli.command()
+def serve(
+    host: str = typer.Option("0.0.0.0", help="Bind address"),
+    port: int = typer.Option(8001, help="Bind port"),
+    workers: int = typer.Option(default_workers(), help="Worker processes (default: CPU count)"),
+    loop: str = typer.Option("auto", help="Event loop: auto, uvloop or asyncio"),
+    http: str = typer.Option("auto", help="HTTP parser: auto, httptools or h11"),
+    backlog: int = typer.Option(2048, help="Listen socket backlog"),
+    limit_concurrency: Optional[int] = typer.Option(
+        None, help="Per-worker connection limit before answering 503"
+    ),
+    keep_alive: int = typer.Option(5, help="Keep-alive timeout in seconds"),
+    graceful_timeout: int = typer.Option(30, help="Seconds to drain in-flight requests on SIGTERM"),
+    secret_key_file: Optional[str] = typer.Option(
+        os.environ.get("SECRET_KEY_FILE"), help="File holding the shared JWT signing key"
+    ),
+    proxy_headers: bool = typer.Option(True, help="Trust X-Forwarded-* from the proxy"),
+    log_level: str = typer.Option("info"),
+):
+    """Serve the API with multiple workers"""
+    import uvicorn
+
+    logging.basicConfig(level=log_level.upper())
+    shared_secret_key(secret_key_file)
+    loop = resolve_loop(loop)
+    http = resolve_http(http)
+    logger.info("Starting %d worker(s) on %s:%d (loop=%s, http=%s)", workers, host, port, loop, http)
+    uvicorn.run(
+        "server:app",
+        app_dir=BACKEND_DIR,
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=backlog,
+        limit_concurrency=limit_concurrency,
+        timeout_keep_alive=keep_alive,
+        timeout_graceful_shutdown=graceful_timeout,
+        proxy_headers=proxy_headers,
+        log_level=log_level,
+    )
+
+
+@cli.command()
+def calibrate(
+    scheme: str = typer.Option("bcrypt", help="Scheme to calibrate: bcrypt or argon2"),
+    target_ms: float = typer.Option(250.0, help="Target verify latency in milliseconds"),
+    memory_kib: int = typer.Option(65536, help="argon2 memory cost in KiB"),
+    parallelism: int = typer.Option(4, help="argon2 parallelism"),
+    samples: int = typer.Option(3, help="Verifications timed per candidate cost"),
+):
+    """Pick password hashing parameters for a target verify latency"""
+    import hashing
+
+    target = target_ms / 1000
+    if scheme == "bcrypt":
+        candidates = hashing.calibrate_bcrypt(target, samples)
+    elif scheme == "argon2":
+        if not _available("argon2"):
+            raise typer.BadParameter("argon2 needs the argon2-cffi package", param_hint="--scheme")
+        candidates = hashing.calibrate_argon2(target, memory_kib, parallelism, samples)
+    else:
+        raise typer.BadParameter(f"unknown scheme {scheme!r}", param_hint="--scheme")
+
+    cost = seconds = None
+    for cost, seconds in candidates:
+        typer.echo(f"  cost {cost:>3}: {seconds * 1000:8.1f} ms")
+    if seconds < target:
+        typer.echo(f"Could not reach {target_ms:.0f} ms; using the highest cost tried", err=True)
+
+    typer.echo(f"\nVerify takes {seconds * 1000:.1f} ms at cost {cost}. Settings:")
+    if scheme == "bcrypt":
+        typer.echo(f"PASSWORD_SCHEMES=bcrypt\nBCRYPT_ROUNDS={cost}")
+    else:
+        typer.echo(
+            f"PASSWORD_SCHEMES=argon2,bcrypt\nARGON2_TIME_COST={cost}\n"
+            f"ARGON2_MEMORY_COST={memory_kib}\nARGON2_PARALLELISM={parallelism}"
+        )
+
+
+async def _read_chunks(path: str, size: int = 1 << 16):
+    f = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+@cli.command("import-users")
+def import_users(
+    path: str = typer.Argument(..., help="NDJSON file of {name, email, password} rows, or - for stdin"),
+    chunk_size: int = typer.Option(1000, help="Rows hashed and inserted per batch"),
+    workers: int = typer.Option(os.cpu_count() or 1, help="Hashing processes"),
+    mongo_url: str = typer.Option(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"), help="Database URL"),
+    db_name: str = typer.Option("xgen_cloud", help="Database name"),
+    report: Optional[str] = typer.Option(None, help="Write the full JSON report to this file"),
+):
+    """Bulk import users from NDJSON"""
+    from indexes import MONGO_CREATE_INDEXES, ensure_indexes
+    from repository import DataLayer
+    from user_import import UserImporter
+
+    async def run():
+        data = DataLayer(mongo_url, db_name)
+        await data.connect()
+        if MONGO_CREATE_INDEXES:
+            # The unique email index is what turns duplicates into per-row errors
+            await ensure_indexes(data.db)
+        importer = UserImporter(data.users, chunk_size=chunk_size, workers=workers)
+        try:
+            return await importer.run(_read_chunks(path))
+        finally:
+            importer.shutdown()
+            await data.close()
+
+    result = asyncio.run(run()).as_dict()
+    for error in result["errors"][:20]:
+        typer.echo(f"line {error['line']}: {error['error']}", err=True)
+    typer.echo(
+        f"{result['rows']} rows: {result['inserted']} inserted, {result['duplicates']} duplicates, "
+        f"{result['invalid']} invalid, {result['failed']} failed in {result['seconds']:.1f} s "
+        f"({result['rows_per_second']:.0f} rows/s; hashing {result['hash_seconds']:.1f} s, "
+        f"inserts {result['insert_seconds']:.1f} s)"
+    )
+    if report:
+        with open(report, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+@cli.command("contact-worker")
+def contact_worker(
+    concurrency: int = typer.Option(int(os.environ.get("CONTACT_WORKER_CONCURRENCY", "4")),
+                                    help="Messages processed at once"),
+    handler: str = typer.Option(os.environ.get("CONTACT_WORKER_HANDLER", "log"), help="Registered handler name"),
+    mongo_url: str = typer.Option(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"), help="Database URL"),
+    db_name: str = typer.Option("xgen_cloud", help="Database name"),
+):
+    """Process new contact messages in the background"""
+    import signal
+
+    from contact_worker import ContactProcessor, get_handler
+    from repository import DataLayer
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def run():
+        data = DataLayer(mongo_url, db_name)
+        await data.connect()
+        processor = ContactProcessor(lambda: data.contact_messages, get_handler(handler), concurrency=concurrency)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await processor.start()
+        logger.info("Contact worker %s running with %d workers", processor.owner, concurrency)
+        try:
+            await stop.wait()
+        finally:
+            await processor.stop()
+            await data.close()
+        return processor.stats()
+
+    stats = asyncio.run(run())
+    typer.echo(f"{stats['done']} done, {stats['retried']} retried, {stats['failed']} failed, "
+               f"{stats['recovered']} recovered")
+
+
+@cli.command("backfill-analytics")
+def backfill_analytics(
+    since: Optional[datetime] = typer.Option(None, help="Rebuild from this day on (default: everything)"),
+    mongo_url: str = typer.Option(os.environ.get("MONGO_URL", "mongodb://localhost:27017/"), help="Database URL"),
+    db_name: str = typer.Option("xgen_cloud", help="Database name"),
+):
+    """Rebuild the analytics rollups from the raw collections"""
+    from analytics import backfill
+    from indexes import MONGO_CREATE_INDEXES, ensure_indexes
+    from repository import DataLayer
+
+    async def run():
+        data = DataLayer(mongo_url, db_name)
+        await data.connect()
+        try:
+            if MONGO_CREATE_INDEXES:
+                await ensure_indexes(data.db)
+            return await backfill(data, since)
+        finally:
+            await data.close()
+
+    events = asyncio.run(run())
+    typer.echo(", ".join(f"{count} {metric}" for metric, count in events.items()) or "Nothing to count")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,264 @@
+"""Negotiated response compression.
+
+``CompressionMiddleware`` encodes responses with the best encoding the client
+accepts: brotli or zstd when the ``brotli``/``zstandard`` packages are
+installed, gzip otherwise. It skips:
+
+- bodies smaller than ``min_size``
+- content types in ``skip_types``, which are already compressed
+- responses that already have a ``Content-Encoding``
+- HEAD requests and bodiless statuses
+
+Streaming responses (the contact message export) are compressed chunk by
+chunk, with a flush after each chunk so clients still receive data
+incrementally.
+
+Complete bodies that carry a strong ETag are identical whenever the ETag is,
+so their compressed form is cached per (ETag, encoding). Compressed
+responses get a weak ETag, because the bytes differ from the identity
+representation. A 304 to a client that negotiated an encoding stands for
+the compressed response, so its ETag is weakened the same way.
+"""
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from cache import TTLCache
+from metrics import COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '500'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', '3'))
+COMPRESSION_CACHE_SIZE = int(os.environ.get('COMPRESSION_CACHE_SIZE', '256'))
+COMPRESSION_SKIP_TYPES = [t.strip() for t in os.environ.get(
+    'COMPRESSION_SKIP_TYPES',
+    'image/,video/,audio/,font/woff,application/zip,application/gzip,application/x-gzip,'
+    'application/zstd,application/x-brotli,application/pdf,application/octet-stream',
+).split(',') if t.strip()]
+
+# Bodies larger than this are compressed on every request instead of cached
+MAX_CACHED_BODY = 64 * 1024
+
+
+# Encoders: compress() then flush() per streamed chunk, finish() at the end
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int = COMPRESSION_BROTLI_QUALITY):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level: int = COMPRESSION_ZSTD_LEVEL):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush()
+
+
+def available_encoders() -> Dict[str, type]:
+    """Installed encoders by content-coding, in server preference order"""
+    encoders = {}
+    if brotli is not None:
+        encoders["br"] = BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = ZstdEncoder
+    encoders["gzip"] = GzipEncoder
+    return encoders
+
+
+def negotiate(accept_encoding: str, encoders: Iterable[str]) -> Optional[str]:
+    """The encoding to use for ``accept_encoding``, or None for identity.
+
+    The client's q-values decide; ties go to the order of ``encoders``.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding] = q
+    best, best_q = None, 0.0
+    for coding in encoders:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _header(headers: List, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the negotiated encoding"""
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE,
+                 skip_types: Iterable[str] = COMPRESSION_SKIP_TYPES,
+                 encoders: Optional[Dict[str, type]] = None, cache_size: int = COMPRESSION_CACHE_SIZE,
+                 enabled: bool = COMPRESSION_ENABLED):
+        self.app = app
+        self.min_size = min_size
+        self.skip_types = tuple(skip_types)
+        self.encoders = encoders if encoders is not None else available_encoders()
+        self.cache = TTLCache(cache_size, ttl=3600)
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept = _header(scope["headers"], b"accept-encoding")
+        coding = negotiate(accept.decode("latin-1"), self.encoders) if accept else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] == 304:
+                    passthrough = True
+                    await send({**message, "headers": self.representation_headers(message["headers"])})
+                elif not self.compressible(message):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None and not more_body:
+                # Complete body in one message
+                if len(body) < self.min_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressed = self.compress_body(body, coding, _header(start["headers"], b"etag"))
+                await send(self.encoded_start(start, coding, len(compressed)))
+                await send({"type": "http.response.body", "body": compressed})
+                return
+
+            if encoder is None:
+                encoder = self.encoders[coding]()
+                await send(self.encoded_start(start, coding, None))
+            chunk = encoder.compress(body) + (encoder.flush() if more_body else encoder.finish())
+            COMPRESSION_BYTES.labels(coding, "original").inc(len(body))
+            COMPRESSION_BYTES.labels(coding, "compressed").inc(len(chunk))
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def compressible(self, start) -> bool:
+        if start["status"] < 200 or start["status"] in (204, 304):
+            return False
+        headers = start.get("headers", [])
+        if _header(headers, b"content-encoding") is not None:
+            return False
+        content_type = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+        return not content_type.startswith(self.skip_types)
+
+    def compress_body(self, body: bytes, coding: str, etag: Optional[bytes]) -> bytes:
+        key = (etag, coding) if etag and not etag.startswith(b"W/") and len(body) <= MAX_CACHED_BODY else None
+        compressed = self.cache.get(key) if key else None
+        if compressed is None:
+            encoder = self.encoders[coding]()
+            compressed = encoder.compress(body) + encoder.finish()
+            if key:
+                self.cache.set(key, compressed)
+        COMPRESSION_BYTES.labels(coding, "original").inc(len(body))
+        COMPRESSION_BYTES.labels(coding, "compressed").inc(len(compressed))
+        return compressed
+
+    @staticmethod
+    def representation_headers(start_headers) -> List:
+        """``start_headers`` for the encoded representation: weak ETag, Vary, no Content-Length"""
+        headers = []
+        vary = None
+        for key, value in start_headers:
+            name = key.lower()
+            if name == b"content-length":
+                continue
+            if name == b"vary":
+                vary = value
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                value = b"W/" + value
+            headers.append((key, value))
+        headers.append((b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding"))
+        return headers
+
+    @classmethod
+    def encoded_start(cls, start, coding: str, length: Optional[int]):
+        headers = cls.representation_headers(start["headers"])
+        headers.append((b"content-encoding", coding.encode()))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode()))
+        return {**start, "headers": headers}
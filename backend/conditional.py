@@ -0,0 +1,96 @@
+"""Conditional GET for the cacheable public routes.
+
+``ConditionalGetMiddleware`` gives complete 200 responses to GET requests on
+``paths`` an ETag, computed from the body unless the route already set
+one. When the request's ``If-None-Match`` matches, it answers 304 without
+a body. The route still runs, so the saving is bandwidth and client-side
+parsing, not server work; routes that can avoid the work (the catalog)
+check ``If-None-Match`` themselves.
+
+Only routes whose responses are the same for every caller and change
+rarely are listed: hashing per-user, admin, probe or metrics responses
+costs a SHA-256 per request for validators no client reuses. Streaming
+responses and responses marked ``Cache-Control: no-store`` are passed
+through untouched.
+"""
+import os
+from typing import Iterable
+
+from catalog import etag_for, etag_matches
+
+CONDITIONAL_GET_ENABLED = os.environ.get('CONDITIONAL_GET_ENABLED', 'true').lower() == 'true'
+CONDITIONAL_GET_PATHS = [p.strip() for p in os.environ.get(
+    'CONDITIONAL_GET_PATHS', '/,/api/services,/api/partners'
+).split(',') if p.strip()]
+
+# Headers a 304 keeps from the full response (RFC 9110, section 15.4.5)
+NOT_MODIFIED_HEADERS = (b"cache-control", b"content-location", b"date", b"etag", b"expires", b"vary")
+
+
+class ConditionalGetMiddleware:
+    """ASGI middleware adding ETags to GET responses on ``paths`` and answering If-None-Match"""
+
+    def __init__(self, app, paths: Iterable[str] = CONDITIONAL_GET_PATHS, enabled: bool = CONDITIONAL_GET_ENABLED):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["method"] != "GET"
+                or scope["path"] not in self.paths):
+            await self.app(scope, receive, send)
+            return
+        if_none_match = None
+        for name, value in scope["headers"]:
+            if name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] != 200 or self.no_store(message["headers"]):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if message.get("more_body", False):
+                # Streaming: the full body, and so its ETag, is not known up front
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers = list(start["headers"])
+            etag = next((value for name, value in headers if name.lower() == b"etag"), None)
+            if etag is None:
+                etag = etag_for(message.get("body", b"")).encode()
+                headers.append((b"etag", etag))
+            if etag_matches(if_none_match, etag.decode("latin-1")):
+                await send({
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [(name, value) for name, value in headers if name.lower() in NOT_MODIFIED_HEADERS],
+                })
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({**start, "headers": headers})
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def no_store(headers) -> bool:
+        for name, value in headers:
+            if name.lower() == b"cache-control" and b"no-store" in value.lower():
+                return True
+        return False
@@ -0,0 +1,249 @@
+"""Background processing of contact messages.
+
+``submit_contact_message`` stores messages with status ``new`` and returns.
+``ContactProcessor`` runs ``concurrency`` worker tasks that move them
+along::
+
+    new -> processing -> done
+                      -> new (retry after a backoff) -> ... -> failed
+
+A worker claims one message at a time with ``find_one_and_update``, which
+sets ``status: processing``, a ``lease_owner`` and a ``lease_until``
+deadline and counts the attempt. Only one worker, in any process, can win a
+given message. The follow-up work itself (notifications, CRM sync, ...)
+is the ``handler``, an async callable taking the public message fields.
+Handlers are registered by name with ``register_handler`` and picked with
+``CONTACT_WORKER_HANDLER``.
+
+A handler that raises or exceeds ``timeout`` is retried after an
+exponential, jittered backoff (``next_attempt_at``) until ``max_attempts``,
+then marked ``failed`` with the last error. If a worker dies mid-message,
+or cannot record the outcome because the database is down, its lease runs
+out and the periodic recovery pass puts the message back to ``new``, or
+``failed`` once it has used up its attempts. Handlers should be
+idempotent: a message can run twice if a lease expires while its handler
+is still going.
+
+Workers run in the API process when ``CONTACT_WORKERS_ENABLED`` is set, or
+standalone with ``python cli.py contact-worker``.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import CONTACT_MESSAGES_PROCESSED, CONTACT_PROCESSING_LATENCY
+
+logger = logging.getLogger(__name__)
+
+CONTACT_WORKERS_ENABLED = os.environ.get('CONTACT_WORKERS_ENABLED', 'false').lower() == 'true'
+CONTACT_WORKER_HANDLER = os.environ.get('CONTACT_WORKER_HANDLER', 'log')
+CONTACT_WORKER_CONCURRENCY = int(os.environ.get('CONTACT_WORKER_CONCURRENCY', '4'))
+CONTACT_WORKER_TIMEOUT_SECONDS = float(os.environ.get('CONTACT_WORKER_TIMEOUT_SECONDS', '30'))
+CONTACT_WORKER_LEASE_SECONDS = float(os.environ.get('CONTACT_WORKER_LEASE_SECONDS', '120'))
+CONTACT_WORKER_MAX_ATTEMPTS = int(os.environ.get('CONTACT_WORKER_MAX_ATTEMPTS', '5'))
+CONTACT_WORKER_BACKOFF_SECONDS = float(os.environ.get('CONTACT_WORKER_BACKOFF_SECONDS', '5'))
+CONTACT_WORKER_MAX_BACKOFF_SECONDS = float(os.environ.get('CONTACT_WORKER_MAX_BACKOFF_SECONDS', '600'))
+CONTACT_WORKER_POLL_SECONDS = float(os.environ.get('CONTACT_WORKER_POLL_SECONDS', '1'))
+CONTACT_WORKER_RECOVER_SECONDS = float(os.environ.get('CONTACT_WORKER_RECOVER_SECONDS', '30'))
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+async def log_message(message: dict):
+    """Default handler: record that the message was picked up"""
+    logger.info("Contact message %s from %s processed", message["id"], message["email"])
+
+
+HANDLERS: Dict[str, Handler] = {"log": log_message}
+
+
+def register_handler(name: str, handler: Handler):
+    """Make ``handler`` selectable with ``CONTACT_WORKER_HANDLER=name``"""
+    HANDLERS[name] = handler
+
+
+def get_handler(name: str = CONTACT_WORKER_HANDLER) -> Handler:
+    handler = HANDLERS.get(name)
+    if handler is None:
+        raise ValueError(f"Unknown contact worker handler: {name}")
+    return handler
+
+
+class ContactProcessor:
+    """Claims ``new`` messages from ``repository_getter()`` and runs ``handler`` on them"""
+
+    def __init__(self, repository_getter, handler: Optional[Handler] = None,
+                 concurrency: int = CONTACT_WORKER_CONCURRENCY, timeout: float = CONTACT_WORKER_TIMEOUT_SECONDS,
+                 lease: float = CONTACT_WORKER_LEASE_SECONDS, max_attempts: int = CONTACT_WORKER_MAX_ATTEMPTS,
+                 backoff: float = CONTACT_WORKER_BACKOFF_SECONDS,
+                 max_backoff: float = CONTACT_WORKER_MAX_BACKOFF_SECONDS,
+                 poll_interval: float = CONTACT_WORKER_POLL_SECONDS,
+                 recover_interval: float = CONTACT_WORKER_RECOVER_SECONDS,
+                 listeners: Optional[List[Callable[[str, int], None]]] = None):
+        if lease <= timeout:
+            raise ValueError("The lease must be longer than the handler timeout")
+        self.repository_getter = repository_getter
+        self.handler = handler or get_handler()
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.recover_interval = recover_interval
+        # Called with (outcome, count) for done, retried and failed messages
+        self.listeners = listeners if listeners is not None else []
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.in_flight = 0
+        self.counts = {"done": 0, "retried": 0, "failed": 0, "recovered": 0}
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def notify(self):
+        """Wake idle workers, e.g. right after a message was stored"""
+        self._wakeup.set()
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._stopped.clear()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._recover_loop()))
+
+    async def stop(self, drain: float = 10.0):
+        """Let running handlers finish for up to ``drain`` seconds, then cancel them"""
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._stopped.set()
+        self._wakeup.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=drain)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                message = await self.repository_getter().claim(
+                    self.owner, datetime.utcnow(), datetime.utcnow() + self.lease
+                )
+            except Exception as e:
+                logger.error("Could not claim a contact message: %s", e)
+                message = None
+            if message is not None:
+                try:
+                    await self.process(message)
+                    continue
+                except Exception as e:
+                    # Still leased to us; the recovery pass returns it once the lease runs out
+                    logger.error("Could not record the outcome of contact message %s: %s", message.get("id"), e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def process(self, message: dict):
+        """Run the handler on one claimed message and record the outcome"""
+        repository = self.repository_getter()
+        public = {field: message.get(field) for field in repository.FIELDS}
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.handler(public), self.timeout)
+        except asyncio.CancelledError:
+            # Shutting down: hand the message back without spending the attempt
+            try:
+                await asyncio.shield(repository.finish(
+                    message["_id"], self.owner, {"status": "new"}, attempts=-1
+                ))
+            except Exception as e:
+                logger.error("Could not hand back contact message %s: %s", message.get("id"), e)
+            raise
+        except Exception as e:
+            await self.retry_or_fail(message, str(e) or type(e).__name__)
+        else:
+            updated = await repository.finish(
+                message["_id"], self.owner, {"status": "done", "processed_at": datetime.utcnow()}
+            )
+            self.record("done" if updated else "lost")
+        finally:
+            self.in_flight -= 1
+            CONTACT_PROCESSING_LATENCY.observe(time.perf_counter() - started)
+
+    async def retry_or_fail(self, message: dict, error: str):
+        attempts = message.get("attempts", 1)
+        if attempts >= self.max_attempts:
+            logger.error("Contact message %s failed after %d attempts: %s", message.get("id"), attempts, error)
+            changes = {"status": "failed", "last_error": error, "failed_at": datetime.utcnow()}
+            outcome = "failed"
+        else:
+            delay = self.backoff_delay(attempts)
+            logger.warning("Contact message %s attempt %d failed, retrying in %.1f s: %s",
+                           message.get("id"), attempts, delay, error)
+            changes = {
+                "status": "new",
+                "last_error": error,
+                "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+            }
+            outcome = "retried"
+        updated = await self.repository_getter().finish(message["_id"], self.owner, changes)
+        self.record(outcome if updated else "lost")
+
+    def backoff_delay(self, attempts: int) -> float:
+        """Exponential backoff with jitter: between half and all of ``backoff * 2**(attempts - 1)``"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def record(self, outcome: str):
+        if outcome == "lost":
+            # The lease ran out mid-handler and another worker owns the message now
+            logger.warning("Lost the lease on a contact message before finishing it")
+        else:
+            self.counts[outcome] += 1
+            self.notify_listeners(outcome, 1)
+        CONTACT_MESSAGES_PROCESSED.labels(outcome).inc()
+
+    def notify_listeners(self, outcome: str, count: int):
+        for listener in self.listeners:
+            listener(outcome, count)
+
+    async def recover(self) -> int:
+        """Return messages whose lease expired to ``new`` (or ``failed``); how many were recovered"""
+        failed, retried = await self.repository_getter().recover_expired(datetime.utcnow(), self.max_attempts)
+        recovered = failed + retried
+        if failed:
+            self.counts["failed"] += failed
+            self.notify_listeners("failed", failed)
+        if recovered:
+            logger.warning("Recovered %d contact messages with expired leases", recovered)
+            self.counts["recovered"] += recovered
+            CONTACT_MESSAGES_PROCESSED.labels("recovered").inc(recovered)
+            self._wakeup.set()
+        return recovered
+
+    async def _recover_loop(self):
+        while not self._stopping:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error("Contact message lease recovery failed: %s", e)
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.recover_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {"owner": self.owner, "concurrency": self.concurrency, "in_flight": self.in_flight, **self.counts}
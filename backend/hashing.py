@@ -0,0 +1,236 @@
+"""Password hashing off the event loop.
+
+bcrypt costs 100-300 ms of CPU per call, so hashing and verification run in a
+dedicated worker pool instead of inline in the request handlers. The pool is
+bounded: once ``max_pending`` calls are queued or running, new calls are
+rejected with ``HashPoolSaturated`` straight away rather than waiting behind
+a backlog that would outlive the client's timeout.
+
+The scheme and its cost come from the environment. ``PASSWORD_SCHEMES``
+lists the accepted schemes with the one used for new hashes first; hashes in
+any other listed scheme, or made with a lower cost than configured, are
+reported by ``needs_update()`` so they can be upgraded after a successful
+login. ``cli.py calibrate`` picks a cost that meets a target verify latency
+on the current host.
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from metrics import PASSWORD_HASH_LATENCY, PASSWORD_HASH_REJECTED
+from tracing import tracer
+
+# Pool configuration
+HASH_POOL_KIND = os.environ.get('HASH_POOL_KIND', 'thread')
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', str(os.cpu_count() or 1)))
+HASH_POOL_MAX_PENDING = int(os.environ.get('HASH_POOL_MAX_PENDING', str(HASH_POOL_WORKERS * 8)))
+
+# Scheme configuration; the first scheme is used for new hashes
+PASSWORD_SCHEMES = [s.strip() for s in os.environ.get('PASSWORD_SCHEMES', 'bcrypt').split(',') if s.strip()]
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '65536'))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', '4'))
+
+
+def build_context(schemes: Optional[List[str]] = None, bcrypt_rounds: int = BCRYPT_ROUNDS,
+                  argon2_time_cost: int = ARGON2_TIME_COST, argon2_memory_cost: int = ARGON2_MEMORY_COST,
+                  argon2_parallelism: int = ARGON2_PARALLELISM) -> "CryptContext":
+    """A CryptContext hashing with ``schemes[0]`` and treating the rest as deprecated"""
+    from passlib.context import CryptContext
+
+    schemes = schemes or PASSWORD_SCHEMES
+    settings = {}
+    if "bcrypt" in schemes:
+        settings.update(bcrypt__rounds=bcrypt_rounds, bcrypt__min_rounds=bcrypt_rounds)
+    if "argon2" in schemes:
+        settings.update(
+            argon2__time_cost=argon2_time_cost,
+            argon2__memory_cost=argon2_memory_cost,
+            argon2__parallelism=argon2_parallelism,
+        )
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+_context = None
+
+
+def pwd_context() -> "CryptContext":
+    """The configured context, built on first use to keep passlib out of startup"""
+    global _context
+    if _context is None:
+        _context = build_context()
+    return _context
+
+
+class HashPoolSaturated(Exception):
+    """Raised when the hashing pool already has ``max_pending`` calls queued"""
+
+
+# Module-level so they can be pickled into a process pool
+def _hash(password: str) -> str:
+    return pwd_context().hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context().verify(password, hashed_password)
+
+
+def hash_many(passwords: List[str]) -> List[str]:
+    """Hash a batch in one call, for bulk imports running in a process pool"""
+    return [pwd_context().hash(password) for password in passwords]
+
+
+class OperationStats:
+    """Call count and latency totals for one kind of pool operation"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.queue_seconds = 0.0
+
+    def observe(self, seconds: float, queued: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.queue_seconds += queued
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": self.total_seconds / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "avg_queue_ms": self.queue_seconds / self.count * 1000 if self.count else 0.0,
+        }
+
+
+class PasswordHasher:
+    """Runs password hashing in a size-limited worker pool with admission control"""
+
+    def __init__(self, workers: int = HASH_POOL_WORKERS, max_pending: int = HASH_POOL_MAX_PENDING,
+                 kind: str = HASH_POOL_KIND):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = kind
+        self.pending = 0
+        self.rejected = 0
+        self.operations = {"hash": OperationStats(), "verify": OperationStats()}
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: the pool starts after the driver's threads, and forking
+                # a process that runs them is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify, password, hashed_password)
+
+    def needs_update(self, hashed_password: str) -> bool:
+        """Whether ``hashed_password`` uses a deprecated scheme or too low a cost.
+
+        Only parses the hash, so it is cheap enough to call on the event loop.
+        """
+        return pwd_context().needs_update(hashed_password)
+
+    async def _run(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise HashPoolSaturated(f"{self.pending} password hashing calls already pending")
+
+        self.pending += 1
+        submitted = time.perf_counter()
+        try:
+            with tracer.span(f"password.{operation}") as span:
+                loop = asyncio.get_running_loop()
+                result, dequeued = await loop.run_in_executor(self.executor, _timed_call, func, args)
+                elapsed = time.perf_counter() - submitted
+                span.set("queue_ms", round((dequeued - submitted) * 1000, 3))
+            self.operations[operation].observe(elapsed, dequeued - submitted)
+            PASSWORD_HASH_LATENCY.labels(operation).observe(elapsed)
+            return result
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "saturation": self.pending / self.max_pending if self.max_pending else 0.0,
+            "rejected": self.rejected,
+            "hash": self.operations["hash"].as_dict(),
+            "verify": self.operations["verify"].as_dict(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def _timed_call(func, args):
+    """Worker-side wrapper recording when the call left the queue"""
+    started = time.perf_counter()
+    return func(*args), started
+
+
+# Calibration
+def time_hash(context: "CryptContext", samples: int = 3) -> float:
+    """Median seconds to verify a password with ``context``'s default scheme"""
+    hashed = context.hash("calibration password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify("calibration password", hashed)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target_seconds: float, samples: int = 3, max_rounds: int = 20):
+    """Lowest bcrypt rounds whose verify takes at least ``target_seconds``.
+
+    Yields ``(rounds, seconds)`` for every cost tried; the last one is the pick.
+    """
+    for rounds in range(4, max_rounds + 1):
+        seconds = time_hash(build_context(["bcrypt"], bcrypt_rounds=rounds), samples)
+        yield rounds, seconds
+        if seconds >= target_seconds:
+            return
+
+
+def calibrate_argon2(target_seconds: float, memory_cost: int = ARGON2_MEMORY_COST,
+                     parallelism: int = ARGON2_PARALLELISM, samples: int = 3, max_time_cost: int = 50):
+    """Lowest argon2 time cost at ``memory_cost`` KiB whose verify takes at least ``target_seconds``.
+
+    Yields ``(time_cost, seconds)`` for every cost tried; the last one is the pick.
+    """
+    for time_cost in range(1, max_time_cost + 1):
+        context = build_context(
+            ["argon2"], argon2_time_cost=time_cost,
+            argon2_memory_cost=memory_cost, argon2_parallelism=parallelism,
+        )
+        seconds = time_hash(context, samples)
+        yield time_cost, seconds
+        if seconds >= target_seconds:
+            return
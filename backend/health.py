@@ -0,0 +1,171 @@
+"""Liveness and readiness state for the probe endpoints.
+
+``/livez`` only proves the event loop answers, so it does no I/O at all.
+``/readyz`` serves the result of a ``HealthChecker`` that pings Mongo in the
+background every ``interval`` seconds. Probes never wait on the database,
+and the database sees one ping per interval per process no matter how often
+the probes run.
+
+Readiness also looks at the process itself: the worker reports not ready
+while the event loop is lagging (some callback is blocking it) or the
+password hash pool has too many calls queued. The load balancer can then
+route around it until it recovers.
+"""
+import asyncio
+import collections
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.environ.get('HEALTH_CHECK_INTERVAL_SECONDS', '5'))
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_CHECK_TIMEOUT_SECONDS', '2'))
+READY_MAX_LOOP_LAG_MS = float(os.environ.get('READY_MAX_LOOP_LAG_MS', '500'))
+READY_MAX_HASH_PENDING = os.environ.get('READY_MAX_HASH_PENDING')  # default: the pool's max_pending
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping ``interval`` seconds.
+
+    ``max_lag`` is the worst lag over the last ``window`` samples, so one long
+    blocking callback stays visible for a few seconds after it ends. ``due``
+    is when the current sleep should end; ``profiling.LoopWatchdog`` reads it
+    from another thread to catch a callback while it is still blocking.
+    """
+
+    def __init__(self, interval: float = 0.25, window: int = 8):
+        self.interval = interval
+        self.lag = 0.0
+        self.samples = collections.deque(maxlen=window)
+        self.due: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def max_lag(self) -> float:
+        return max(self.samples, default=0.0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.due = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            self.due = started + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(self.lag)
+
+
+class HealthChecker:
+    """Pings the database in the background and combines the result with process checks.
+
+    ``hash_pending`` returns the current hash pool queue depth.
+    """
+
+    def __init__(self, ping: Callable[[], Awaitable], hash_pending: Callable[[], int], max_hash_pending: int,
+                 interval: float = HEALTH_CHECK_INTERVAL_SECONDS, timeout: float = HEALTH_CHECK_TIMEOUT_SECONDS,
+                 max_loop_lag: float = READY_MAX_LOOP_LAG_MS / 1000, loop_monitor: Optional[LoopLagMonitor] = None):
+        self.ping = ping
+        self.hash_pending = hash_pending
+        self.max_hash_pending = max_hash_pending
+        self.interval = interval
+        self.timeout = timeout
+        self.max_loop_lag = max_loop_lag
+        self.loop_monitor = loop_monitor or LoopLagMonitor()
+        self.database_ok = False
+        self.database_error: Optional[str] = None
+        self.database_latency = 0.0
+        self.checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = asyncio.Event()
+
+    async def start(self):
+        """Start checking in the background; not ready until the first check passes"""
+        self.loop_monitor.start()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after the check in progress, if any; cancel it only if it overruns its timeout.
+
+        Not a plain cancel: ``asyncio.wait_for`` in ``check`` can swallow a
+        cancellation that lands as the ping completes, leaving the task running.
+        """
+        if self._task is not None:
+            self._stopped.set()
+            _, pending = await asyncio.wait({self._task}, timeout=self.timeout + 1)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self._task = None
+        await self.loop_monitor.stop()
+
+    async def _run(self):
+        while not self._stopped.is_set():
+            await self.check()
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def check(self):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.ping(), self.timeout)
+        except Exception as e:
+            if self.database_ok:
+                logger.warning("Database health check failed: %s", e or type(e).__name__)
+            self.database_ok = False
+            self.database_error = str(e) or type(e).__name__
+        else:
+            if not self.database_ok and self.checked_at is not None:
+                logger.info("Database health check recovered")
+            self.database_ok = True
+            self.database_error = None
+        self.database_latency = time.perf_counter() - started
+        self.checked_at = time.time()
+
+    def database_fresh(self) -> bool:
+        """Whether the last database check is recent and succeeded"""
+        return (
+            self.database_ok and self.checked_at is not None
+            and time.time() - self.checked_at <= self.interval * 3 + self.timeout
+        )
+
+    def readiness(self) -> Dict[str, object]:
+        """The cached readiness report; ``ready`` is False if any check fails"""
+        loop_lag = self.loop_monitor.max_lag
+        hash_pending = self.hash_pending()
+        checks = {
+            "database": self.database_fresh(),
+            "loop_lag": loop_lag < self.max_loop_lag,
+            "hash_pool": hash_pending < self.max_hash_pending,
+        }
+        return {
+            "ready": all(checks.values()),
+            "checks": checks,
+            "database": {
+                "ok": self.database_ok,
+                "error": self.database_error,
+                "latency_ms": self.database_latency * 1000,
+                "checked_seconds_ago": time.time() - self.checked_at if self.checked_at else None,
+            },
+            "loop_lag_ms": self.loop_monitor.lag * 1000,
+            "loop_lag_max_ms": loop_lag * 1000,
+            "max_loop_lag_ms": self.max_loop_lag * 1000,
+            "hash_pending": hash_pending,
+            "max_hash_pending": self.max_hash_pending,
+        }
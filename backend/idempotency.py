@@ -0,0 +1,360 @@
+"""Idempotency keys for retried POST requests.
+
+Clients on flaky networks retry ``POST /api/register`` and ``POST
+/api/contact`` when they do not see a response. If the request carries an
+``Idempotency-Key`` header, ``IdempotencyMiddleware`` runs it once and
+stores the response (status, headers and body bytes). A retry with the same
+key then gets those bytes back, marked ``Idempotent-Replayed: true``,
+without hashing a password or inserting another document.
+
+A key is reserved before the route runs. A duplicate that arrives while the
+first request is still running waits for it: in the same process on a
+future, across processes by polling the shared store. A duplicate that
+waits longer than ``wait`` gets 409 with ``Retry-After``. Reusing a key
+with a different request body is a client error (422).
+
+Keys are scoped to the route and the caller (the ``Authorization``
+header, or the client IP for anonymous requests), so two callers sending
+the same key never see each other's responses.
+
+Only responses below 500 are stored. After a 5xx, an exception or a
+client disconnect the reservation is released, so the retry does the work
+again. Reservations also expire after ``lock_seconds`` in case the process
+holding one dies.
+
+Responses carrying an access or refresh token are never stored: refresh
+tokens are only kept as HMACs, and a replay could hand back one that was
+already rotated. Their record holds a 409 saying the request completed,
+and the client signs in for fresh tokens.
+
+``MemoryStore`` keeps records per process, bounded by ``max_keys``.
+``MongoStore`` shares them between workers in the ``idempotency_keys``
+collection, where a TTL index removes them once ``expires_at`` has passed.
+Records only need to outlive the client's retries, so the TTL is minutes.
+"""
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from breaker import DATABASE_UNAVAILABLE
+from cache import TTLCache
+from metrics import IDEMPOTENT_REQUESTS
+from repository import is_duplicate_key
+from request_body import client_ip, read_body, replay_body
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'mongo')
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_TRUST_FORWARDED = os.environ.get(
+    'IDEMPOTENCY_TRUST_FORWARDED', os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false')
+).lower() == 'true'
+
+MAX_KEY_LENGTH = 255
+# Larger responses are passed through but not stored
+MAX_STORED_BODY = 64 * 1024
+# Response fields that must not be written to the store
+TOKEN_FIELDS = ("access_token", "refresh_token")
+
+
+class IdempotencyStore(abc.ABC):
+    """Storage for idempotency records.
+
+    A record is a dict with the request ``fingerprint`` and ``complete``;
+    complete records also hold the response ``status``, ``headers`` and
+    ``body``. ``reserve`` must be atomic when several processes share the
+    store: exactly one caller gets None for a free key.
+    """
+
+    @abc.abstractmethod
+    async def reserve(self, key: str, fingerprint: str) -> Optional[dict]:
+        """Reserve ``key`` and return None, or return the record already holding it"""
+
+    @abc.abstractmethod
+    async def complete(self, key: str, record: dict):
+        """Store the finished ``record`` for ``key``"""
+
+    @abc.abstractmethod
+    async def release(self, key: str):
+        """Drop the reservation on ``key`` if it has not completed"""
+
+
+class MemoryStore(IdempotencyStore):
+    """Per-process records; the least recently used are evicted beyond ``max_keys``"""
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS, ttl: float = IDEMPOTENCY_TTL_SECONDS,
+                 lock_seconds: float = IDEMPOTENCY_LOCK_SECONDS):
+        self.records = TTLCache(max_keys, ttl)
+        self.lock_seconds = lock_seconds
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[dict]:
+        record = self.records.get(key)
+        if record is not None:
+            return record
+        self.records.set(key, {"fingerprint": fingerprint, "complete": False}, ttl=self.lock_seconds)
+        return None
+
+    async def complete(self, key: str, record: dict):
+        self.records.set(key, record)
+
+    async def release(self, key: str):
+        record = self.records.get(key)
+        if record is not None and not record["complete"]:
+            self.records.invalidate(key)
+
+
+class MongoStore(IdempotencyStore):
+    """Records shared by all workers, through ``repository_getter()``"""
+
+    def __init__(self, repository_getter, ttl: float = IDEMPOTENCY_TTL_SECONDS,
+                 lock_seconds: float = IDEMPOTENCY_LOCK_SECONDS):
+        self.repository_getter = repository_getter
+        self.ttl = timedelta(seconds=ttl)
+        self.lock = timedelta(seconds=lock_seconds)
+
+    async def reserve(self, key: str, fingerprint: str) -> Optional[dict]:
+        repository = self.repository_getter()
+        now = datetime.utcnow()
+        document = {
+            "key": key,
+            "fingerprint": fingerprint,
+            "complete": False,
+            "locked_until": now + self.lock,
+            "expires_at": now + self.ttl,
+        }
+        for _ in range(2):
+            try:
+                await repository.insert(dict(document))
+                return None
+            except Exception as e:
+                if not is_duplicate_key(e):
+                    raise
+            # A pending record past its lock belongs to a request that died
+            if await repository.take_over(key, now, document):
+                return None
+            existing = await repository.find(key)
+            if existing is not None:
+                return self.from_document(existing)
+            # Released between the insert and the find; try again
+        return {"fingerprint": fingerprint, "complete": False}
+
+    async def complete(self, key: str, record: dict):
+        await self.repository_getter().complete(key, {
+            "status": record["status"],
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in record["headers"]],
+            "body": record["body"],
+            "expires_at": datetime.utcnow() + self.ttl,
+        })
+
+    async def release(self, key: str):
+        await self.repository_getter().release(key)
+
+    @staticmethod
+    def from_document(document: dict) -> dict:
+        record = {"fingerprint": document["fingerprint"], "complete": document["complete"]}
+        if document["complete"]:
+            record.update(
+                status=document["status"],
+                headers=[(name.encode("latin-1"), value.encode("latin-1")) for name, value in document["headers"]],
+                body=bytes(document["body"]),
+            )
+        return record
+
+
+def fingerprint_for(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(b"%s %s\n%s" % (method.encode(), path.encode(), body)).hexdigest()
+
+
+def carries_tokens(body: bytes) -> bool:
+    """True for a JSON object body with a non-empty ``TOKEN_FIELDS`` entry"""
+    if not any(b'"%s"' % field.encode() in body for field in TOKEN_FIELDS):
+        return False
+    try:
+        document = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(document, dict) and any(document.get(field) for field in TOKEN_FIELDS)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware honouring ``Idempotency-Key`` on selected POST routes"""
+
+    def __init__(self, app, store: IdempotencyStore, paths: Iterable[str] = ("/api/register", "/api/contact"),
+                 wait: float = IDEMPOTENCY_WAIT_SECONDS, trust_forwarded: bool = IDEMPOTENCY_TRUST_FORWARDED,
+                 enabled: bool = IDEMPOTENCY_ENABLED):
+        self.app = app
+        self.store = store
+        self.paths = frozenset(paths)
+        self.wait = wait
+        self.trust_forwarded = trust_forwarded
+        self.enabled = enabled
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in self.paths):
+            await self.app(scope, receive, send)
+            return
+        raw_key = next((value for name, value in scope["headers"] if name == b"idempotency-key"), None)
+        if raw_key is None:
+            await self.app(scope, receive, send)
+            return
+        raw_key = raw_key.decode("latin-1").strip()
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            IDEMPOTENT_REQUESTS.labels("invalid").inc()
+            await self.respond(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+
+        body = await read_body(receive)
+        key = f"{scope['path']}:{self.caller(scope)}:{raw_key}"
+        fingerprint = fingerprint_for(scope["method"], scope["path"], body)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait
+        delay = 0.05
+        while True:
+            future = self.inflight.get(key)
+            if future is not None:
+                # The first request is running in this process
+                try:
+                    record = await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    record = {"fingerprint": fingerprint, "complete": False}
+                if record is None:
+                    continue  # it failed and released the key; run this one
+            else:
+                try:
+                    record = await self.store.reserve(key, fingerprint)
+                except Exception as e:
+                    # Without a reservation a retry could run twice; let the client retry later
+                    logger.warning("Idempotency store unavailable: %s", e)
+                    await self.respond(send, 503, DATABASE_UNAVAILABLE,
+                                       retry_after=math.ceil(getattr(e, "retry_after", 1)))
+                    return
+                if record is None:
+                    break
+            if record["fingerprint"] != fingerprint:
+                IDEMPOTENT_REQUESTS.labels("mismatch").inc()
+                await self.respond(send, 422, "Idempotency-Key was already used with a different request")
+                return
+            if record["complete"]:
+                IDEMPOTENT_REQUESTS.labels("replayed").inc()
+                await self.replay(send, record)
+                return
+            if loop.time() >= deadline:
+                IDEMPOTENT_REQUESTS.labels("conflict").inc()
+                await self.respond(send, 409, "A request with this Idempotency-Key is still in progress",
+                                   retry_after=1)
+                return
+            # Running in another process; poll the shared store until it finishes
+            await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+            delay = min(delay * 2, 0.5)
+
+        IDEMPOTENT_REQUESTS.labels("executed").inc()
+        self.inflight[key] = loop.create_future()
+        record = None
+        try:
+            record = await self.forward(scope, body, receive, send, fingerprint)
+        finally:
+            record = await self.finish(key, record)
+            self.inflight.pop(key).set_result(record)
+
+    def caller(self, scope) -> str:
+        """Who sent the request: a digest of its credentials, else the client IP"""
+        authorization = next((value for name, value in scope["headers"] if name == b"authorization"), None)
+        if authorization:
+            return "auth:" + hashlib.sha256(authorization).hexdigest()[:32]
+        return "ip:" + client_ip(scope, self.trust_forwarded)
+
+    async def forward(self, scope, body: bytes, receive, send, fingerprint: str) -> Optional[dict]:
+        """Run the route, passing its response through; the record to store, or None"""
+        start = None
+        chunks = []
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body" and size <= MAX_STORED_BODY:
+                chunk = message.get("body", b"")
+                chunks.append(chunk)
+                size += len(chunk)
+            await send(message)
+
+        await self.app(scope, replay_body(body, receive), send_wrapper)
+        if start is None or start["status"] >= 500 or size > MAX_STORED_BODY:
+            return None
+        body = b"".join(chunks)
+        if carries_tokens(body):
+            return self.completed_without_body(fingerprint)
+        return {
+            "fingerprint": fingerprint,
+            "complete": True,
+            "status": start["status"],
+            "headers": list(start.get("headers", [])),
+            "body": body,
+        }
+
+    @classmethod
+    def completed_without_body(cls, fingerprint: str) -> dict:
+        """The record kept in place of a response that carried tokens"""
+        body = cls.error_body("Request already completed; sign in to get new tokens")
+        return {
+            "fingerprint": fingerprint,
+            "complete": True,
+            "status": 409,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            "body": body,
+        }
+
+    async def finish(self, key: str, record: Optional[dict]) -> Optional[dict]:
+        """Store the record, or release the key if there is nothing to store"""
+        try:
+            if record is not None:
+                await self.store.complete(key, record)
+                return record
+            await self.store.release(key)
+        except Exception as e:
+            logger.warning("Could not %s idempotency key: %s", "store" if record else "release", e)
+            if record is not None:
+                try:
+                    await self.store.release(key)
+                except Exception:
+                    pass
+        return None
+
+    @staticmethod
+    async def replay(send, record: dict):
+        await send({
+            "type": "http.response.start",
+            "status": record["status"],
+            "headers": [*record["headers"], (b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": record["body"]})
+
+    @staticmethod
+    def error_body(detail: str) -> bytes:
+        return ('{"detail":"%s"}' % detail).encode()
+
+    @classmethod
+    async def respond(cls, send, status: int, detail: str, retry_after: Optional[int] = None):
+        body = cls.error_body(detail)
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(retry_after).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
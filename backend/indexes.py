@@ -0,0 +1,72 @@
+"""Index declarations for the Xgen Cloud collections.
+
+Every index the API relies on is declared in ``INDEXES`` and created by
+``ensure_indexes()`` when the app starts. ``create_indexes`` is a no-op for
+indexes that already exist with the same definition, so running it on every
+start is cheap.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+MONGO_CREATE_INDEXES = os.environ.get('MONGO_CREATE_INDEXES', 'true').lower() == 'true'
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Lookups by email on login/auth; uniqueness also makes registration race-free
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "contact_messages": [
+        # Keyset pagination order for the admin listing and export
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel(
+            [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+            name="status_created_at_id",
+        ),
+    ],
+    "refresh_tokens": [
+        IndexModel([("token_hash", ASCENDING)], name="token_hash_unique", unique=True),
+        IndexModel([("family_id", ASCENDING)], name="family_id"),
+        # Mongo's TTL monitor removes tokens once expires_at has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "analytics_rollups": [
+        # Range reads for one series; documents are upserted by _id
+        IndexModel(
+            [("metric", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+            name="metric_granularity_bucket",
+        ),
+        # Minute and hour buckets only; day buckets have no expires_at
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "idempotency_keys": [
+        # Uniqueness makes reserving a key atomic across workers
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+async def ensure_indexes(db, indexes: Dict[str, List[IndexModel]] = INDEXES) -> Dict[str, List[str]]:
+    """Create the declared indexes, returning the index names per collection.
+
+    Collections are handled concurrently. A failure on one collection (for
+    example a unique index over existing duplicate data) is logged and does
+    not stop the others.
+    """
+    async def create(collection_name: str, models: List[IndexModel]):
+        try:
+            return await db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            logger.error("Could not create indexes on %s: %s", collection_name, e)
+
+    # One round trip per collection, all in flight at once
+    names = await asyncio.gather(*(create(name, models) for name, models in indexes.items()))
+    return {name: created for name, created in zip(indexes, names) if created is not None}
@@ -0,0 +1,139 @@
+"""Write-behind ingestion for contact messages.
+
+In ``buffered`` mode ``POST /api/contact`` only appends the message to an
+in-memory buffer and returns; a background task writes the buffer with
+``insert_many`` whenever ``batch_size`` messages are waiting or
+``flush_interval`` has passed, whichever comes first. Everything still
+buffered is flushed when the app shuts down.
+
+The buffer is bounded. When it is full (for example because Mongo is down
+and batches keep failing) ``submit()`` raises ``IngestBufferFull`` so the
+route can answer 503 instead of growing memory without limit.
+"""
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from repository import DUPLICATE_KEY
+
+logger = logging.getLogger(__name__)
+
+CONTACT_INGEST_MODE = os.environ.get('CONTACT_INGEST_MODE', 'direct')
+CONTACT_INGEST_BATCH_SIZE = int(os.environ.get('CONTACT_INGEST_BATCH_SIZE', '500'))
+CONTACT_INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('CONTACT_INGEST_FLUSH_INTERVAL_MS', '200'))
+CONTACT_INGEST_MAX_BUFFER = int(os.environ.get('CONTACT_INGEST_MAX_BUFFER', '50000'))
+CONTACT_INGEST_WRITE_CONCERN = os.environ.get('CONTACT_INGEST_WRITE_CONCERN', '1')
+CONTACT_INGEST_JOURNAL = os.environ.get('CONTACT_INGEST_JOURNAL', '').lower() == 'true'
+
+
+class IngestBufferFull(Exception):
+    """Raised when the ingestion buffer already holds ``max_buffer`` messages"""
+
+
+def write_concern(w: str = CONTACT_INGEST_WRITE_CONCERN, journal: bool = CONTACT_INGEST_JOURNAL) -> "WriteConcern":
+    """WriteConcern from the ``w`` setting ("majority" or a node count)"""
+    from pymongo.write_concern import WriteConcern
+
+    return WriteConcern(w=int(w) if w.isdigit() else w, j=journal or None)
+
+
+class BufferedIngest:
+    """Buffers documents in memory and writes them in batches"""
+
+    def __init__(self, repository_getter, batch_size: int = CONTACT_INGEST_BATCH_SIZE,
+                 flush_interval: float = CONTACT_INGEST_FLUSH_INTERVAL_MS / 1000.0,
+                 max_buffer: int = CONTACT_INGEST_MAX_BUFFER,
+                 concern: Optional["WriteConcern"] = None):
+        self.repository_getter = repository_getter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        # Built on the first write, so that pymongo loads with the driver
+        self.concern = concern
+        self.buffer: List[dict] = []
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def submit(self, document: dict):
+        if len(self.buffer) >= self.max_buffer:
+            raise IngestBufferFull(f"{len(self.buffer)} messages waiting to be written")
+        self.buffer.append(document)
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write out everything still buffered"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        try:
+            while self.buffer:
+                await self.flush()
+        except Exception as e:
+            logger.error("Dropping %d unwritten contact messages: %s", len(self.buffer), e)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The failed batch is back in the buffer; retry on the next tick
+                logger.error("Contact message flush failed: %s", e)
+
+    async def flush(self):
+        """Write the messages buffered at call time; later arrivals wait for the next flush"""
+        remaining = len(self.buffer)
+        while remaining > 0 and self.buffer:
+            batch = self.buffer[:min(self.batch_size, remaining)]
+            del self.buffer[:len(batch)]
+            remaining -= len(batch)
+            try:
+                await self._write(batch)
+            except Exception:
+                self.failed_batches += 1
+                self.buffer[:0] = batch
+                raise
+
+    async def _write(self, batch: List[dict]):
+        from pymongo.errors import BulkWriteError
+
+        if self.concern is None:
+            self.concern = write_concern()
+        repository = self.repository_getter()
+        try:
+            await repository.insert_many(batch, write_concern=self.concern)
+        except BulkWriteError as e:
+            # Documents already written by an earlier, partially failed
+            # attempt come back as duplicate _id errors; anything else is real
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+        self.batches += 1
+        self.written += len(batch)
+
+    def stats(self):
+        return {
+            "buffered": len(self.buffer),
+            "max_buffer": self.max_buffer,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+        }
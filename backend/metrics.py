@@ -0,0 +1,332 @@
+"""Prometheus-style metrics.
+
+A minimal, dependency-free implementation of counters, gauges and
+histograms, rendered in the Prometheus text exposition format by the
+``/metrics`` route. Everything is updated from the event loop thread, so
+there is no locking; a labelled child is looked up once per label
+combination and cached, and a histogram observation is a ``bisect`` plus
+two additions.
+
+The application metrics are declared at the bottom of this module and
+imported by the modules that record them.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class; with ``function`` an unlabelled value is read at render time"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            self.labels().set(self.function())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "count")
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "started")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        # Set before Metric.__init__, which creates the unlabelled child
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request counts, latency and in-flight requests.
+
+    Routes are labelled by their path template (``/api/profile``), never the
+    raw URL, so label cardinality stays bounded; unmatched paths share the
+    ``unmatched`` label. Requests answered by a middleware before routing (a
+    429, an idempotent replay) have no route in the scope; they are
+    matched against the app's router so they count under their route too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            path = self.route_path(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, path, str(status)).inc()
+            HTTP_LATENCY.labels(method, path).observe(elapsed)
+
+
+    @staticmethod
+    def route_path(scope) -> str:
+        route = scope.get("route")
+        if route is None:
+            # Same order as the router: the first full match, else the first
+            # route matching only the path (answered with 405)
+            partial = None
+            for candidate in getattr(scope.get("app"), "routes", ()):
+                match, _ = candidate.matches(scope)
+                if match == Match.FULL:
+                    route = candidate
+                    break
+                if match == Match.PARTIAL and partial is None:
+                    partial = candidate
+            else:
+                route = partial
+        return getattr(route, "path", None) or "unmatched"
+
+
+# Application metrics
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "HTTP requests by method, route and status",
+    ("method", "route", "status"),
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route",
+    ("method", "route"),
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+COMPRESSION_BYTES = REGISTRY.counter(
+    "http_compression_bytes_total", "Response bytes before and after compression",
+    ("encoding", "stage"),
+)
+
+PASSWORD_HASH_LATENCY = REGISTRY.histogram(
+    "password_hash_duration_seconds", "Password hash/verify latency including pool queueing",
+    ("operation",), buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0),
+)
+PASSWORD_HASH_REJECTED = REGISTRY.counter(
+    "password_hash_rejected_total", "Hash calls rejected because the pool was saturated",
+)
+PASSWORD_REHASHES = REGISTRY.counter(
+    "password_rehashes_total", "Stored password hashes upgraded after login, by outcome", ("outcome",),
+)
+TOKEN_LATENCY = REGISTRY.histogram(
+    "token_duration_seconds", "JWT encode/decode latency", ("operation",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+TOKEN_CACHE_LOOKUPS = REGISTRY.counter(
+    "token_cache_lookups_total", "Verified-token cache lookups by result", ("result",),
+)
+REFRESH_TOKENS = REGISTRY.counter(
+    "refresh_tokens_total", "Refresh token operations by outcome", ("outcome",),
+)
+CONTACT_MESSAGES_PROCESSED = REGISTRY.counter(
+    "contact_messages_processed_total", "Background contact message outcomes", ("outcome",),
+)
+CONTACT_PROCESSING_LATENCY = REGISTRY.histogram(
+    "contact_message_processing_seconds", "Contact message handler duration",
+)
+IDEMPOTENT_REQUESTS = REGISTRY.counter(
+    "idempotent_requests_total", "Requests carrying an Idempotency-Key, by outcome", ("outcome",),
+)
+USERS_IMPORTED = REGISTRY.counter(
+    "users_imported_total", "Bulk import rows by outcome", ("outcome",),
+)
+DB_CIRCUIT_TRANSITIONS = REGISTRY.counter(
+    "db_circuit_transitions_total", "Database circuit breaker state changes, by new state", ("state",),
+)
+DB_CALLS_REJECTED = REGISTRY.counter(
+    "db_calls_rejected_total", "Database calls failed fast by the open circuit breaker",
+)
+DB_DEADLINES_EXCEEDED = REGISTRY.counter(
+    "db_deadlines_exceeded_total", "Database calls abandoned at their deadline, by operation", ("operation",),
+)
+MONGO_LATENCY = REGISTRY.histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency by collection and operation",
+    ("collection", "operation"),
+)
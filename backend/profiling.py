@@ -0,0 +1,213 @@
+"""On-demand sampling profiles and a watchdog for a blocked event loop.
+
+``sample_stacks`` runs a sampling profiler for a few seconds: a thread reads
+``sys._current_frames()`` every ``interval`` and counts each stack. The
+result is in the collapsed ("folded") format that ``flamegraph.pl``,
+speedscope and inferno read, one ``frame;frame;frame count`` line per
+distinct stack, root first::
+
+    curl -H "Authorization: Bearer $TOKEN" -o api.folded \\
+        "http://localhost:8001/api/admin/profile?seconds=10"
+    flamegraph.pl api.folded > api.svg
+
+By default only the event loop thread is sampled, so the graph shows where
+the loop spends its time; time it sits idle waiting for I/O shows up under
+``select``. ``threads=all`` adds the executor threads (motor's pymongo
+calls, the password hash pool). Nothing is installed in the interpreter:
+when no profile is running there is no cost at all.
+
+``LoopWatchdog`` runs all the time. ``health.LoopLagMonitor`` already wakes
+up on the loop every ``interval`` and notes when its next wake-up is due;
+the watchdog thread checks that deadline. When the loop is more than
+``threshold`` late, some callback is still running, so the watchdog grabs
+the loop thread's stack right then and logs it, once per blocking episode.
+That names the culprit (a sync pymongo call, bcrypt on the loop, a big JSON
+encode) rather than only saying that the loop was slow. The cost is one
+thread waking every ``check_interval`` to compare two floats.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', '200'))  # 0 disables the watchdog
+LOOP_BLOCK_STACK_LIMIT = int(os.environ.get('LOOP_BLOCK_STACK_LIMIT', '30'))
+
+
+def _path_prefixes() -> List[str]:
+    prefixes = {os.path.abspath(path) + os.sep for path in sys.path if path}
+    return sorted(prefixes, key=len, reverse=True)
+
+
+class FrameNames:
+    """``function (file:line)`` labels, with files shortened to their import path"""
+
+    def __init__(self):
+        self.prefixes = _path_prefixes()
+        self.files: Dict[str, str] = {}
+
+    def filename(self, path: str) -> str:
+        short = self.files.get(path)
+        if short is None:
+            short = path
+            for prefix in self.prefixes:
+                if path.startswith(prefix):
+                    short = path[len(prefix):]
+                    break
+            self.files[path] = short
+        return short
+
+    def stack(self, frame) -> List[str]:
+        """Labels from the outermost frame to ``frame``"""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            # Separators of the collapsed format cannot appear inside a frame
+            name = f"{code.co_name} ({self.filename(code.co_filename)}:{frame.f_lineno})"
+            names.append(name.replace(";", ":"))
+            frame = frame.f_back
+        names.reverse()
+        return names
+
+
+class Profile:
+    """Stack counts from one sampling run"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+
+    def collapsed(self) -> str:
+        """The folded-stack text, heaviest stacks first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def sample_stacks(seconds: float, interval: float, thread_ids: Optional[Iterable[int]] = None) -> Profile:
+    """Sample the given threads (all but this one by default) every ``interval`` for ``seconds``.
+
+    Blocks for ``seconds``; run it in its own thread.
+    """
+    me = threading.get_ident()
+    wanted = set(thread_ids) if thread_ids is not None else None
+    names = FrameNames()
+    profile = Profile(interval)
+    started = time.perf_counter()
+    deadline = started + seconds
+    next_sample = started
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now < next_sample:
+            time.sleep(next_sample - now)
+            continue
+        # Fall behind rather than sample in bursts when the GIL is busy
+        next_sample = max(next_sample + interval, now)
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (wanted is not None and ident not in wanted):
+                continue
+            stack = names.stack(frame)
+            if wanted is None or len(wanted) > 1:
+                stack.insert(0, thread_names.get(ident, f"thread-{ident}").replace(";", ":"))
+            profile.stacks[";".join(stack)] += 1
+        profile.samples += 1
+    profile.elapsed = time.perf_counter() - started
+    return profile
+
+
+async def profile(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000,
+                  thread_ids: Optional[Iterable[int]] = None) -> Profile:
+    """Run ``sample_stacks`` on a dedicated thread without blocking the loop.
+
+    Not on the default executor: motor runs its pymongo calls there, and a
+    profile taken while that pool is backed up should not wait in its queue.
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def run():
+        try:
+            result = sample_stacks(seconds, interval, thread_ids)
+        except BaseException as e:  # noqa: BLE001  (handed to the waiting coroutine)
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_exception(e))
+        else:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(result))
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return await done
+
+
+class LoopWatchdog:
+    """Logs the loop thread's stack when the loop is blocked longer than ``threshold`` seconds.
+
+    ``monitor`` is the ``LoopLagMonitor`` whose ``due`` time is checked.
+    The last ``keep`` reports are kept for the admin endpoint.
+    """
+
+    def __init__(self, monitor, threshold: float = LOOP_BLOCK_THRESHOLD_MS / 1000,
+                 check_interval: Optional[float] = None, keep: int = 20, stack_limit: int = LOOP_BLOCK_STACK_LIMIT):
+        self.monitor = monitor
+        self.threshold = threshold
+        self.check_interval = check_interval or min(0.1, max(threshold / 2, 0.01))
+        self.stack_limit = stack_limit
+        self.blocks = 0
+        self.recent = collections.deque(maxlen=keep)
+        self.loop_thread: Optional[int] = None
+        self._reported_due: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self):
+        """Start watching the calling thread's event loop"""
+        if not self.enabled or self._thread is not None:
+            return
+        self.loop_thread = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        due = self.monitor.due
+        if due is None or due == self._reported_due:
+            return
+        late = time.perf_counter() - due
+        if late < self.threshold:
+            return
+        frame = sys._current_frames().get(self.loop_thread)
+        if frame is None:
+            return
+        self._reported_due = due
+        stack = "".join(traceback.format_stack(frame, limit=self.stack_limit))
+        del frame
+        self.blocks += 1
+        self.recent.append({"at": time.time(), "blocked_ms": late * 1000, "stack": stack})
+        logger.warning("Event loop blocked for %.0f ms so far; loop thread is at:\n%s", late * 1000, stack)
+
+    def stats(self):
+        return {"enabled": self.enabled, "threshold_ms": self.threshold * 1000, "blocks": self.blocks}
@@ -0,0 +1,164 @@
+"""Rate limiting for the credential endpoints.
+
+``/api/login`` and ``/api/register`` are the most expensive routes (bcrypt
+plus Mongo), so they are throttled by a token bucket per client IP and a
+second bucket per submitted email address. The check runs in ASGI
+middleware, before FastAPI parses the request or any hashing is queued,
+and rejected requests get a 429 with ``Retry-After``. The body is read to
+find the email address, so bodies over ``RATE_LIMIT_MAX_BODY`` bytes are
+rejected with 413 rather than buffered.
+
+Bucket state lives in a ``RateLimitBackend``. ``MemoryBackend`` keeps it
+per process; a shared store (Redis, Mongo, ...) can be plugged in by
+implementing ``hit()`` so that limits hold across workers and hosts.
+"""
+import abc
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from request_body import BodyTooLarge, client_ip, read_body, replay_body
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', '60'))
+RATE_LIMIT_IP_BURST = int(os.environ.get('RATE_LIMIT_IP_BURST', '20'))
+RATE_LIMIT_EMAIL_PER_MINUTE = float(os.environ.get('RATE_LIMIT_EMAIL_PER_MINUTE', '10'))
+RATE_LIMIT_EMAIL_BURST = int(os.environ.get('RATE_LIMIT_EMAIL_BURST', '5'))
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_MAX_BODY = int(os.environ.get('RATE_LIMIT_MAX_BODY', str(64 * 1024)))
+
+
+class RateLimitBackend(abc.ABC):
+    """Storage for token buckets.
+
+    ``hit`` takes one token from the bucket ``key`` refilling at ``rate``
+    tokens per second up to ``burst``, and returns ``(allowed,
+    retry_after_seconds)``. Implementations must apply the take atomically
+    when several processes share the store.
+    """
+
+    @abc.abstractmethod
+    async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        """Take one token from bucket ``key``; ``(allowed, retry_after_seconds)``"""
+
+
+class MemoryBackend(RateLimitBackend):
+    """In-process token buckets, bounded to ``max_keys`` (least recently used evicted)"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def hit(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        now = self.clock()
+        tokens, updated = self.buckets.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated) * rate)
+        if tokens >= 1.0:
+            allowed, retry_after = True, 0.0
+            tokens -= 1.0
+        else:
+            allowed, retry_after = False, (1.0 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying per-IP and per-email buckets to selected POST routes"""
+
+    def __init__(self, app, paths: Iterable[str] = ("/api/login", "/api/register"),
+                 backend: Optional[RateLimitBackend] = None,
+                 ip_per_minute: float = RATE_LIMIT_IP_PER_MINUTE, ip_burst: int = RATE_LIMIT_IP_BURST,
+                 email_per_minute: float = RATE_LIMIT_EMAIL_PER_MINUTE,
+                 email_burst: int = RATE_LIMIT_EMAIL_BURST,
+                 trust_forwarded: bool = RATE_LIMIT_TRUST_FORWARDED, max_body: int = RATE_LIMIT_MAX_BODY,
+                 enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ip_rate = ip_per_minute / 60.0
+        self.ip_burst = ip_burst
+        self.email_rate = email_per_minute / 60.0
+        self.email_burst = email_burst
+        self.trust_forwarded = trust_forwarded
+        self.max_body = max_body
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        allowed, retry_after = await self.backend.hit(
+            f"ip:{path}:{client_ip(scope, self.trust_forwarded)}", self.ip_rate, self.ip_burst
+        )
+        if not allowed:
+            await self.reject(send, retry_after)
+            return
+
+        # Read the body once to find the email, then replay it to the app
+        content_length = next((value for name, value in scope["headers"] if name == b"content-length"), b"")
+        if content_length.isdigit() and int(content_length) > self.max_body:
+            await self.reject_too_large(send)
+            return
+        try:
+            body = await read_body(receive, self.max_body)
+        except BodyTooLarge:
+            await self.reject_too_large(send)
+            return
+        email = self.email_from(body)
+        if email:
+            allowed, retry_after = await self.backend.hit(
+                f"email:{path}:{email}", self.email_rate, self.email_burst
+            )
+            if not allowed:
+                await self.reject(send, retry_after)
+                return
+
+        await self.app(scope, replay_body(body, receive), send)
+
+    @staticmethod
+    def email_from(body: bytes) -> Optional[str]:
+        if not body:
+            return None
+        try:
+            email = json.loads(body).get("email")
+        except (ValueError, AttributeError):
+            return None
+        return email.strip().lower() if isinstance(email, str) else None
+
+    @staticmethod
+    async def reject(send, retry_after: float):
+        body = b'{"detail":"Too many requests, please retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def reject_too_large(send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
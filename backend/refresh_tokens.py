@@ -0,0 +1,87 @@
+"""Rotating refresh tokens.
+
+Login and registration hand out a long-lived refresh token next to the
+short-lived access token. ``POST /api/token/refresh`` exchanges it for a new
+access token and a new refresh token, so renewing a session costs one HMAC
+and one indexed ``find_one_and_update`` instead of a bcrypt verify.
+
+Refresh tokens are random strings. Only their HMAC-SHA256 under the signing
+key is stored, so a database dump does not contain usable tokens. Each token
+can be exchanged once. Every token descended from one login shares a
+``family_id``, and presenting a token that was already exchanged revokes the
+whole family: either the client or an attacker holds a stolen copy, and
+neither can tell which. Expired tokens are removed by a TTL index on
+``expires_at``.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from metrics import REFRESH_TOKENS
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+
+
+class InvalidRefreshToken(Exception):
+    """Raised for an unknown, expired or revoked refresh token"""
+
+
+class RefreshTokenReused(InvalidRefreshToken):
+    """Raised when an already exchanged token is presented again"""
+
+
+class RefreshTokenService:
+    """Issues and rotates refresh tokens stored through ``repository_getter()``"""
+
+    def __init__(self, repository_getter, secret_key: str,
+                 lifetime: timedelta = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)):
+        self.repository_getter = repository_getter
+        self.secret_key = secret_key.encode()
+        self.lifetime = lifetime
+
+    def digest(self, token: str) -> str:
+        return hmac.new(self.secret_key, token.encode(), hashlib.sha256).hexdigest()
+
+    async def issue(self, email: str, family_id: Optional[str] = None) -> str:
+        """A new refresh token for ``email``, starting a new family unless given one"""
+        token = secrets.token_urlsafe(32)
+        now = datetime.utcnow()
+        await self.repository_getter().insert({
+            "token_hash": self.digest(token),
+            "family_id": family_id or str(uuid.uuid4()),
+            "email": email,
+            "created_at": now,
+            "expires_at": now + self.lifetime,
+            "used_at": None,
+        })
+        REFRESH_TOKENS.labels("issued").inc()
+        return token
+
+    async def rotate(self, token: str) -> Tuple[str, str]:
+        """Exchange ``token`` for a new one, returning ``(email, new_token)``"""
+        repository = self.repository_getter()
+        token_hash = self.digest(token)
+        record = await repository.claim(token_hash, datetime.utcnow())
+        if record is None:
+            existing = await repository.find(token_hash)
+            if existing is not None and existing.get("used_at") is not None:
+                revoked = await repository.revoke_family(existing["family_id"])
+                REFRESH_TOKENS.labels("reused").inc()
+                logger.warning(
+                    "Refresh token reuse for %s; revoked %d token(s) in family %s",
+                    existing["email"], revoked, existing["family_id"],
+                )
+                raise RefreshTokenReused("Refresh token was already used")
+            REFRESH_TOKENS.labels("invalid").inc()
+            raise InvalidRefreshToken("Refresh token is invalid or expired")
+
+        new_token = await self.issue(record["email"], record["family_id"])
+        REFRESH_TOKENS.labels("rotated").inc()
+        return record["email"], new_token
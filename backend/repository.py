@@ -0,0 +1,570 @@
+"""Async data layer for the Xgen Cloud API.
+
+Route handlers talk to the repositories defined here instead of raw
+collections, so every database round trip is awaited on the event loop and
+the driver can be swapped (motor in production, mongomock-motor for local
+benchmarks) without touching handler code.
+
+pymongo is imported where it is used rather than at the top: importing it
+(with bson and dnspython) is a good share of the API's import time, and
+``connect()`` loads it with the driver anyway.
+"""
+import base64
+import contextlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from breaker import breaker
+from metrics import MONGO_LATENCY
+from tracing import tracer
+
+# Connection pool and timeout settings
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '60000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '10000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+
+# Server error code for a unique index violation
+DUPLICATE_KEY = 11000
+
+
+def is_duplicate_key(error: BaseException) -> bool:
+    """Whether ``error`` is a unique index violation (pymongo's ``DuplicateKeyError``)"""
+    return getattr(error, "code", None) == DUPLICATE_KEY
+
+
+def client_options() -> Dict[str, Any]:
+    """Driver options built from the MONGO_* environment settings"""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+
+
+class PoolStats:
+    """Connection pool counters fed by the driver's CMAP events.
+
+    The driver calls these from its own threads; plain integer updates are
+    good enough for reporting. ``pool_stats_listener()`` makes one the
+    driver accepts as a listener.
+    """
+
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "open": self.open,
+            "in_use": self.in_use,
+            "idle": max(0, self.open - self.in_use),
+            "checkout_failures": self.checkout_failures,
+            "cleared": self.cleared,
+        }
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def pool_cleared(self, event):
+        self.cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def pool_stats_listener() -> PoolStats:
+    """A ``PoolStats`` that is also a pymongo ``ConnectionPoolListener``"""
+    from pymongo import monitoring
+
+    return type("PoolStatsListener", (PoolStats, monitoring.ConnectionPoolListener), {})()
+
+
+# Client factories, keyed by URL scheme
+def _motor_client(url: str, **options):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    return AsyncIOMotorClient(url, **options)
+
+
+def _mongomock_client(url: str, **options):
+    # Optional dependency, only needed for local benchmarks
+    import mongomock
+    from mongomock_motor import AsyncMongoMockClient
+
+    # mongomock implements no server commands; answer pings so the health
+    # check behaves like it does against a real server
+    def command(self, command, *args, **kwargs):
+        return {"ok": 1.0}
+
+    mongomock.database.Database.command = command
+    return AsyncMongoMockClient()
+
+
+CLIENT_FACTORIES: Dict[str, Callable[..., Any]] = {
+    "mongodb": _motor_client,
+    "mongodb+srv": _motor_client,
+    "mongomock": _mongomock_client,
+}
+
+
+def register_client_factory(scheme: str, factory: Callable[..., Any]):
+    """Plug in another async driver for URLs starting with ``scheme://``"""
+    CLIENT_FACTORIES[scheme] = factory
+
+
+def create_client(url: str, **options):
+    scheme = url.split("://", 1)[0]
+    factory = CLIENT_FACTORIES.get(scheme)
+    if factory is None:
+        raise ValueError(f"Unsupported database URL scheme: {scheme}")
+    return factory(url, **options)
+
+
+def naive_utc(value: datetime) -> datetime:
+    # Stored timestamps are naive UTC (datetime.utcnow())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@contextlib.asynccontextmanager
+async def timed(collection, operation: str):
+    """One Mongo operation: under the circuit breaker and its deadline, timed as a metric and a span"""
+    with tracer.span(f"mongo.{operation}", collection=collection.name), \
+            MONGO_LATENCY.labels(collection.name, operation).time():
+        async with breaker.call(operation):
+            yield
+
+
+async def _in_batches(collection, cursor, batch_size: int) -> AsyncIterator[dict]:
+    """The documents of ``cursor``, fetching each batch through ``timed``"""
+    while True:
+        async with timed(collection, "find"):
+            batch = await cursor.to_list(length=batch_size)
+        for document in batch:
+            yield document
+        if len(batch) < batch_size:
+            return
+
+
+async def _timestamps(collection, field: str, query: dict, since: Optional[datetime]) -> AsyncIterator[datetime]:
+    """Every value of the datetime ``field`` in documents matching ``query``"""
+    query = {**query, field: {"$gte": since} if since else {"$ne": None}}
+    cursor = collection.find(query, {"_id": 0, field: 1}).batch_size(5000)
+    async for document in _in_batches(collection, cursor, 5000):
+        yield document[field]
+
+
+# Repositories
+class UserRepository:
+    """Access to the ``users`` collection.
+
+    ``listeners`` are called with the email of any user record changed
+    through this repository, so caches holding that user can drop it.
+    """
+
+    # Fields safe to return to clients; never includes the password hash
+    PUBLIC_FIELDS = ("id", "name", "email", "created_at")
+    PUBLIC_PROJECTION = {"_id": 0, **{field: 1 for field in PUBLIC_FIELDS}}
+
+    def __init__(self, collection, listeners: Optional[List[Callable[[str], None]]] = None):
+        self.collection = collection
+        self.listeners = listeners if listeners is not None else []
+
+    async def find_by_email(self, email: str, projection: Optional[dict] = None) -> Optional[dict]:
+        async with timed(self.collection, "find_one"):
+            return await self.collection.find_one({"email": email}, projection)
+
+    async def find_public_by_email(self, email: str) -> Optional[dict]:
+        """The user's public fields only, as fetched by ``PUBLIC_PROJECTION``"""
+        return await self.find_by_email(email, self.PUBLIC_PROJECTION)
+
+    async def insert(self, user: dict):
+        async with timed(self.collection, "insert_one"):
+            return await self.collection.insert_one(user)
+
+    async def insert_many(self, users: List[dict]):
+        """Unordered bulk insert; duplicates fail individually in the BulkWriteError"""
+        async with timed(self.collection, "insert_many"):
+            return await self.collection.insert_many(users, ordered=False)
+
+    async def update_by_email(self, email: str, changes: dict, expected: Optional[dict] = None):
+        """Apply ``changes``, only if the record still matches ``expected`` when given"""
+        async with timed(self.collection, "update_one"):
+            result = await self.collection.update_one({"email": email, **(expected or {})}, {"$set": changes})
+        self.notify_changed(email)
+        return result
+
+    def timestamps(self, field: str, query: dict, since: Optional[datetime] = None) -> AsyncIterator[datetime]:
+        return _timestamps(self.collection, field, query, since)
+
+    def notify_changed(self, email: str):
+        for listener in self.listeners:
+            listener(email)
+
+
+# Keyset pagination cursors: the (created_at, id) of the last row returned
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(created_at: datetime, message_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), message_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, message_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(message_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+class ContactMessageRepository:
+    """Access to the ``contact_messages`` collection"""
+
+    # Public fields of a message, in export column order
+    FIELDS = ("id", "name", "email", "message", "status", "created_at")
+    PROJECTION = {"_id": 0, **{field: 1 for field in FIELDS}}
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, message: dict):
+        async with timed(self.collection, "insert_one"):
+            return await self.collection.insert_one(message)
+
+    async def insert_many(self, messages: List[dict], write_concern=None):
+        collection = self.collection
+        if write_concern is not None:
+            collection = collection.database.get_collection(collection.name, write_concern=write_concern)
+        async with timed(self.collection, "insert_many"):
+            return await collection.insert_many(messages, ordered=False)
+
+    @classmethod
+    def filter_query(cls, status: Optional[str] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None) -> dict:
+        """Mongo filter for the admin listing/export parameters"""
+        query: Dict[str, Any] = {}
+        if status is not None:
+            query["status"] = status
+        if since is not None or until is not None:
+            query["created_at"] = {}
+            if since is not None:
+                query["created_at"]["$gte"] = naive_utc(since)
+            if until is not None:
+                query["created_at"]["$lt"] = naive_utc(until)
+        return query
+
+    async def list_page(self, query: dict, limit: int, cursor: Optional[str] = None
+                        ) -> Tuple[List[dict], Optional[str]]:
+        """One page of messages, newest first, and the cursor for the next page.
+
+        Pages are keyed on (created_at, id) rather than skip/limit, so each
+        page is a bounded index range scan however deep the client pages.
+        """
+        if cursor is not None:
+            created_at, message_id = decode_cursor(cursor)
+            after = {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": message_id}},
+            ]}
+            query = {"$and": [query, after]} if query else after
+        results = (
+            self.collection.find(query, self.PROJECTION)
+            .sort([("created_at", -1), ("id", -1)])
+            .limit(limit + 1)
+        )
+        async with timed(self.collection, "find"):
+            documents = await results.to_list(length=limit + 1)
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        last = documents[-1]
+        return documents, encode_cursor(last["created_at"], last["id"])
+
+    async def iterate(self, query: dict, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Stream every matching message, oldest first, a batch at a time"""
+        documents = (
+            self.collection.find(query, self.PROJECTION)
+            .sort([("created_at", 1), ("id", 1)])
+            .batch_size(batch_size)
+        )
+        async for document in _in_batches(self.collection, documents, batch_size):
+            yield document
+
+    def timestamps(self, field: str, query: dict, since: Optional[datetime] = None) -> AsyncIterator[datetime]:
+        return _timestamps(self.collection, field, query, since)
+
+    # Background processing: status new -> processing -> done/failed
+    async def claim(self, owner: str, now: datetime, lease_until: datetime) -> Optional[dict]:
+        """Atomically lease the oldest ``new`` message that is due, counting the attempt"""
+        from pymongo import ReturnDocument
+
+        async with timed(self.collection, "find_one_and_update"):
+            return await self.collection.find_one_and_update(
+                {"status": "new", "next_attempt_at": {"$not": {"$gt": now}}},
+                {
+                    "$set": {"status": "processing", "lease_owner": owner, "lease_until": lease_until},
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("created_at", 1), ("id", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+
+    async def finish(self, document_id, owner: str, changes: dict, attempts: int = 0) -> bool:
+        """Apply ``changes`` and drop the lease, if ``owner`` still holds it"""
+        update: Dict[str, Any] = {"$set": changes, "$unset": {"lease_owner": "", "lease_until": ""}}
+        if attempts:
+            update["$inc"] = {"attempts": attempts}
+        async with timed(self.collection, "update_one"):
+            result = await self.collection.update_one(
+                {"_id": document_id, "status": "processing", "lease_owner": owner}, update
+            )
+        return result.modified_count == 1
+
+    async def recover_expired(self, now: datetime, max_attempts: int) -> Tuple[int, int]:
+        """Release messages whose lease ran out: ``failed`` if out of attempts, else ``new``.
+
+        Returns the number of messages failed and retried.
+        """
+        expired = {"status": "processing", "lease_until": {"$lte": now}}
+        unset = {"lease_owner": "", "lease_until": ""}
+        async with timed(self.collection, "update_many"):
+            failed = await self.collection.update_many(
+                {**expired, "attempts": {"$gte": max_attempts}},
+                {"$set": {"status": "failed", "last_error": "lease expired", "failed_at": now}, "$unset": unset},
+            )
+            retried = await self.collection.update_many(
+                expired, {"$set": {"status": "new", "last_error": "lease expired"}, "$unset": unset},
+            )
+        return failed.modified_count, retried.modified_count
+
+
+class RefreshTokenRepository:
+    """Access to the ``refresh_tokens`` collection.
+
+    Documents are keyed by the token's HMAC (``token_hash``), never the token
+    itself. ``used_at`` is set when a token is exchanged; every token issued
+    from one login shares a ``family_id``.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, token: dict):
+        async with timed(self.collection, "insert_one"):
+            return await self.collection.insert_one(token)
+
+    async def claim(self, token_hash: str, now: datetime) -> Optional[dict]:
+        """Atomically mark an unused, unexpired token as used and return it"""
+        async with timed(self.collection, "find_one_and_update"):
+            return await self.collection.find_one_and_update(
+                {"token_hash": token_hash, "used_at": None, "expires_at": {"$gt": now}},
+                {"$set": {"used_at": now}},
+                projection={"_id": 0},
+            )
+
+    async def find(self, token_hash: str) -> Optional[dict]:
+        async with timed(self.collection, "find_one"):
+            return await self.collection.find_one({"token_hash": token_hash}, {"_id": 0})
+
+    async def revoke_family(self, family_id: str) -> int:
+        async with timed(self.collection, "delete_many"):
+            result = await self.collection.delete_many({"family_id": family_id})
+        return result.deleted_count
+
+
+class IdempotencyKeyRepository:
+    """Access to the ``idempotency_keys`` collection.
+
+    One document per ``key``; ``complete`` is False while the first request
+    is running and holds the reservation until ``locked_until``.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, record: dict):
+        async with timed(self.collection, "insert_one"):
+            return await self.collection.insert_one(record)
+
+    async def find(self, key: str) -> Optional[dict]:
+        async with timed(self.collection, "find_one"):
+            return await self.collection.find_one({"key": key}, {"_id": 0})
+
+    async def take_over(self, key: str, now: datetime, record: dict) -> bool:
+        """Replace a reservation whose lock has expired; True if this call got it"""
+        async with timed(self.collection, "update_one"):
+            result = await self.collection.update_one(
+                {"key": key, "complete": False, "locked_until": {"$lte": now}},
+                {"$set": record},
+            )
+        return result.modified_count == 1
+
+    async def complete(self, key: str, response: dict):
+        async with timed(self.collection, "update_one"):
+            await self.collection.update_one({"key": key}, {"$set": {**response, "complete": True}})
+
+    async def release(self, key: str):
+        async with timed(self.collection, "delete_one"):
+            await self.collection.delete_one({"key": key, "complete": False})
+
+
+class AnalyticsRepository:
+    """Access to the ``analytics_rollups`` collection (see ``analytics``)"""
+
+    # Flush ids remembered per rollup: more than the flushes, from every
+    # worker, that can land on one document before a failed flush is retried
+    FLUSH_HISTORY = 32
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def increment(self, updates: List[dict], flush_id: str):
+        """Apply ``{"_id", "inc", "fields"}`` updates as ``$inc`` upserts, each at most once per ``flush_id``.
+
+        A rollup records the ids of its recent flushes and an update only
+        matches a rollup that has not seen its flush, so retrying a flush that
+        failed partway does not count the applied part twice. Its upsert fails
+        on the duplicate ``_id`` instead. A duplicate can also mean another
+        worker inserted the rollup first; the duplicates are sent once more,
+        and only those already applied fail again.
+        """
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+
+        requests = [
+            UpdateOne(
+                {"_id": update["_id"], "flushes": {"$ne": flush_id}},
+                {
+                    "$inc": update["inc"],
+                    "$setOnInsert": update["fields"],
+                    "$push": {"flushes": {"$each": [flush_id], "$slice": -self.FLUSH_HISTORY}},
+                },
+                upsert=True,
+            )
+            for update in updates
+        ]
+        for attempt in range(2):
+            try:
+                async with timed(self.collection, "bulk_write"):
+                    await self.collection.bulk_write(requests, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                    raise
+                requests = [requests[error["index"]] for error in errors]
+
+    async def find_range(self, metric: str, granularity: str, since: datetime, until: datetime) -> List[dict]:
+        query = {"metric": metric, "granularity": granularity, "bucket": {"$gte": since, "$lt": until}}
+        async with timed(self.collection, "find"):
+            return await self.collection.find(query, {"_id": 0, "bucket": 1, "counts": 1}).to_list(length=None)
+
+    async def replace(self, metrics, since: Optional[datetime], documents: List[dict]):
+        """Delete the rollups of ``metrics`` from ``since`` on and write ``documents`` instead"""
+        query: Dict[str, Any] = {"metric": {"$in": list(metrics)}}
+        if since is not None:
+            query["bucket"] = {"$gte": since}
+        async with timed(self.collection, "delete_many"):
+            await self.collection.delete_many(query)
+        for start in range(0, len(documents), 1000):
+            async with timed(self.collection, "insert_many"):
+                await self.collection.insert_many(documents[start:start + 1000], ordered=False)
+
+
+class DataLayer:
+    """Owns the database client and the repositories built on top of it.
+
+    The client is created in ``connect()`` (called from the app startup
+    event) rather than at import time, and released in ``close()``.
+    """
+
+    def __init__(self, url: str, db_name: str, **options):
+        self.url = url
+        self.db_name = db_name
+        self.pool_stats = PoolStats()
+        self.options = {**client_options(), **options}
+        self.client = None
+        self.db = None
+        self.users: Optional[UserRepository] = None
+        self.contact_messages: Optional[ContactMessageRepository] = None
+        self.refresh_tokens: Optional[RefreshTokenRepository] = None
+        self.idempotency_keys: Optional[IdempotencyKeyRepository] = None
+        self.analytics: Optional[AnalyticsRepository] = None
+        self.user_listeners: List[Callable[[str], None]] = []
+
+    def on_user_change(self, listener: Callable[[str], None]):
+        """Register ``listener(email)`` to run whenever a user record changes"""
+        self.user_listeners.append(listener)
+
+    def pool_status(self) -> Dict[str, int]:
+        return {**self.pool_stats.as_dict(), "max_size": self.options.get("maxPoolSize")}
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    async def connect(self):
+        if self.client is not None:
+            return
+        self.pool_stats = pool_stats_listener()
+        self.client = create_client(self.url, **{"event_listeners": [self.pool_stats], **self.options})
+        self.db = self.client[self.db_name]
+        self.users = UserRepository(self.db.users, self.user_listeners)
+        self.contact_messages = ContactMessageRepository(self.db.contact_messages)
+        self.refresh_tokens = RefreshTokenRepository(self.db.refresh_tokens)
+        self.idempotency_keys = IdempotencyKeyRepository(self.db.idempotency_keys)
+        self.analytics = AnalyticsRepository(self.db.analytics_rollups)
+
+    async def close(self):
+        if self.client is None:
+            return
+        self.client.close()
+        self.client = None
+        self.db = None
+        self.users = None
+        self.contact_messages = None
+        self.refresh_tokens = None
+        self.idempotency_keys = None
+        self.analytics = None
+
+    async def ping(self):
+        with tracer.span("mongo.command"), MONGO_LATENCY.labels("$cmd", "command").time():
+            return await self.db.command('ismaster')
@@ -0,0 +1,54 @@
+"""Request helpers for ASGI middleware that looks at the request before the app.
+
+``RateLimitMiddleware`` looks for the email address and
+``IdempotencyMiddleware`` fingerprints the body, both before the route
+runs. ``read_body`` drains the body from ``receive``; ``replay_body`` then
+gives the app a ``receive`` that hands the same bytes back once and defers
+to the real one after that (for ``http.disconnect``). ``client_ip`` names
+the caller for per-client limits and keys.
+"""
+from typing import Optional
+
+
+class BodyTooLarge(Exception):
+    """Raised by ``read_body`` once the body exceeds ``max_size``"""
+
+
+async def read_body(receive, max_size: Optional[int] = None) -> bytes:
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise BodyTooLarge(f"Request body is over {max_size} bytes")
+        chunks.append(chunk)
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def client_ip(scope, trust_forwarded: bool = False) -> str:
+    """The client address, or the first ``X-Forwarded-For`` hop behind a trusted proxy"""
+    if trust_forwarded:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def replay_body(body: bytes, receive):
+    """A ``receive`` that returns ``body`` as the whole request, then calls ``receive``"""
+    replayed = False
+
+    async def receive_replayed():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return receive_replayed
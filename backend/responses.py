@@ -0,0 +1,48 @@
+"""Fast JSON responses for already-trusted data.
+
+``FastJSONResponse`` serializes with orjson when it is installed and falls
+back to the standard library otherwise. Handlers return it directly, which
+makes FastAPI skip ``response_model`` validation and ``jsonable_encoder``;
+only use it for payloads the handler has built itself from known fields.
+
+``TracedJSONResponse`` is the app's default response class: FastAPI's own
+JSON rendering, inside a ``serialize`` span.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from tracing import tracer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with tracer.span("serialize"):
+            return super().render(content)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        with tracer.span("serialize", fast=True):
+            return dumps(content)
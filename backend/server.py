@@ -1,43 +1,174 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from pymongo import MongoClient
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
+import asyncio
+import csv
+import io
+import json
+import logging
+import math
 import os
 import hashlib
 import secrets
+import threading
 from typing import Optional
 import uuid
 
-# Initialize FastAPI app
-app = FastAPI(title="Xgen Cloud API", version="1.0.0")
+from analytics import ANALYTICS_ENABLED, RollupRecorder, read_series
+from breaker import DATABASE_UNAVAILABLE, STATE_VALUES, DatabaseUnavailable, breaker
+from cache import TTLCache
+from catalog import partners_response, services_response
+from compression import CompressionMiddleware
+from conditional import ConditionalGetMiddleware
+from contact_worker import CONTACT_WORKERS_ENABLED, ContactProcessor
+from hashing import HashPoolSaturated, PasswordHasher
+from health import READY_MAX_HASH_PENDING, HealthChecker
+from idempotency import IDEMPOTENCY_STORE, IdempotencyMiddleware, MemoryStore, MongoStore
+from ingest import CONTACT_INGEST_MODE, BufferedIngest, IngestBufferFull
+from metrics import CONTENT_TYPE, PASSWORD_REHASHES, REGISTRY, MetricsMiddleware
+from profiling import PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL_MS, LoopWatchdog, profile
+from ratelimit import RateLimitMiddleware
+from refresh_tokens import InvalidRefreshToken, RefreshTokenService
+from repository import ContactMessageRepository, DataLayer, InvalidCursor, is_duplicate_key
+from responses import FastJSONResponse, TracedJSONResponse
+from tokens import InvalidToken, TokenCodec
+from tracing import TracingMiddleware, current_request_id, current_span, tracer
+from user_import import USER_IMPORT_CHUNK_SIZE, UserImporter
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with specific origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger(__name__)
+
+# Routes are collected on a router and mounted by create_app()
+router = APIRouter()
 
 # Database connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client.xgen_cloud
-users_collection = db.users
+data = DataLayer(MONGO_URL, "xgen_cloud")
+
+# Write-behind buffer for contact messages (CONTACT_INGEST_MODE=buffered)
+contact_ingest = BufferedIngest(lambda: data.contact_messages) if CONTACT_INGEST_MODE == "buffered" else None
+
+# Signup and contact message counts, rolled up per minute/hour/day
+analytics = RollupRecorder(lambda: data.analytics) if ANALYTICS_ENABLED else None
+
+def record_processed(outcome: str, count: int):
+    if analytics and outcome in ("done", "failed"):
+        analytics.record("contact_processed", outcome, count)
+
+# Background processing of stored contact messages (CONTACT_WORKERS_ENABLED=true)
+contact_processor = (
+    ContactProcessor(lambda: data.contact_messages, listeners=[record_processed]) if CONTACT_WORKERS_ENABLED else None
+)
+REGISTRY.gauge(
+    "contact_messages_in_flight", "Contact messages being processed by this process's workers",
+    function=lambda: contact_processor.in_flight if contact_processor else 0,
+)
+
+# Replayed responses for retried POSTs carrying an Idempotency-Key
+idempotency_store = MongoStore(lambda: data.idempotency_keys) if IDEMPOTENCY_STORE == "mongo" else MemoryStore()
+
+# Lifecycle: connect on startup, never at import
+async def connect_database():
+    # Imports pymongo; the driver is loaded by connect() anyway
+    from indexes import MONGO_CREATE_INDEXES, ensure_indexes
+
+    await data.connect()
+    if MONGO_CREATE_INDEXES:
+        await ensure_indexes(data.db)
+    if contact_ingest:
+        await contact_ingest.start()
+    if contact_processor:
+        await contact_processor.start()
+    if analytics:
+        await analytics.start()
+    await health_checker.start()
+    loop_watchdog.start()
+
+async def close_database():
+    loop_watchdog.stop()
+    await health_checker.stop()
+    if contact_processor:
+        await contact_processor.stop()
+    # Flush buffered contact messages before the client goes away
+    if contact_ingest:
+        await contact_ingest.stop()
+    if password_rehash_tasks:
+        await asyncio.gather(*password_rehash_tasks.values(), return_exceptions=True)
+    if analytics:
+        await analytics.stop()
+    await data.close()
+
+async def stop_password_hasher():
+    password_hasher.shutdown()
+
+async def close_trace_exporter():
+    if tracer.exporter is not None:
+        tracer.exporter.close()
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher()
+REGISTRY.gauge(
+    "password_hash_pending", "Hash calls queued or running in the pool",
+    function=lambda: password_hasher.pending,
+)
+REGISTRY.gauge(
+    "password_hash_pool_saturation", "Pending hash calls as a fraction of the admission limit",
+    function=lambda: password_hasher.pending / password_hasher.max_pending,
+)
 security = HTTPBearer()
 
+# Probes: /livez does no I/O, /readyz serves the background checker's result
+health_checker = HealthChecker(
+    data.ping,
+    lambda: password_hasher.pending,
+    int(READY_MAX_HASH_PENDING or password_hasher.max_pending),
+)
+REGISTRY.gauge(
+    "event_loop_lag_seconds", "Event loop wake-up delay, worst over the recent window",
+    function=lambda: health_checker.loop_monitor.max_lag,
+)
+
+# Logs the loop thread's stack whenever a callback blocks the loop (LOOP_BLOCK_THRESHOLD_MS)
+loop_watchdog = LoopWatchdog(health_checker.loop_monitor)
+REGISTRY.counter(
+    "event_loop_blocks_total", "Times the event loop was blocked longer than the watchdog threshold",
+    function=lambda: loop_watchdog.blocks,
+)
+REGISTRY.gauge(
+    "db_circuit_state", "Database circuit breaker state: 0 closed, 1 half-open, 2 open",
+    function=lambda: STATE_VALUES[breaker.state],
+)
+REGISTRY.gauge(
+    "mongo_pool_connections_open", "Open connections in the Mongo pool",
+    function=lambda: data.pool_stats.open,
+)
+REGISTRY.gauge(
+    "mongo_pool_connections_in_use", "Mongo pool connections checked out",
+    function=lambda: data.pool_stats.in_use,
+)
+
 # JWT Configuration
-SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_urlsafe(32))
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    # Per-process key: tokens break across workers and restarts. `cli.py serve`
+    # always exports one shared key before starting workers.
+    logger.warning("SECRET_KEY is not set; using a random per-process signing key")
+    SECRET_KEY = secrets.token_urlsafe(32)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+token_codec = TokenCodec(SECRET_KEY, ALGORITHM)
+refresh_tokens = RefreshTokenService(lambda: data.refresh_tokens, SECRET_KEY)
+
+# Authenticated principal cache, keyed by token subject (email)
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', '60'))
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+REGISTRY.counter("principal_cache_hits_total", "Principal cache hits", function=lambda: principal_cache.hits)
+REGISTRY.counter("principal_cache_misses_total", "Principal cache misses", function=lambda: principal_cache.misses)
+data.on_user_change(principal_cache.invalidate)
 
 # Pydantic models
 class UserRegister(BaseModel):
@@ -59,6 +190,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: User
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class ContactMessage(BaseModel):
     name: str
@@ -66,11 +201,77 @@ class ContactMessage(BaseModel):
     message: str
 
 # Utility functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def hash_pool_busy_exception():
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashPoolSaturated:
+        raise hash_pool_busy_exception()
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashPoolSaturated:
+        raise hash_pool_busy_exception()
+
+# Outdated stored hashes are upgraded in the background after a successful
+# login, so the login response never waits for the extra hash
+password_rehash_tasks = {}
+
+def schedule_rehash(email: str, password: str, old_hash: str):
+    if email in password_rehash_tasks:
+        return
+    if password_hasher.pending >= password_hasher.workers:
+        # Don't queue ahead of requests; the next login tries again
+        PASSWORD_REHASHES.labels("deferred").inc()
+        return
+    task = asyncio.create_task(rehash_password(email, password, old_hash))
+    password_rehash_tasks[email] = task
+    task.add_done_callback(lambda _: password_rehash_tasks.pop(email, None))
+
+async def rehash_password(email: str, password: str, old_hash: str):
+    try:
+        new_hash = await password_hasher.hash(password)
+        # Only replace the hash that was verified, never a newer one
+        result = await data.users.update_by_email(
+            email, {"password": new_hash, "updated_at": datetime.utcnow()}, expected={"password": old_hash}
+        )
+    except HashPoolSaturated:
+        PASSWORD_REHASHES.labels("deferred").inc()
+        return
+    except Exception:
+        logger.exception("Failed to upgrade the password hash for %s", email)
+        PASSWORD_REHASHES.labels("failed").inc()
+        return
+    PASSWORD_REHASHES.labels("upgraded" if result.modified_count else "stale").inc()
+
+def database_unavailable_exception(error: DatabaseUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=DATABASE_UNAVAILABLE,
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+def server_error(message: str, error: Exception) -> HTTPException:
+    """500 for an unexpected error, logged with the request and trace IDs.
+
+    Database outages (open breaker, missed deadline) become 503 with
+    Retry-After instead, logged without the traceback.
+    """
+    if isinstance(error, DatabaseUnavailable):
+        logger.warning("%s: %s (request %s)", message, error, current_request_id())
+        return database_unavailable_exception(error)
+    span = current_span()
+    if span is not None:
+        span.set("error", f"{type(error).__name__}: {error}")
+    logger.exception("%s (request %s)", message, current_request_id())
+    return HTTPException(status_code=500, detail=f"{message}: {str(error)}")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -79,44 +280,115 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = token_codec.encode(to_encode)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_codec.decode(credentials.credentials)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-    except JWTError:
+    except InvalidToken:
         raise credentials_exception
     
-    user = users_collection.find_one({"email": email})
+    user = await load_principal(email)
     if user is None:
         raise credentials_exception
     return user
 
+async def load_principal(email: str) -> Optional[dict]:
+    """Public fields of the user with ``email``, through the principal cache"""
+    user = principal_cache.get(email)
+    if user is None:
+        user = await data.users.find_public_by_email(email)
+        if user is not None:
+            principal_cache.set(email, user)
+    return user
+
+async def get_admin_user(current_user = Depends(get_current_user)):
+    if current_user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+# Response building. With FAST_RESPONSES the handlers return ready-made
+# FastJSONResponse objects, so FastAPI skips response_model validation and
+# jsonable_encoder; response_model still documents the schema.
+FAST_RESPONSES = os.environ.get('FAST_RESPONSES', 'false').lower() == 'true'
+
+def public_user(user: dict) -> dict:
+    return {"id": user["id"], "name": user["name"], "email": user["email"], "created_at": user["created_at"]}
+
+def token_response(access_token: str, user: dict, refresh_token: Optional[str] = None):
+    if FAST_RESPONSES:
+        return FastJSONResponse({
+            "access_token": access_token, "token_type": "bearer",
+            "user": public_user(user), "refresh_token": refresh_token,
+        })
+    return Token(
+        access_token=access_token, token_type="bearer",
+        user=User(**public_user(user)), refresh_token=refresh_token,
+    )
+
+# Contact message export formats
+EXPORT_CHUNK_ROWS = 500
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+async def export_ndjson(query: dict):
+    lines = []
+    async for message in data.contact_messages.iterate(query):
+        lines.append(json.dumps(message, default=_json_default))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+# Spreadsheets evaluate cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_cell(value) -> str:
+    """``value`` as CSV cell text, prefixed with ``'`` when a spreadsheet would run it as a formula"""
+    text = "" if value is None else str(value)
+    return "'" + text if text.startswith(CSV_FORMULA_PREFIXES) else text
+
+async def export_csv(query: dict):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ContactMessageRepository.FIELDS)
+    rows = 0
+    async for message in data.contact_messages.iterate(query):
+        writer.writerow([
+            message["created_at"].isoformat() if field == "created_at" else csv_cell(message.get(field))
+            for field in ContactMessageRepository.FIELDS
+        ])
+        rows += 1
+        if rows % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 # API Routes
-@app.get("/")
+@router.get("/")
 async def root():
     return {"message": "Xgen Cloud API is running!", "version": "1.0.0"}
 
-@app.post("/api/register", response_model=Token)
+@router.post("/api/register", response_model=Token)
 async def register_user(user_data: UserRegister):
     try:
-        # Check if user already exists
-        existing_user = users_collection.find_one({"email": user_data.email})
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Email already registered")
-        
         # Create new user
         user_id = str(uuid.uuid4())
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await get_password_hash(user_data.password)
         
         new_user = {
             "id": user_id,
@@ -127,90 +399,104 @@ async def register_user(user_data: UserRegister):
             "updated_at": datetime.utcnow()
         }
         
-        # Insert user into database
-        result = users_collection.insert_one(new_user)
+        # Insert user into database; the unique email index rejects duplicates
+        try:
+            result = await data.users.insert(new_user)
+        except Exception as e:
+            if not is_duplicate_key(e):
+                raise
+            raise HTTPException(status_code=400, detail="Email already registered")
         
         if not result.inserted_id:
             raise HTTPException(status_code=500, detail="Failed to create user")
+        if analytics:
+            analytics.record("signups")
         
         # Create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": user_data.email}, expires_delta=access_token_expires
         )
+        refresh_token = await refresh_tokens.issue(user_data.email)
         
-        # Prepare user response
-        user_response = User(
-            id=user_id,
-            name=user_data.name,
-            email=user_data.email,
-            created_at=new_user["created_at"]
-        )
-        
-        return Token(
-            access_token=access_token,
-            token_type="bearer",
-            user=user_response
-        )
+        return token_response(access_token, new_user, refresh_token)
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
+        raise server_error("Registration failed", e)
 
-@app.post("/api/login", response_model=Token)
+@router.post("/api/login", response_model=Token)
 async def login_user(user_data: UserLogin):
     try:
         # Find user by email
-        user = users_collection.find_one({"email": user_data.email})
+        user = await data.users.find_by_email(user_data.email)
         
-        if not user or not verify_password(user_data.password, user["password"]):
+        if not user or not await verify_password(user_data.password, user["password"]):
             raise HTTPException(
                 status_code=401,
                 detail="Incorrect email or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
+        if password_hasher.needs_update(user["password"]):
+            schedule_rehash(user["email"], user_data.password, user["password"])
+        
         # Create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": user_data.email}, expires_delta=access_token_expires
         )
+        refresh_token = await refresh_tokens.issue(user["email"])
         
-        # Prepare user response
-        user_response = User(
-            id=user["id"],
-            name=user["name"],
-            email=user["email"],
-            created_at=user["created_at"]
-        )
+        return token_response(access_token, user, refresh_token)
         
-        return Token(
-            access_token=access_token,
-            token_type="bearer",
-            user=user_response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise server_error("Login failed", e)
+
+@router.post("/api/token/refresh", response_model=Token)
+async def refresh_access_token(request_data: RefreshRequest):
+    """Exchange a refresh token for a new access token and refresh token"""
+    refresh_exception = HTTPException(
+        status_code=401,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        try:
+            email, refresh_token = await refresh_tokens.rotate(request_data.refresh_token)
+        except InvalidRefreshToken:
+            raise refresh_exception
+        
+        user = await load_principal(email)
+        if user is None:
+            raise refresh_exception
+        
+        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        access_token = create_access_token(
+            data={"sub": email}, expires_delta=access_token_expires
         )
         
+        return token_response(access_token, user, refresh_token)
+        
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
+        raise server_error("Token refresh failed", e)
 
-@app.get("/api/profile", response_model=User)
+@router.get("/api/profile", response_model=User)
 async def get_profile(current_user = Depends(get_current_user)):
     """Get current user profile"""
     try:
-        user_response = User(
-            id=current_user["id"],
-            name=current_user["name"],
-            email=current_user["email"],
-            created_at=current_user["created_at"]
-        )
-        return user_response
+        if FAST_RESPONSES:
+            return FastJSONResponse(public_user(current_user))
+        return User(**public_user(current_user))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get profile: {str(e)}")
+        raise server_error("Failed to get profile", e)
 
-@app.post("/api/contact")
+@router.post("/api/contact")
 async def submit_contact_message(message_data: ContactMessage):
     """Submit contact form message"""
     try:
@@ -224,10 +510,26 @@ async def submit_contact_message(message_data: ContactMessage):
             "status": "new"
         }
         
-        result = db.contact_messages.insert_one(contact_message)
+        if contact_ingest:
+            # Written in the next batch; respond without waiting for Mongo
+            try:
+                contact_ingest.submit(contact_message)
+            except IngestBufferFull:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+        else:
+            result = await data.contact_messages.insert(contact_message)
+
+            if not result.inserted_id:
+                raise HTTPException(status_code=500, detail="Failed to submit message")
         
-        if not result.inserted_id:
-            raise HTTPException(status_code=500, detail="Failed to submit message")
+        if analytics:
+            analytics.record("contact_messages")
+        if contact_processor:
+            contact_processor.notify()
         
         return {
             "message": "Thank you! Your message has been submitted successfully.",
@@ -237,108 +539,235 @@ async def submit_contact_message(message_data: ContactMessage):
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to submit message: {str(e)}")
+        raise server_error("Failed to submit message", e)
 
-@app.get("/api/health")
-async def health_check():
-    """Health check endpoint"""
+@router.get("/api/admin/contact-messages")
+async def list_contact_messages(
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    admin_user = Depends(get_admin_user),
+):
+    """List contact messages, newest first, with cursor pagination"""
+    query = ContactMessageRepository.filter_query(status, since, until)
     try:
-        # Test database connection
-        db.command('ismaster')
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "timestamp": datetime.utcnow()
-        }
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+        messages, next_cursor = await data.contact_messages.list_page(query, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"messages": messages, "next_cursor": next_cursor}
+
+@router.get("/api/admin/contact-messages/export")
+async def export_contact_messages(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    admin_user = Depends(get_admin_user),
+):
+    """Stream matching contact messages as NDJSON or CSV, oldest first"""
+    query = ContactMessageRepository.filter_query(status, since, until)
+    if format == "csv":
+        return StreamingResponse(
+            export_csv(query),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="contact_messages.csv"'},
+        )
+    return StreamingResponse(export_ndjson(query), media_type="application/x-ndjson")
+
+# Bulk user import; one at a time per process, since it hashes on every core
+user_import_lock = asyncio.Lock()
+
+@router.post("/api/admin/users/import")
+async def import_users(
+    request: Request,
+    chunk_size: int = Query(USER_IMPORT_CHUNK_SIZE, ge=1, le=10000),
+    admin_user = Depends(get_admin_user),
+):
+    """Create users from an NDJSON body of {name, email, password} rows, reporting per-row errors"""
+    if user_import_lock.locked():
+        raise HTTPException(status_code=409, detail="A user import is already running")
+    async with user_import_lock:
+        importer = UserImporter(data.users, chunk_size=chunk_size)
+        try:
+            report = await importer.run(request.stream())
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, importer.shutdown)
+    if analytics:
+        analytics.record("signups", count=report.inserted)
+    logger.info(
+        "User import by %s: %d rows, %d inserted in %.1f s",
+        admin_user["email"], report.rows, report.inserted, report.elapsed,
+    )
+    return report.as_dict()
+
+@router.get("/api/admin/analytics")
+async def get_analytics(
+    metric: str = Query(..., pattern="^(signups|contact_messages|contact_processed)$"),
+    granularity: str = Query("day", pattern="^(minute|hour|day)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    admin_user = Depends(get_admin_user),
+):
+    """Counts per bucket from the pre-aggregated rollups, empty buckets as zero"""
+    try:
+        return await read_series(data.analytics, metric, granularity, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Sampling profiles of this worker; one at a time, since each adds a sampling thread
+profile_lock = asyncio.Lock()
 
-@app.get("/api/services")
-async def get_services():
+@router.get("/api/admin/profile")
+async def get_sampling_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(PROFILE_SAMPLE_INTERVAL_MS, ge=1, le=1000),
+    threads: str = Query("loop", pattern="^(loop|all)$"),
+    admin_user = Depends(get_admin_user),
+):
+    """Sample this worker's stacks for a few seconds and return them as collapsed stacks for a flame graph"""
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with profile_lock:
+        # This handler runs on the event loop thread
+        thread_ids = None if threads == "all" else [threading.get_ident()]
+        result = await profile(seconds, interval_ms / 1000, thread_ids)
+    logger.info(
+        "Profile by %s: %d samples over %.1f s (%s threads)",
+        admin_user["email"], result.samples, result.elapsed, threads,
+    )
+    return Response(
+        content=result.collapsed(),
+        media_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"', "Cache-Control": "no-store"},
+    )
+
+@router.get("/api/admin/loop-blocks")
+async def get_loop_blocks(admin_user = Depends(get_admin_user)):
+    """Recent event loop blocks caught by the watchdog, with the loop thread's stack at the time"""
+    return {**loop_watchdog.stats(), "recent": list(loop_watchdog.recent)}
+
+@router.get("/api/health")
+async def health_check():
+    """Health check endpoint, from the background checker's last result"""
+    if not health_checker.database_fresh():
+        raise HTTPException(
+            status_code=503, detail=f"Service unavailable: {health_checker.database_error or 'database check is stale'}"
+        )
+    return {
+        "status": "healthy",
+        "database": "connected",
+        "hash_pool": password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "contact_ingest": contact_ingest.stats() if contact_ingest else None,
+        "contact_processor": contact_processor.stats() if contact_processor else None,
+        "analytics": analytics.stats() if analytics else None,
+        "database_circuit": breaker.stats(),
+        "loop_watchdog": loop_watchdog.stats(),
+        "timestamp": datetime.utcnow()
+    }
+
+@router.get("/livez")
+async def liveness():
+    """Liveness probe: answers as long as the event loop runs"""
+    return {"status": "alive"}
+
+@router.get("/readyz")
+async def readiness():
+    """Readiness probe: 503 while the database or this worker is unhealthy"""
+    report = health_checker.readiness()
+    report["mongo_pool"] = data.pool_status()
+    report["hash_pool"] = password_hasher.stats()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@router.get("/api/services")
+async def get_services(request: Request):
     """Get available services information"""
-    services = [
-        {
-            "id": "telecom",
-            "name": "Telecom Provider",
-            "description": "Advanced telecommunications infrastructure and connectivity solutions",
-            "features": [
-                "Network Infrastructure",
-                "VoIP Solutions",
-                "Enterprise Communications",
-                "5G Implementation"
-            ]
-        },
-        {
-            "id": "cloud",
-            "name": "Cloud Services",
-            "description": "Scalable cloud infrastructure and migration services",
-            "features": [
-                "Cloud Migration",
-                "Infrastructure as a Service",
-                "Platform as a Service",
-                "Cloud Security"
-            ]
-        },
-        {
-            "id": "marketing",
-            "name": "Digital Marketing",
-            "description": "Data-driven digital marketing strategies and brand building",
-            "features": [
-                "SEO Optimization",
-                "Social Media Marketing",
-                "Content Strategy",
-                "Analytics & Reporting"
-            ]
-        }
-    ]
-    
-    return {"services": services}
+    return services_response.response(request)
 
-@app.get("/api/partners")
-async def get_partners():
+@router.get("/api/partners")
+async def get_partners(request: Request):
     """Get partner companies information"""
-    partners = [
-        {
-            "id": "tata-tele",
-            "name": "Tata Tele",
-            "description": "Leading telecommunications provider in India",
-            "industry": "Telecommunications",
-            "partnership_since": "2020"
-        },
-        {
-            "id": "jio",
-            "name": "Jio",
-            "description": "Digital services and connectivity leader",
-            "industry": "Digital Services",
-            "partnership_since": "2021"
-        },
-        {
-            "id": "vi",
-            "name": "VI (Vodafone Idea)",
-            "description": "Major telecommunications operator",
-            "industry": "Telecommunications",
-            "partnership_since": "2019"
-        },
-        {
-            "id": "microsoft",
-            "name": "Microsoft",
-            "description": "Global leader in cloud and technology solutions",
-            "industry": "Technology",
-            "partnership_since": "2018"
-        }
-    ]
-    
-    return {"partners": partners}
+    return partners_response.response(request)
+
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
 
 # Error handlers
-@app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return {"error": "Endpoint not found", "status_code": 404}
+    return JSONResponse(
+        {"error": "Endpoint not found", "status_code": 404, "request_id": current_request_id()},
+        status_code=404,
+    )
+
+async def database_unavailable_handler(request, exc):
+    # Routes without their own error handling, e.g. token checks and admin listings
+    error = database_unavailable_exception(exc)
+    return JSONResponse({"detail": error.detail}, status_code=error.status_code, headers=error.headers)
 
-@app.exception_handler(500)
 async def internal_error_handler(request, exc):
-    return {"error": "Internal server error", "status_code": 500}
+    # Runs outside TracingMiddleware, so the request ID comes from request.state
+    request_id = getattr(request.state, "request_id", None)
+    logger.error("Unhandled error (request %s)", request_id, exc_info=exc)
+    return JSONResponse(
+        {"error": "Internal server error", "status_code": 500, "request_id": request_id},
+        status_code=500,
+    )
+
+# Application factory
+def create_app() -> FastAPI:
+    """Build the ASGI app.
+
+    Nothing here does I/O: the database client is created in the startup
+    event, and the hash pool, JWT backend and passlib context on first use.
+    Components are module-level, so apps built by repeated calls share them.
+    """
+    app = FastAPI(title="Xgen Cloud API", version="1.0.0", default_response_class=TracedJSONResponse)
+
+    # ETags and 304s for GET responses, innermost so the ETag describes the
+    # uncompressed body; compression wraps it
+    app.add_middleware(ConditionalGetMiddleware)
+
+    # Stores and replays responses to POSTs with an Idempotency-Key; inside
+    # compression so stored bytes do not depend on the client's Accept-Encoding
+    app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+    app.add_middleware(CompressionMiddleware)
+
+    # Throttle credential endpoints before any hashing work; added before CORS
+    # so rejections still carry CORS headers
+    app.add_middleware(RateLimitMiddleware)
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, replace with specific origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Request metrics; outermost so the timings include every other middleware
+    app.add_middleware(MetricsMiddleware)
+
+    # Request IDs and trace spans; outermost so the root span covers everything
+    app.add_middleware(TracingMiddleware)
+
+    app.include_router(router)
+    app.add_exception_handler(404, not_found_handler)
+    app.add_exception_handler(500, internal_error_handler)
+    app.add_exception_handler(DatabaseUnavailable, database_unavailable_handler)
+
+    app.add_event_handler("startup", connect_database)
+    app.add_event_handler("shutdown", close_database)
+    app.add_event_handler("shutdown", stop_password_hasher)
+    app.add_event_handler("shutdown", close_trace_exporter)
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    from cli import cli
+    cli(["serve"])
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""JWT encoding and verification with a cache of already-verified tokens.
+
+Clients resend the same access token on every request for its whole
+lifetime, so once a token has passed signature verification its claims are
+kept in a bounded cache keyed by the token's SHA-256 digest. Each entry
+expires at the token's own ``exp`` claim, so a cached token is never
+accepted after it would have failed verification.
+
+The signing library is selectable with ``JWT_BACKEND``: ``jose``
+(python-jose, the original implementation) or ``pyjwt``, which is faster.
+"""
+import hashlib
+import os
+import time
+from typing import Any, Dict
+
+from cache import TTLCache
+from metrics import TOKEN_CACHE_LOOKUPS, TOKEN_LATENCY
+from tracing import tracer
+
+JWT_BACKEND = os.environ.get('JWT_BACKEND', 'jose')
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+
+
+class InvalidToken(Exception):
+    """Raised when a token is malformed, badly signed or expired"""
+
+
+class JoseBackend:
+    name = "jose"
+
+    def __init__(self):
+        from jose import JWTError, jwt
+        self.jwt = jwt
+        self.error = JWTError
+
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return self.jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        try:
+            return self.jwt.decode(token, key, algorithms=[algorithm])
+        except self.error as e:
+            raise InvalidToken(str(e))
+
+
+class PyJWTBackend:
+    name = "pyjwt"
+
+    def __init__(self):
+        import jwt
+        self.jwt = jwt
+        self.error = jwt.PyJWTError
+
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return self.jwt.encode(claims, key, algorithm=algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        try:
+            return self.jwt.decode(token, key, algorithms=[algorithm])
+        except self.error as e:
+            raise InvalidToken(str(e))
+
+
+BACKENDS = {
+    "jose": JoseBackend,
+    "pyjwt": PyJWTBackend,
+}
+
+
+class TokenCodec:
+    """Signs and verifies access tokens, caching verified claims until ``exp``"""
+
+    def __init__(self, secret_key: str, algorithm: str = "HS256", backend: str = JWT_BACKEND,
+                 cache_size: int = TOKEN_CACHE_SIZE):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown JWT backend: {backend}")
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.backend_name = backend
+        self._backend = None
+        self.cache = TTLCache(cache_size, ttl=0)
+
+    @property
+    def backend(self):
+        # Created on first use, so the JWT library is not imported at startup
+        if self._backend is None:
+            self._backend = BACKENDS[self.backend_name]()
+        return self._backend
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        with tracer.span("jwt.encode"), TOKEN_LATENCY.labels("encode").time():
+            return self.backend.encode(claims, self.secret_key, self.algorithm)
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verified claims of ``token``; the returned dict must not be modified"""
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self.cache.get(digest)
+        if claims is not None:
+            TOKEN_CACHE_LOOKUPS.labels("hit").inc()
+            return claims
+
+        TOKEN_CACHE_LOOKUPS.labels("miss").inc()
+        with tracer.span("jwt.decode"), TOKEN_LATENCY.labels("decode").time():
+            claims = self.backend.decode(token, self.secret_key, self.algorithm)
+        exp = claims.get("exp")
+        if exp is not None:
+            remaining = float(exp) - time.time()
+            if remaining > 0:
+                self.cache.set(digest, claims, ttl=remaining)
+        return claims
@@ -0,0 +1,296 @@
+"""Request-scoped tracing.
+
+``TracingMiddleware`` gives every request an ID (the client's
+``X-Request-ID`` or a new one, echoed in the response) and, for sampled
+requests, a root span. Code under the request opens nested spans with
+``tracer.span(name, **attributes)``. The data layer, hash pool, JWT codec
+and JSON rendering already do. When the root span ends, the finished trace
+goes to the configured exporter.
+
+Trace context follows W3C Trace Context: an incoming ``traceparent`` header
+continues the caller's trace, and its sampled flag is honoured unless
+``TRACE_HONOR_PARENT`` is false. Other requests are sampled at
+``TRACE_SAMPLE_RATE``. Sampled responses carry a ``traceresponse`` header
+with the trace and root span IDs.
+
+An unsampled request allocates no spans: ``tracer.span()`` returns a shared
+no-op span, so instrumentation can stay on in production. With
+``TRACE_EXPORTER=none`` (the default) nothing is sampled at all.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_HONOR_PARENT = os.environ.get('TRACE_HONOR_PARENT', 'true').lower() == 'true'
+TRACE_JSONL_PATH = os.environ.get('TRACE_JSONL_PATH', 'traces.jsonl')
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def current_span() -> Optional["Span"]:
+    return _current_span.get()
+
+
+class Trace:
+    """The spans of one sampled request"""
+
+    def __init__(self, trace_id: str, exporter):
+        self.trace_id = trace_id
+        self.exporter = exporter
+        self.spans: List[Span] = []
+        self.finished = False
+
+
+class Span:
+    """A timed operation within a trace; use as a context manager"""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "attributes", "error",
+                 "start", "duration", "_started", "_token")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: Dict[str, object]):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        trace = self.trace
+        if trace.finished:
+            # Outlived its request (for example a background task it started)
+            return False
+        trace.spans.append(self)
+        return False
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Returned by ``Tracer.span`` outside a sampled request"""
+
+    __slots__ = ()
+
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate: float = TRACE_SAMPLE_RATE,
+                 honor_parent: bool = TRACE_HONOR_PARENT):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.honor_parent = honor_parent
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def span(self, name: str, **attributes):
+        """A child of the current span, or a no-op span when the request is not sampled"""
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def should_sample(self, parent_sampled: Optional[bool]) -> bool:
+        if not self.enabled:
+            return False
+        if parent_sampled is not None and self.honor_parent:
+            return parent_sampled
+        return random.random() < self.sample_rate
+
+    def finish(self, trace: Trace):
+        trace.finished = True
+        try:
+            trace.exporter.export([span.as_dict() for span in trace.spans])
+        except Exception:
+            logger.exception("Trace export failed")
+
+
+# Exporters: export() receives the spans of one trace, root span last
+class ConsoleExporter:
+    """Logs each trace as an indented span tree"""
+
+    def export(self, spans: List[dict]):
+        children: Dict[Optional[str], List[dict]] = {}
+        for span in spans:
+            children.setdefault(span["parent_id"], []).append(span)
+        root = spans[-1]
+        lines = [f"trace {root['trace_id']}"]
+
+        def walk(span, depth):
+            error = f" ERROR {span['error']}" if span["error"] else ""
+            attributes = " ".join(f"{k}={v}" for k, v in span["attributes"].items())
+            lines.append(f"{'  ' * depth}{span['name']} {span['duration_ms']:.2f} ms {attributes}{error}")
+            for child in sorted(children.get(span["span_id"], []), key=lambda s: s["start"]):
+                walk(child, depth + 1)
+
+        walk(root, 1)
+        logger.info("\n".join(lines))
+
+    def close(self):
+        pass
+
+
+class JsonlExporter:
+    """Appends one JSON line per span to ``path`` from a background thread"""
+
+    def __init__(self, path: str = TRACE_JSONL_PATH):
+        self.path = path
+        self.queue: "queue.SimpleQueue[Optional[List[dict]]]" = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._write, name="trace-writer", daemon=True)
+        self.thread.start()
+
+    def export(self, spans: List[dict]):
+        self.queue.put(spans)
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                spans = self.queue.get()
+                if spans is None:
+                    return
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + "\n")
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+
+EXPORTERS = {
+    "console": ConsoleExporter,
+    "jsonl": JsonlExporter,
+}
+
+
+def create_exporter(name: str = TRACE_EXPORTER):
+    if name == "none":
+        return None
+    if name not in EXPORTERS:
+        raise ValueError(f"Unknown trace exporter: {name}")
+    return EXPORTERS[name]()
+
+
+tracer = Tracer(create_exporter())
+
+
+def parse_traceparent(value: Optional[str]):
+    """``(trace_id, parent_span_id, sampled)`` from a traceparent header, or None"""
+    if not value:
+        return None
+    match = TRACEPARENT.match(value.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class TracingMiddleware:
+    """ASGI middleware assigning request IDs and opening the root span of sampled requests"""
+
+    def __init__(self, app, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+            elif name == b"traceparent":
+                traceparent = value.decode("latin-1")
+        request_id = request_id or secrets.token_hex(16)
+        parent = parse_traceparent(traceparent)
+
+        root = None
+        if self.tracer.should_sample(parent[2] if parent else None):
+            trace = Trace(parent[0] if parent else secrets.token_hex(16), self.tracer.exporter)
+            root = Span(trace, "HTTP", parent[1] if parent else None, {
+                "http.method": scope["method"], "http.target": scope["path"], "request_id": request_id,
+            })
+        extra_headers = [(b"x-request-id", request_id.encode("latin-1"))]
+        if root is not None:
+            extra_headers.append((b"traceresponse", f"00-{root.trace.trace_id}-{root.span_id}-01".encode()))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                if root is not None:
+                    root.set("http.status_code", message["status"])
+                message = {**message, "headers": [*message.get("headers", []), *extra_headers]}
+            await send(message)
+
+        # Also kept in request.state, for error handlers running outside this middleware
+        scope.setdefault("state", {})["request_id"] = request_id
+        token = _request_id.set(request_id)
+        try:
+            if root is None:
+                await self.app(scope, receive, send_wrapper)
+                return
+            with root:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
+            if root is not None:
+                route = scope.get("route")
+                root.name = f"HTTP {scope['method']} {route.path if route is not None else 'unmatched'}"
+                self.tracer.finish(root.trace)
@@ -0,0 +1,204 @@
+"""Bulk user import from NDJSON.
+
+Each input line is a JSON object with ``name``, ``email`` and ``password``,
+the same fields as ``POST /api/register``. Valid rows are collected into
+chunks of ``chunk_size``. Each chunk's passwords are hashed in parallel on a
+process pool, one slice per worker, and the chunk is written with an
+unordered ``insert_many``. Invalid rows, and rows rejected by the unique
+email index, are reported with their line number and do not stop the
+import.
+
+The process pool is separate from the request hashing pool, so an import
+does not take admission slots from logins. It does still compete with
+them for CPU; size ``workers`` accordingly when importing into a live
+server.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, EmailStr, ValidationError
+
+from hashing import hash_many
+from metrics import USERS_IMPORTED
+from repository import DUPLICATE_KEY
+
+USER_IMPORT_CHUNK_SIZE = int(os.environ.get('USER_IMPORT_CHUNK_SIZE', '1000'))
+USER_IMPORT_HASH_WORKERS = int(os.environ.get('USER_IMPORT_HASH_WORKERS', str(os.cpu_count() or 1)))
+USER_IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('USER_IMPORT_MAX_REPORTED_ERRORS', '1000'))
+
+# Longer lines are reported as invalid without being parsed
+MAX_LINE_BYTES = 64 * 1024
+
+
+class ImportRow(BaseModel):
+    name: str
+    email: EmailStr
+    password: str
+
+
+class ImportReport:
+    """Counts, per-row errors and timings of one import"""
+
+    def __init__(self, max_errors: int = USER_IMPORT_MAX_REPORTED_ERRORS):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.failed = 0
+        self.errors: List[Dict[str, object]] = []
+        self.hash_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def error(self, line: int, kind: str, message: str, email: Optional[str] = None):
+        setattr(self, kind, getattr(self, kind) + 1)
+        USERS_IMPORTED.labels(kind).inc()
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "email": email, "error": message})
+
+    def finish(self) -> "ImportReport":
+        self.elapsed = time.perf_counter() - self.started
+        # Insert errors are only known once their chunk is written, after
+        # invalid rows further down the file have already been reported
+        self.errors.sort(key=lambda error: error["line"])
+        return self
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.duplicates + self.invalid + self.failed > len(self.errors),
+            "seconds": round(self.elapsed, 3),
+            "hash_seconds": round(self.hash_seconds, 3),
+            "insert_seconds": round(self.insert_seconds, 3),
+            "rows_per_second": round(self.rows / self.elapsed, 1) if self.elapsed else 0.0,
+        }
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes],
+                       max_line: int = MAX_LINE_BYTES) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """``(line number, line)`` pairs from a byte stream; ``line`` is None if too long"""
+    buffer = b""
+    number = 0
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            end = buffer.find(b"\n")
+            if end < 0:
+                break
+            line, buffer = buffer[:end], buffer[end + 1:]
+            number += 1
+            if skipping:
+                skipping = False
+                yield number, None
+            else:
+                yield number, line if len(line) <= max_line else None
+        if len(buffer) > max_line:
+            # Drop the rest of an over-long line as it arrives
+            skipping = True
+            buffer = b""
+    if skipping or buffer.strip():
+        number += 1
+        yield number, None if skipping else buffer
+
+
+class UserImporter:
+    """Imports users into ``repository`` (a ``UserRepository``) in hashed chunks"""
+
+    def __init__(self, repository, chunk_size: int = USER_IMPORT_CHUNK_SIZE,
+                 workers: int = USER_IMPORT_HASH_WORKERS, executor=None):
+        self.repository = repository
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._owns_executor = executor is None
+        # spawn: forking a process that runs driver threads is not safe
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def run(self, chunks: AsyncIterator[bytes]) -> ImportReport:
+        report = ImportReport()
+        pending: List[Tuple[int, ImportRow]] = []
+        async for number, line in ndjson_lines(chunks):
+            if line is None:
+                report.rows += 1
+                report.error(number, "invalid", f"Line longer than {MAX_LINE_BYTES} bytes")
+                continue
+            if not line.strip():
+                continue
+            report.rows += 1
+            try:
+                row = ImportRow.model_validate_json(line)
+            except ValidationError as e:
+                first = e.errors()[0]
+                field = ".".join(str(part) for part in first["loc"])
+                report.error(number, "invalid", f"{field}: {first['msg']}" if field else first["msg"])
+                continue
+            pending.append((number, row))
+            if len(pending) >= self.chunk_size:
+                await self.write_chunk(pending, report)
+                pending = []
+        if pending:
+            await self.write_chunk(pending, report)
+        return report.finish()
+
+    async def write_chunk(self, rows: List[Tuple[int, ImportRow]], report: ImportReport):
+        started = time.perf_counter()
+        hashes = await self.hash_passwords([row.password for _, row in rows])
+        report.hash_seconds += time.perf_counter() - started
+
+        now = datetime.utcnow()
+        documents = [
+            {
+                "id": str(uuid.uuid4()),
+                "name": row.name,
+                "email": row.email,
+                "password": hashed,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for (_, row), hashed in zip(rows, hashes)
+        ]
+        from pymongo.errors import BulkWriteError
+
+        started = time.perf_counter()
+        try:
+            await self.repository.insert_many(documents)
+            inserted = len(documents)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                number, row = rows[error["index"]]
+                if error.get("code") == DUPLICATE_KEY:
+                    report.error(number, "duplicates", "Email already registered", row.email)
+                else:
+                    report.error(number, "failed", error.get("errmsg", "Insert failed"), row.email)
+        report.insert_seconds += time.perf_counter() - started
+        report.inserted += inserted
+        USERS_IMPORTED.labels("inserted").inc(inserted)
+
+    async def hash_passwords(self, passwords: List[str]) -> List[str]:
+        loop = asyncio.get_running_loop()
+        size = -(-len(passwords) // self.workers)
+        slices = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, hash_many, part) for part in slices)
+        )
+        return [hashed for part in results for hashed in part]
+
+    def shutdown(self):
+        if self._owns_executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+"""In-process tests for the data layer: deadlines, circuit breaker, contact workers, buffered ingestion,
+analytics, listings, refresh tokens, password rehashing and user import.
+
+Runs in-process against a mongomock stand-in wrapped so each call can be
+delayed or fail as if the connection dropped; no server or Mongo needed.
+Requires ``mongomock-motor``::
+
+    python backend_fault_test.py
+"""
+import asyncio
+import csv
+import io
+import os
+import sys
+import time
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError  # noqa: E402
+
+import hashing  # noqa: E402
+import repository  # noqa: E402
+from analytics import RollupRecorder, read_series  # noqa: E402
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, DeadlineExceeded  # noqa: E402
+from cache import TTLCache  # noqa: E402
+from contact_worker import ContactProcessor  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from ingest import BufferedIngest, IngestBufferFull  # noqa: E402
+from metrics import PASSWORD_REHASHES  # noqa: E402
+from refresh_tokens import InvalidRefreshToken, RefreshTokenReused, RefreshTokenService  # noqa: E402
+from repository import DataLayer, InvalidCursor, create_client, register_client_factory  # noqa: E402
+from user_import import UserImporter  # noqa: E402
+
+# Collection methods that make a round trip, and so can be slowed or dropped
+ROUND_TRIPS = {
+    "insert_one", "insert_many", "find_one", "find_one_and_update", "update_one",
+    "update_many", "delete_one", "delete_many", "bulk_write", "count_documents",
+}
+
+
+class Faults:
+    """What the stand-in does to each round trip"""
+
+    def __init__(self):
+        self.latency = 0.0
+        self.drop = False
+        self.calls = 0
+
+    async def apply(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.drop:
+            raise AutoReconnect("connection closed by fault injection")
+
+
+class FaultyCollection:
+    def __init__(self, inner, faults: Faults):
+        self.inner = inner
+        self.faults = faults
+
+    def __getattr__(self, name):
+        attribute = getattr(self.inner, name)
+        if name not in ROUND_TRIPS:
+            return attribute
+
+        async def call(*args, **kwargs):
+            await self.faults.apply()
+            return await attribute(*args, **kwargs)
+        return call
+
+
+class FaultyDatabase:
+    def __init__(self, inner, faults: Faults):
+        self.inner = inner
+        self.faults = faults
+
+    def __getitem__(self, name):
+        return FaultyCollection(self.inner[name], self.faults)
+
+    def __getattr__(self, name):
+        return FaultyCollection(getattr(self.inner, name), self.faults)
+
+    async def command(self, *args, **kwargs):
+        await self.faults.apply()
+        return {"ok": 1.0}
+
+
+class FaultyClient:
+    faults = Faults()
+
+    def __init__(self, url: str, **options):
+        self.inner = create_client("mongomock://")
+
+    def __getitem__(self, name):
+        return FaultyDatabase(self.inner[name], self.faults)
+
+    def close(self):
+        self.inner.close()
+
+
+register_client_factory("faulty", FaultyClient)
+
+
+class DatabaseBreakerTest(unittest.IsolatedAsyncioTestCase):
+    """Deadlines, fast failure and recovery of the data layer under injected faults"""
+
+    async def asyncSetUp(self):
+        self.faults = FaultyClient.faults = Faults()
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.3, timeout=0.2, timeouts={})
+        self.original_breaker = repository.breaker
+        repository.breaker = self.breaker
+        self.data = DataLayer("faulty://", "xgen_cloud_fault_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db.inner)
+
+    async def asyncTearDown(self):
+        repository.breaker = self.original_breaker
+        await self.data.close()
+
+    async def fail(self, times: int, error=AutoReconnect):
+        for _ in range(times):
+            with self.assertRaises(error):
+                await self.data.users.find_by_email("nobody@example.com")
+
+    async def test_slow_call_stops_at_deadline(self):
+        self.faults.latency = 2.0
+        started = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            await self.data.users.find_by_email("nobody@example.com")
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(self.breaker.failures, 1)
+
+    async def test_opens_after_consecutive_failures_and_fails_fast(self):
+        self.faults.drop = True
+        await self.fail(3)
+        self.assertEqual(self.breaker.state, OPEN)
+
+        calls = self.faults.calls
+        started = time.perf_counter()
+        with self.assertRaises(CircuitOpen) as raised:
+            await self.data.users.find_by_email("nobody@example.com")
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(self.faults.calls, calls, "an open breaker must not call the database")
+        self.assertGreaterEqual(raised.exception.retry_after, 1.0)
+
+    async def test_latency_opens_the_breaker(self):
+        self.faults.latency = 1.0
+        await self.fail(3, DeadlineExceeded)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    async def test_successful_probe_closes(self):
+        self.faults.drop = True
+        await self.fail(3)
+        self.faults.drop = False
+        await asyncio.sleep(0.35)
+        self.assertIsNone(await self.data.users.find_by_email("nobody@example.com"))
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_failed_probe_reopens(self):
+        self.faults.drop = True
+        await self.fail(3)
+        await asyncio.sleep(0.35)
+        await self.fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        await self.fail(1, CircuitOpen)
+
+    async def test_half_open_admits_one_probe_at_a_time(self):
+        self.faults.drop = True
+        await self.fail(3)
+        await asyncio.sleep(0.35)
+        self.faults.drop = False
+        self.faults.latency = 0.1
+        results = await asyncio.gather(
+            self.data.users.find_by_email("a@example.com"),
+            self.data.users.find_by_email("b@example.com"),
+            return_exceptions=True,
+        )
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], CircuitOpen)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_application_errors_keep_it_closed(self):
+        user = {"id": "1", "name": "A", "email": "dup@example.com", "password": "x"}
+        await self.data.users.insert(dict(user))
+        for _ in range(5):
+            with self.assertRaises(DuplicateKeyError):
+                await self.data.users.insert({**user, "id": "2"})
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_export_cursor_goes_through_the_breaker(self):
+        self.faults.drop = True
+        await self.fail(3)
+        with self.assertRaises(CircuitOpen):
+            async for _ in self.data.contact_messages.iterate({}):
+                pass
+
+    async def test_api_answers_503_with_retry_after(self):
+        import server
+
+        error = server.server_error("Login failed", CircuitOpen("open", retry_after=4.2))
+        self.assertEqual(error.status_code, 503)
+        self.assertEqual(error.headers["Retry-After"], "5")
+        response = await server.database_unavailable_handler(None, DeadlineExceeded("slow"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["retry-after"], "1")
+
+
+class ContactWorkerFaultTest(unittest.IsolatedAsyncioTestCase):
+    """Workers keep going when the database fails while they record an outcome"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_worker_fault_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+
+    async def asyncTearDown(self):
+        await self.data.close()
+
+    async def test_worker_survives_failed_finish(self):
+        messages = self.data.contact_messages
+        ids = [str(uuid.uuid4()) for _ in range(2)]
+        for i, message_id in enumerate(ids):
+            await messages.insert({
+                "id": message_id, "name": "Fault", "email": f"fault.{i}@example.com", "message": "Hello",
+                "created_at": datetime(2026, 1, 1, 0, 0, i), "status": "new",
+            })
+        finish, failures = messages.finish, []
+
+        async def finish_failing_once(*args, **kwargs):
+            if not failures:
+                failures.append(args)
+                raise ConnectionError("connection dropped while recording the outcome")
+            return await finish(*args, **kwargs)
+        messages.finish = finish_failing_once
+
+        async def handler(message):
+            pass
+
+        processor = ContactProcessor(lambda: messages, handler, concurrency=1, poll_interval=0.01,
+                                     recover_interval=60, timeout=1, lease=60)
+        await processor.start()
+        try:
+            for _ in range(200):
+                if processor.counts["done"]:
+                    break
+                await asyncio.sleep(0.01)
+            worker = processor._tasks[0]
+            self.assertFalse(worker.done(), "the worker must survive a failed finish")
+        finally:
+            await processor.stop()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(processor.counts["done"], 1)
+        statuses = {document["id"]: document["status"]
+                    async for document in self.data.db.contact_messages.find({}, {"id": 1, "status": 1})}
+        # The first message stays leased until recovery; the worker went on to the second
+        self.assertEqual(statuses, {ids[0]: "processing", ids[1]: "done"})
+
+
+class BufferedIngestTest(unittest.IsolatedAsyncioTestCase):
+    """Write-behind contact messages: flush triggers, failed batches and the buffer bound"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_ingest_test")
+        await self.data.connect()
+        self.repository = self.data.contact_messages
+        self.insert_many = self.repository.insert_many
+        self.ingest = BufferedIngest(lambda: self.data.contact_messages, batch_size=3, flush_interval=60,
+                                     max_buffer=5)
+
+    async def asyncTearDown(self):
+        await self.ingest.stop()
+        await self.data.close()
+
+    def submit(self, *numbers: int):
+        for number in numbers:
+            self.ingest.submit({"_id": f"m{number}", "id": f"m{number}", "status": "new"})
+
+    async def stored(self) -> list:
+        return sorted([document["id"] async for document in self.data.db.contact_messages.find({})],
+                      key=lambda value: int(value[1:]))
+
+    async def test_full_batch_is_written_without_waiting_for_the_interval(self):
+        await self.ingest.start()
+        self.submit(1, 2)
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.stored(), [])
+        self.submit(3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.stored(), ["m1", "m2", "m3"])
+        self.assertEqual(self.ingest.stats()["batches"], 1)
+
+    async def test_interval_flushes_a_partial_batch(self):
+        self.ingest.flush_interval = 0.05
+        await self.ingest.start()
+        self.submit(1)
+        await asyncio.sleep(0.2)
+        self.assertEqual(await self.stored(), ["m1"])
+        self.assertEqual(self.ingest.stats()["buffered"], 0)
+
+    async def test_failed_batch_stays_buffered_in_order(self):
+        async def dropped(messages, **kwargs):
+            raise AutoReconnect("connection closed by fault injection")
+        self.repository.insert_many = dropped
+        self.submit(1, 2, 3, 4)
+        with self.assertRaises(AutoReconnect):
+            await self.ingest.flush()
+        self.assertEqual([document["id"] for document in self.ingest.buffer], ["m1", "m2", "m3", "m4"])
+        self.assertEqual(self.ingest.stats()["failed_batches"], 1)
+
+        self.repository.insert_many = self.insert_many
+        await self.ingest.flush()
+        self.assertEqual(await self.stored(), ["m1", "m2", "m3", "m4"])
+        self.assertEqual(self.ingest.stats()["written"], 4)
+
+    async def test_retry_after_lost_reply_writes_once(self):
+        async def applied_then_dropped(messages, **kwargs):
+            await self.insert_many(messages, **kwargs)
+            raise AutoReconnect("connection closed before the reply")
+        self.repository.insert_many = applied_then_dropped
+        self.submit(1, 2)
+        with self.assertRaises(AutoReconnect):
+            await self.ingest.flush()
+
+        self.repository.insert_many = self.insert_many
+        await self.ingest.flush()  # every document is already there: duplicate _ids only
+        self.assertEqual(await self.stored(), ["m1", "m2"])
+        self.assertEqual(self.ingest.stats()["buffered"], 0)
+
+    async def test_full_buffer_refuses_new_messages(self):
+        self.submit(1, 2, 3, 4, 5)
+        with self.assertRaises(IngestBufferFull):
+            self.submit(6)
+        self.assertEqual(self.ingest.stats()["buffered"], 5)
+
+    async def test_stop_writes_everything_still_buffered(self):
+        await self.ingest.start()
+        self.ingest.batch_size = 10
+        self.submit(1, 2, 3, 4)
+        await self.ingest.stop()
+        self.assertEqual(await self.stored(), ["m1", "m2", "m3", "m4"])
+
+
+class AnalyticsFlushFaultTest(unittest.IsolatedAsyncioTestCase):
+    """Rollup counts stay exact when a flush is retried"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_analytics_fault_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+        self.collection = self.data.analytics.collection
+        self.bulk_write = self.collection.bulk_write
+        self.recorder = RollupRecorder(lambda: self.data.analytics)
+        self.at = datetime(2026, 1, 1, 12, 30)
+
+    async def asyncTearDown(self):
+        await self.data.close()
+
+    async def totals(self) -> dict:
+        series = await read_series(self.data.analytics, "signups", "day", self.at, self.at)
+        return series["totals"]
+
+    async def test_retry_after_lost_reply_counts_once(self):
+        async def applied_then_dropped(requests, **kwargs):
+            await self.bulk_write(requests, **kwargs)
+            raise AutoReconnect("connection closed before the reply")
+        self.collection.bulk_write = applied_then_dropped
+        self.recorder.record("signups", count=3, at=self.at)
+        with self.assertRaises(AutoReconnect):
+            await self.recorder.flush()
+
+        self.collection.bulk_write = self.bulk_write
+        self.recorder.record("signups", count=2, at=self.at)
+        await self.recorder.flush()  # the failed flush, again
+        await self.recorder.flush()  # the newer counts
+        self.assertEqual((await self.totals())["total"], 5)
+        self.assertEqual(self.recorder.stats()["pending"], 0)
+
+    async def test_rollup_inserted_by_another_worker_still_counts(self):
+        other = RollupRecorder(lambda: self.data.analytics)
+        other_flush = []
+
+        async def racing(requests, **kwargs):
+            if not other_flush:
+                # Another worker inserts the same rollups between our match and
+                # our insert, so every one of our upserts hits a duplicate _id
+                other_flush.append(True)
+                other.record("signups", count=4, at=self.at)
+                await other.flush()
+                raise BulkWriteError({"writeErrors": [
+                    {"index": index, "code": 11000, "errmsg": "E11000 duplicate key error"}
+                    for index in range(len(requests))
+                ]})
+            return await self.bulk_write(requests, **kwargs)
+        self.collection.bulk_write = racing
+        self.recorder.record("signups", count=1, at=self.at)
+        await self.recorder.flush()
+        self.assertEqual((await self.totals())["total"], 5)
+
+
+class PrincipalCacheTest(unittest.IsolatedAsyncioTestCase):
+    """Cached principals are dropped when their user record changes"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_principal_test")
+        self.cache = TTLCache(10, ttl=60)
+        self.data.on_user_change(self.cache.invalidate)
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+
+    async def asyncTearDown(self):
+        await self.data.close()
+
+    async def test_user_update_invalidates_the_cached_principal(self):
+        await self.data.users.insert({"id": "1", "name": "Old", "email": "p@example.com", "password": "x"})
+        self.cache.set("p@example.com", await self.data.users.find_public_by_email("p@example.com"))
+        self.cache.set("other@example.com", {"name": "Other"})
+        await self.data.users.update_by_email("p@example.com", {"name": "New"})
+        self.assertIsNone(self.cache.get("p@example.com"))
+        self.assertIsNotNone(self.cache.get("other@example.com"))
+
+
+class ContactMessageListingTest(unittest.IsolatedAsyncioTestCase):
+    """Cursor pagination and export of contact messages"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_listing_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+        self.messages = self.data.contact_messages
+        start = datetime(2026, 1, 1)
+        # Pairs share a timestamp, so the id has to break ties
+        for i in range(7):
+            await self.messages.insert({
+                "id": f"m{i}", "name": "Lister", "email": f"list.{i}@example.com", "message": "Hi",
+                "created_at": start + timedelta(minutes=i // 2), "status": "done" if i % 3 == 0 else "new",
+            })
+
+    async def asyncTearDown(self):
+        await self.data.close()
+
+    async def pages(self, query: dict, limit: int) -> list:
+        pages, cursor = [], None
+        while True:
+            page, cursor = await self.messages.list_page(query, limit, cursor)
+            pages.append([message["id"] for message in page])
+            if cursor is None:
+                return pages
+
+    async def test_pages_cover_every_message_newest_first(self):
+        pages = await self.pages({}, 3)
+        self.assertEqual(pages, [["m6", "m5", "m4"], ["m3", "m2", "m1"], ["m0"]])
+
+    async def test_last_full_page_has_no_cursor(self):
+        page, cursor = await self.messages.list_page({}, 7)
+        self.assertEqual(len(page), 7)
+        self.assertIsNone(cursor)
+
+    async def test_pages_respect_the_filter(self):
+        query = self.messages.filter_query(status="new", since=datetime(2026, 1, 1, 0, 1))
+        self.assertEqual(await self.pages(query, 2), [["m5", "m4"], ["m2"]])
+
+    async def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            await self.messages.list_page({}, 3, "not-a-cursor")
+
+    async def test_iterate_streams_oldest_first_in_batches(self):
+        ids = [message["id"] async for message in self.messages.iterate({}, batch_size=2)]
+        self.assertEqual(ids, [f"m{i}" for i in range(7)])
+
+    async def test_csv_export_escapes_formulas(self):
+        import server
+
+        await self.messages.insert({
+            "id": "m7", "name": "=HYPERLINK(\"http://example.com\")", "email": "formula@example.com",
+            "message": "+1 call me", "created_at": datetime(2026, 1, 2), "status": "new",
+        })
+        original, server.data = server.data, self.data
+        try:
+            exported = "".join([chunk async for chunk in server.export_csv({"id": "m7"})])
+        finally:
+            server.data = original
+        header, row = list(csv.reader(io.StringIO(exported)))
+        values = dict(zip(header, row))
+        self.assertEqual(values["name"], "'=HYPERLINK(\"http://example.com\")")
+        self.assertEqual(values["message"], "'+1 call me")
+        self.assertEqual(values["email"], "formula@example.com")
+        for value in ("-1", "@SUM(A1)", "\tx", "\rx"):
+            self.assertEqual(server.csv_cell(value), "'" + value)
+
+
+class RefreshTokenTest(unittest.IsolatedAsyncioTestCase):
+    """Rotation and reuse detection of refresh tokens"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_refresh_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+        self.service = RefreshTokenService(lambda: self.data.refresh_tokens, "test-secret")
+
+    async def asyncTearDown(self):
+        await self.data.close()
+
+    async def test_rotation_issues_a_new_token_in_the_family(self):
+        first = await self.service.issue("rotate@example.com")
+        email, second = await self.service.rotate(first)
+        self.assertEqual(email, "rotate@example.com")
+        self.assertNotEqual(second, first)
+        email, third = await self.service.rotate(second)
+        self.assertEqual(email, "rotate@example.com")
+        documents = [document async for document in self.data.db.refresh_tokens.find({})]
+        self.assertEqual(len({document["family_id"] for document in documents}), 1)
+        for document in documents:
+            self.assertNotIn(first, document.values(), "only HMACs of tokens are stored")
+
+    async def test_reuse_revokes_the_whole_family(self):
+        first = await self.service.issue("reuse@example.com")
+        _, second = await self.service.rotate(first)
+        other = await self.service.issue("reuse@example.com")
+
+        with self.assertRaises(RefreshTokenReused):
+            await self.service.rotate(first)
+        # The token the rotation handed out went with the family...
+        with self.assertRaises(InvalidRefreshToken):
+            await self.service.rotate(second)
+        # ...and the reused token stays rejected
+        with self.assertRaises(InvalidRefreshToken):
+            await self.service.rotate(first)
+        # Another session of the same user is a different family
+        email, _ = await self.service.rotate(other)
+        self.assertEqual(email, "reuse@example.com")
+
+    async def test_unknown_token_is_invalid_not_reused(self):
+        with self.assertRaises(InvalidRefreshToken) as raised:
+            await self.service.rotate("never-issued")
+        self.assertNotIsInstance(raised.exception, RefreshTokenReused)
+
+
+class PasswordRehashTest(unittest.IsolatedAsyncioTestCase):
+    """Logging in with an outdated hash upgrades it in the background"""
+
+    async def asyncSetUp(self):
+        import server
+
+        self.server = server
+        self.data = DataLayer("mongomock://", "xgen_cloud_rehash_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+        # The lowest bcrypt cost stands in for a hash made before the cost was raised
+        self.legacy_hash = hashing.build_context(["bcrypt"], bcrypt_rounds=4).hash("Password123!")
+        await self.data.users.insert({
+            "id": "1", "name": "Legacy", "email": "legacy@example.com", "password": self.legacy_hash,
+            "created_at": datetime(2020, 1, 1),
+        })
+        self.original = server.data, hashing._context
+        server.data = self.data
+        hashing._context = hashing.build_context(["bcrypt"], bcrypt_rounds=5)
+
+    async def asyncTearDown(self):
+        self.server.data, hashing._context = self.original
+        await self.data.close()
+
+    @staticmethod
+    def rehashes(outcome: str) -> float:
+        return PASSWORD_REHASHES.labels(outcome).value
+
+    async def stored_hash(self) -> str:
+        return (await self.data.users.find_by_email("legacy@example.com"))["password"]
+
+    async def test_login_upgrades_a_legacy_hash(self):
+        upgraded = self.rehashes("upgraded")
+        await self.server.login_user(self.server.UserLogin(email="legacy@example.com", password="Password123!"))
+        await asyncio.gather(*self.server.password_rehash_tasks.values())
+        new_hash = await self.stored_hash()
+        self.assertNotEqual(new_hash, self.legacy_hash)
+        self.assertFalse(self.server.password_hasher.needs_update(new_hash))
+        self.assertTrue(await self.server.password_hasher.verify("Password123!", new_hash))
+        self.assertEqual(self.rehashes("upgraded"), upgraded + 1)
+
+        # The upgraded hash is current, so the next login schedules nothing
+        await self.server.login_user(self.server.UserLogin(email="legacy@example.com", password="Password123!"))
+        self.assertEqual(self.server.password_rehash_tasks, {})
+
+    async def test_hash_changed_meanwhile_is_left_alone(self):
+        stale = self.rehashes("stale")
+        changed = hashing.pwd_context().hash("Changed123!")
+        await self.data.users.update_by_email("legacy@example.com", {"password": changed})
+        await self.server.rehash_password("legacy@example.com", "Password123!", self.legacy_hash)
+        self.assertEqual(await self.stored_hash(), changed)
+        self.assertEqual(self.rehashes("stale"), stale + 1)
+
+
+class UserImportTest(unittest.IsolatedAsyncioTestCase):
+    """Per-row outcomes of an NDJSON import"""
+
+    async def asyncSetUp(self):
+        self.data = DataLayer("mongomock://", "xgen_cloud_import_test")
+        await self.data.connect()
+        await ensure_indexes(self.data.db)
+        await self.data.users.insert({"id": "0", "name": "Existing", "email": "existing@example.com", "password": "x"})
+        self.original_context = hashing._context
+        hashing._context = hashing.build_context(["bcrypt"], bcrypt_rounds=4)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.importer = UserImporter(self.data.users, chunk_size=10, workers=2, executor=self.executor)
+
+    async def asyncTearDown(self):
+        self.importer.shutdown()
+        self.executor.shutdown()
+        hashing._context = self.original_context
+        await self.data.close()
+
+    @staticmethod
+    async def stream(text: str):
+        raw = text.encode()
+        for start in range(0, len(raw), 7):  # lines split across chunks
+            yield raw[start:start + 7]
+
+    async def test_counts_and_errors_by_line(self):
+        rows = [
+            '{"name": "A", "email": "a@example.com", "password": "Password1!"}',
+            '{"name": "Bad", "email": "not-an-email", "password": "Password1!"}',
+            '{"name": "Existing", "email": "existing@example.com", "password": "Password1!"}',
+            '',
+            '{"name": "B", "email": "b@example.com", "password": "Password1!"}',
+            '{"name": "A again", "email": "a@example.com", "password": "Password1!"}',
+            '{not json',
+        ]
+        report = (await self.importer.run(self.stream("\n".join(rows) + "\n"))).as_dict()
+        self.assertEqual(
+            {key: report[key] for key in ("rows", "inserted", "duplicates", "invalid", "failed")},
+            {"rows": 6, "inserted": 2, "duplicates": 2, "invalid": 2, "failed": 0},
+        )
+        self.assertEqual([error["line"] for error in report["errors"]], [2, 3, 6, 7])
+        self.assertEqual(report["errors"][1]["error"], "Email already registered")
+        self.assertFalse(report["errors_truncated"])
+
+        imported = await self.data.users.find_by_email("b@example.com")
+        self.assertTrue(hashing.pwd_context().verify("Password1!", imported["password"]))
+        self.assertEqual((await self.data.users.find_by_email("existing@example.com"))["password"], "x")
+
+
+class BreakerStateTest(unittest.TestCase):
+    """State machine with a fake clock"""
+
+    def test_reset_timeout_moves_to_half_open(self):
+        now = [0.0]
+        breaker = CircuitBreaker("clock", failure_threshold=1, reset_timeout=10, clock=lambda: now[0], timeouts={})
+        breaker.on_failure(breaker.before_call())
+        self.assertEqual(breaker.state, OPEN)
+        now[0] = 9.0
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+        now[0] = 10.0
+        self.assertTrue(breaker.before_call())
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+    def test_disabled_never_opens(self):
+        breaker = CircuitBreaker("off", failure_threshold=1, enabled=False, timeouts={})
+        for _ in range(5):
+            breaker.on_failure(breaker.before_call())
+        self.assertEqual(breaker.state, CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
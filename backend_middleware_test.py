@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""In-process tests for the request middleware.
+
+Each middleware wraps a small ASGI app that counts its calls, and requests
+are sent straight through the ASGI interface; no server, database or HTTP
+client is needed::
+
+    python backend_middleware_test.py
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+import unittest
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from breaker import DATABASE_UNAVAILABLE, CircuitOpen  # noqa: E402
+from compression import CompressionMiddleware, GzipEncoder, negotiate  # noqa: E402
+from conditional import ConditionalGetMiddleware  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from idempotency import IdempotencyMiddleware, MemoryStore  # noqa: E402
+from metrics import HTTP_REQUESTS, MetricsMiddleware  # noqa: E402
+from ratelimit import MemoryBackend, RateLimitMiddleware  # noqa: E402
+
+
+class Response:
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+async def request(app, path: str, body: Optional[dict], headers: Optional[Dict[str, str]] = None,
+                  client: str = "203.0.113.7", method: str = "POST") -> Response:
+    """Send ``body`` as JSON (or no body) to ``app`` and collect the response"""
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "scheme": "http",
+        "http_version": "1.1",
+        "server": ("testserver", 80),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": (client, 50000),
+    }
+    content = json.dumps(body).encode() if body is not None else b""
+    messages = [{"type": "http.request", "body": content, "more_body": False}]
+    sent: List[dict] = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()  # no disconnect while the test runs
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return Response(
+        start["status"],
+        {name.decode(): value.decode() for name, value in start.get("headers", [])},
+        b"".join(message.get("body", b"") for message in sent[1:]),
+    )
+
+
+class CountingApp:
+    """Answers with the call number and ``fields``; ``statuses`` sets the status of successive calls"""
+
+    def __init__(self, statuses=(), release: Optional[asyncio.Event] = None, fields: Optional[dict] = None):
+        self.calls = 0
+        self.statuses = list(statuses)
+        self.release = release
+        self.fields = fields or {}
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        call = self.calls
+        body = json.loads((await receive())["body"])
+        if self.release is not None:
+            await self.release.wait()
+        status = self.statuses.pop(0) if self.statuses else 200
+        payload = json.dumps({"call": call, "received": body, **self.fields}).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": payload})
+
+
+class StaticApp:
+    """Answers every request with ``body`` and ``headers``"""
+
+    def __init__(self, body: bytes, headers=(), status: int = 200):
+        self.body = body
+        self.headers = [(b"content-type", b"application/json"), *headers]
+        self.status = status
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await send({"type": "http.response.start", "status": self.status, "headers": list(self.headers)})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class CountingGzip(GzipEncoder):
+    created = 0
+
+    def __init__(self):
+        type(self).created += 1
+        super().__init__()
+
+
+class UnavailableStore(MemoryStore):
+    async def reserve(self, key: str, fingerprint: str):
+        raise CircuitOpen("Database circuit test is open", retry_after=3.5)
+
+
+class IdempotencyMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    """Idempotency-Key handling with the per-process store"""
+
+    def middleware(self, app, wait: float = 2.0, store=None) -> IdempotencyMiddleware:
+        self.store = store or MemoryStore()
+        return IdempotencyMiddleware(app, store=self.store, paths=("/api/register",), wait=wait, enabled=True)
+
+    async def test_retry_replays_stored_response(self):
+        app = CountingApp()
+        middleware = self.middleware(app)
+        headers = {"Idempotency-Key": "key-1"}
+        first = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        retry = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(retry.status, 200)
+        self.assertEqual(retry.body, first.body)
+        self.assertEqual(retry.headers.get("idempotent-replayed"), "true")
+        self.assertNotIn("idempotent-replayed", first.headers)
+
+    async def test_different_body_is_rejected(self):
+        app = CountingApp()
+        middleware = self.middleware(app)
+        headers = {"Idempotency-Key": "key-2"}
+        await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        response = await request(middleware, "/api/register", {"email": "b@example.com"}, headers)
+        self.assertEqual(response.status, 422)
+        self.assertEqual(app.calls, 1)
+
+    async def test_concurrent_duplicate_waits_for_the_first(self):
+        release = asyncio.Event()
+        app = CountingApp(release=release)
+        middleware = self.middleware(app)
+        headers = {"Idempotency-Key": "key-3"}
+        first = asyncio.create_task(request(middleware, "/api/register", {"email": "a@example.com"}, headers))
+        await asyncio.sleep(0.01)
+        duplicate = asyncio.create_task(request(middleware, "/api/register", {"email": "a@example.com"}, headers))
+        await asyncio.sleep(0.05)
+        self.assertFalse(duplicate.done(), "the duplicate must wait for the running request")
+        release.set()
+        first, duplicate = await first, await duplicate
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(duplicate.body, first.body)
+        self.assertEqual(duplicate.headers.get("idempotent-replayed"), "true")
+
+    async def test_duplicate_gets_409_after_wait(self):
+        release = asyncio.Event()
+        app = CountingApp(release=release)
+        middleware = self.middleware(app, wait=0.1)
+        headers = {"Idempotency-Key": "key-4"}
+        first = asyncio.create_task(request(middleware, "/api/register", {"email": "a@example.com"}, headers))
+        await asyncio.sleep(0.01)
+        duplicate = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        self.assertEqual(duplicate.status, 409)
+        self.assertEqual(duplicate.headers.get("retry-after"), "1")
+        release.set()
+        self.assertEqual((await first).status, 200)
+        self.assertEqual(app.calls, 1)
+
+    async def test_server_error_releases_the_key(self):
+        app = CountingApp(statuses=[500])
+        middleware = self.middleware(app)
+        headers = {"Idempotency-Key": "key-5"}
+        failed = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        retry = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        self.assertEqual(failed.status, 500)
+        self.assertEqual(retry.status, 200)
+        self.assertEqual(app.calls, 2)
+        self.assertNotIn("idempotent-replayed", retry.headers)
+
+    async def test_responses_with_tokens_are_not_stored(self):
+        app = CountingApp(fields={"access_token": "access-secret", "refresh_token": "refresh-secret"})
+        middleware = self.middleware(app)
+        headers = {"Idempotency-Key": "key-6"}
+        first = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        retry = await request(middleware, "/api/register", {"email": "a@example.com"}, headers)
+        self.assertEqual(first.json()["refresh_token"], "refresh-secret")
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(retry.status, 409)
+        self.assertNotIn("retry-after", retry.headers)
+        self.assertNotIn(b"secret", retry.body)
+        stored = [record for record, _ in self.store.records._entries.values()]
+        self.assertEqual(len(stored), 1)
+        self.assertNotIn(b"secret", stored[0]["body"])
+
+    async def test_keys_are_scoped_to_the_caller(self):
+        app = CountingApp()
+        middleware = self.middleware(app)
+        body = {"email": "a@example.com"}
+        await request(middleware, "/api/register", body, {"Idempotency-Key": "key-7"}, client="198.51.100.1")
+        other_ip = await request(middleware, "/api/register", body, {"Idempotency-Key": "key-7"},
+                                 client="198.51.100.2")
+        other_user = await request(middleware, "/api/register", body,
+                                   {"Idempotency-Key": "key-7", "Authorization": "Bearer other"},
+                                   client="198.51.100.1")
+        self.assertEqual(app.calls, 3)
+        self.assertNotIn("idempotent-replayed", other_ip.headers)
+        self.assertNotIn("idempotent-replayed", other_user.headers)
+
+    async def test_store_outage_answers_database_unavailable(self):
+        app = CountingApp()
+        middleware = self.middleware(app, store=UnavailableStore())
+        response = await request(middleware, "/api/register", {"email": "a@example.com"}, {"Idempotency-Key": "key-8"})
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.json()["detail"], DATABASE_UNAVAILABLE)
+        self.assertEqual(response.headers["retry-after"], "4")
+        self.assertEqual(app.calls, 0)
+
+    async def test_requests_without_a_key_always_run(self):
+        app = CountingApp()
+        middleware = self.middleware(app)
+        for _ in range(2):
+            await request(middleware, "/api/register", {"email": "a@example.com"})
+        self.assertEqual(app.calls, 2)
+
+
+class RateLimitMiddlewareTest(unittest.TestCase):
+    """Token buckets per client IP and per email, on a fake clock"""
+
+    def setUp(self):
+        self.now = [0.0]
+        self.app = CountingApp()
+        # 30 a minute is one token every 2 seconds
+        self.middleware = RateLimitMiddleware(
+            self.app, backend=MemoryBackend(clock=lambda: self.now[0]),
+            ip_per_minute=30, ip_burst=3, email_per_minute=30, email_burst=2, enabled=True,
+        )
+
+    def login(self, email: str, client: str = "203.0.113.7") -> Response:
+        return asyncio.run(request(self.middleware, "/api/login", {"email": email, "password": "x"}, client=client))
+
+    def test_over_the_ip_limit_gets_429_with_retry_after(self):
+        statuses = [self.login(f"user{i}@example.com").status for i in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        response = self.login("user9@example.com")
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers["retry-after"], "2")
+        self.assertEqual(response.json()["detail"], "Too many requests, please retry later")
+        self.assertEqual(self.app.calls, 3)
+
+    def test_bucket_refills(self):
+        for i in range(3):
+            self.login(f"user{i}@example.com")
+        self.now[0] += 1
+        response = self.login("user3@example.com")
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers["retry-after"], "1")
+        self.now[0] += 1
+        self.assertEqual(self.login("user3@example.com").status, 200)
+
+    def test_email_limit_holds_across_addresses(self):
+        statuses = [self.login("Target@Example.com ", client=f"198.51.100.{i}").status for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(self.login("other@example.com", client="198.51.100.9").status, 200)
+
+    def test_clients_have_separate_buckets(self):
+        for i in range(4):
+            self.login(f"user{i}@example.com")
+        self.assertEqual(self.login("user5@example.com", client="198.51.100.1").status, 200)
+
+    def test_routes_have_separate_buckets(self):
+        for i in range(4):
+            self.login(f"user{i}@example.com")
+        response = asyncio.run(request(self.middleware, "/api/register", {"email": "new@example.com"}))
+        self.assertEqual(response.status, 200)
+
+    def test_oversized_body_gets_413(self):
+        body = {"email": "big@example.com", "password": "x" * (64 * 1024)}
+        response = asyncio.run(request(self.middleware, "/api/login", body))
+        self.assertEqual(response.status, 413)
+        declared = asyncio.run(request(self.middleware, "/api/login", {"email": "a@example.com"},
+                                       {"Content-Length": str(1024 * 1024)}))
+        self.assertEqual(declared.status, 413)
+        self.assertEqual(self.app.calls, 0)
+
+    def test_other_paths_are_not_limited(self):
+        for _ in range(10):
+            self.assertEqual(asyncio.run(request(self.middleware, "/api/contact", {"email": "a@example.com"})).status,
+                             200)
+
+
+class CompressionMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    """Encoding negotiation and the compressed body cache"""
+
+    BODY = json.dumps({"items": ["service %d" % i for i in range(200)]}).encode()
+
+    def test_negotiation_follows_q_values(self):
+        encoders = ("br", "zstd", "gzip")
+        self.assertEqual(negotiate("gzip, br", encoders), "br")
+        self.assertEqual(negotiate("gzip;q=1.0, br;q=0.5", encoders), "gzip")
+        self.assertEqual(negotiate("br;q=0, gzip", encoders), "gzip")
+        self.assertEqual(negotiate("*", encoders), "br")
+        self.assertEqual(negotiate("*;q=0, gzip;q=0.1", encoders), "gzip")
+        self.assertIsNone(negotiate("identity", encoders))
+        self.assertIsNone(negotiate("deflate, gzip;q=0", encoders))
+
+    async def get(self, app, headers=None) -> Response:
+        return await request(app, "/api/services", None, {"Accept-Encoding": "gzip", **(headers or {})},
+                             method="GET")
+
+    async def test_compresses_and_weakens_etag(self):
+        app = CompressionMiddleware(StaticApp(self.BODY, [(b"etag", b'"abc"')]), encoders={"gzip": GzipEncoder})
+        response = await self.get(app)
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["etag"], 'W/"abc"')
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.body), self.BODY)
+        identity = await request(app, "/api/services", None, method="GET")
+        self.assertNotIn("content-encoding", identity.headers)
+        self.assertEqual(identity.body, self.BODY)
+
+    async def test_small_bodies_are_sent_as_is(self):
+        app = CompressionMiddleware(StaticApp(b'{"ok":true}'), encoders={"gzip": GzipEncoder})
+        response = await self.get(app)
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.body, b'{"ok":true}')
+
+    async def test_cached_per_etag_and_coding(self):
+        CountingGzip.created = 0
+        strong = CompressionMiddleware(StaticApp(self.BODY, [(b"etag", b'"abc"')]), encoders={"gzip": CountingGzip})
+        for _ in range(3):
+            await self.get(strong)
+        self.assertEqual(CountingGzip.created, 1)
+        self.assertEqual(len(strong.cache), 1)
+
+        CountingGzip.created = 0
+        other_etag = CompressionMiddleware(StaticApp(self.BODY, [(b"etag", b'"def"')]), encoders={"gzip": CountingGzip})
+        other_etag.cache = strong.cache
+        await self.get(other_etag)
+        self.assertEqual(CountingGzip.created, 1, "a different ETag is a different cache entry")
+
+        CountingGzip.created = 0
+        untagged = CompressionMiddleware(StaticApp(self.BODY), encoders={"gzip": CountingGzip})
+        for _ in range(2):
+            await self.get(untagged)
+        self.assertEqual(CountingGzip.created, 2, "bodies without a strong ETag are not cached")
+        self.assertEqual(len(untagged.cache), 0)
+
+
+class ConditionalGetMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    """ETags and 304s on the catalog routes, behind compression as in the API"""
+
+    BODY = CompressionMiddlewareTest.BODY
+
+    def stack(self, app) -> CompressionMiddleware:
+        return CompressionMiddleware(ConditionalGetMiddleware(app, enabled=True), encoders={"gzip": GzipEncoder})
+
+    async def get(self, app, path: str = "/api/services", headers=None) -> Response:
+        return await request(app, path, None, headers, method="GET")
+
+    async def test_not_modified_keeps_the_compressed_validator(self):
+        app = self.stack(StaticApp(self.BODY))
+        first = await self.get(app, headers={"Accept-Encoding": "gzip"})
+        etag = first.headers["etag"]
+        self.assertTrue(etag.startswith('W/"'))
+        again = await self.get(app, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(again.status, 304)
+        self.assertEqual(again.body, b"")
+        self.assertEqual(again.headers["etag"], etag)
+        self.assertEqual(again.headers["vary"], "Accept-Encoding")
+
+    async def test_identity_response_keeps_a_strong_validator(self):
+        app = self.stack(StaticApp(self.BODY))
+        first = await self.get(app)
+        self.assertFalse(first.headers["etag"].startswith("W/"))
+        again = await self.get(app, headers={"If-None-Match": first.headers["etag"]})
+        self.assertEqual(again.status, 304)
+        self.assertEqual(again.headers["etag"], first.headers["etag"])
+
+    async def test_route_etag_is_reused(self):
+        app = self.stack(StaticApp(self.BODY, [(b"etag", b'"catalog-1"')]))
+        response = await self.get(app, headers={"If-None-Match": '"catalog-1"'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers["etag"], '"catalog-1"')
+
+    async def test_other_routes_are_not_tagged(self):
+        app = self.stack(StaticApp(self.BODY))
+        for path in ("/api/profile", "/api/admin/contact-messages", "/metrics", "/readyz", "/api/health"):
+            response = await self.get(app, path)
+            self.assertEqual(response.status, 200)
+            self.assertNotIn("etag", response.headers, path)
+
+
+class MetricsMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    """Route labels for requests answered before routing"""
+
+    async def asyncSetUp(self):
+        self.app = FastAPI()
+
+        @self.app.post("/api/metrics-test/{item}")
+        async def item_route(item: str):
+            return {"item": item}
+
+        self.app.add_middleware(RateLimitMiddleware, paths=("/api/metrics-test/1",), backend=MemoryBackend(),
+                                ip_burst=1, email_burst=1, enabled=True)
+        self.app.add_middleware(MetricsMiddleware)
+
+    def count(self, method: str, route: str, status: str) -> float:
+        return HTTP_REQUESTS.labels(method, route, status).value
+
+    async def test_short_circuited_request_keeps_its_route(self):
+        template = "/api/metrics-test/{item}"
+        before = self.count("POST", template, "429")
+        self.assertEqual((await request(self.app, "/api/metrics-test/1", {})).status, 200)
+        self.assertEqual((await request(self.app, "/api/metrics-test/1", {})).status, 429)
+        self.assertEqual(self.count("POST", template, "429"), before + 1)
+
+    async def test_unknown_paths_stay_unmatched(self):
+        before = self.count("POST", "unmatched", "404")
+        self.assertEqual((await request(self.app, "/api/nowhere", {})).status, 404)
+        self.assertEqual(self.count("POST", "unmatched", "404"), before + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import requests
 import json
 import unittest
@@ -6,8 +7,13 @@ import uuid
 import time
 from datetime import datetime
 
-# Base URL from frontend/.env
-BASE_URL = "https://5b0f9f2f-5779-40f1-a547-6f3799a80ed9.preview.emergentagent.com/api"
+# Base URL from frontend/.env; set BACKEND_TEST_URL to test a local server
+# (e.g. http://localhost:8001/api). For load and latency numbers use
+# backend/benchmarks/harness.py instead.
+BASE_URL = os.environ.get(
+    "BACKEND_TEST_URL",
+    "https://5b0f9f2f-5779-40f1-a547-6f3799a80ed9.preview.emergentagent.com/api",
+)
 
 class XgenCloudAPITest(unittest.TestCase):
     """Test suite for Xgen Cloud API endpoints"""
@@ -186,7 +192,53 @@ class XgenCloudAPITest(unittest.TestCase):
         self.assertEqual(response.status_code, 403)  # Forbidden or Unauthorized
         
         print("✅ Authentication Middleware is working")
-    
+
+    def test_04b_refresh_token_reuse(self):
+        """Test refresh token rotation and reuse detection"""
+        print("\n🔍 Testing Refresh Token Rotation...")
+
+        refresh_user = {
+            "name": f"Refresh Test User {str(uuid.uuid4())[:8]}",
+            "email": f"refresh.test.{str(uuid.uuid4())[:8]}@example.com",
+            "password": "RefreshPassword123!"
+        }
+        register_response = requests.post(
+            f"{BASE_URL}/register",
+            json=refresh_user
+        )
+        self.assertEqual(register_response.status_code, 200)
+        first_token = register_response.json()["refresh_token"]
+        self.assertTrue(first_token)
+
+        # Rotating hands out a new access token and a new refresh token
+        response = requests.post(
+            f"{BASE_URL}/token/refresh",
+            json={"refresh_token": first_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue("access_token" in data)
+        self.assertEqual(data["user"]["email"], refresh_user["email"])
+        second_token = data["refresh_token"]
+        self.assertNotEqual(second_token, first_token)
+
+        # Presenting the rotated token again is treated as theft
+        response = requests.post(
+            f"{BASE_URL}/token/refresh",
+            json={"refresh_token": first_token}
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["detail"], "Invalid refresh token")
+
+        # ...and revokes the whole family, including the token issued by the rotation
+        response = requests.post(
+            f"{BASE_URL}/token/refresh",
+            json={"refresh_token": second_token}
+        )
+        self.assertEqual(response.status_code, 401)
+
+        print("✅ Refresh Token Rotation is working")
+
     def test_05_contact_form(self):
         """Test contact form submission endpoint"""
         print("\n🔍 Testing Contact Form API...")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""In-process tests for the components that need no database or server.
+
+Clocks are faked where the component takes one, so nothing here sleeps
+longer than a blocked-loop threshold::
+
+    python backend_unit_test.py
+"""
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from cache import TTLCache  # noqa: E402
+from health import LoopLagMonitor  # noqa: E402
+from profiling import LoopWatchdog  # noqa: E402
+from tokens import BACKENDS, InvalidToken, TokenCodec  # noqa: E402
+
+SECRET = "unit-test-secret-long-enough-for-hs256"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+    """Size-bounded LRU eviction and per-entry expiry"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(3, ttl=10, clock=self.clock)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set("a", 1)
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.clock.now = 10.0
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0, "an expired entry is dropped when read")
+
+    def test_per_entry_ttl(self):
+        self.cache.set("short", 1, ttl=1)
+        self.cache.set("long", 2)
+        self.clock.now = 5
+        self.assertIsNone(self.cache.get("short"))
+        self.assertEqual(self.cache.get("long"), 2)
+
+    def test_reading_does_not_extend_ttl(self):
+        self.cache.set("a", 1)
+        self.clock.now = 8
+        self.cache.get("a")
+        self.clock.now = 11
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_full_cache_evicts_least_recently_used(self):
+        for key in "abc":
+            self.cache.set(key, key)
+        self.cache.get("a")  # b is now the least recently used
+        self.cache.set("d", "d")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual([self.cache.get(key) for key in "acd"], ["a", "c", "d"])
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_overwriting_refreshes_value_and_recency(self):
+        for key in "abc":
+            self.cache.set(key, key)
+        self.clock.now = 9
+        self.cache.set("a", "A")
+        self.cache.set("d", "d")
+        self.clock.now = 12
+        self.assertEqual(self.cache.get("a"), "A")
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_invalidate_and_stats(self):
+        self.cache.set("a", 1)
+        self.cache.invalidate("a")
+        self.cache.invalidate("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("b", 2)
+        self.cache.get("b")
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_zero_size_stores_nothing(self):
+        cache = TTLCache(0, ttl=10, clock=self.clock)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class CountingBackend:
+    def __init__(self, inner):
+        self.inner = inner
+        self.decodes = 0
+
+    def encode(self, claims: dict, key: str, algorithm: str) -> str:
+        return self.inner.encode(claims, key, algorithm)
+
+    def decode(self, token: str, key: str, algorithm: str) -> dict:
+        self.decodes += 1
+        return self.inner.decode(token, key, algorithm)
+
+
+class TokenCodecTest(unittest.TestCase):
+    """Verified claims are cached until the token's ``exp``, never past it"""
+
+    def codec(self, backend: str = "jose") -> TokenCodec:
+        codec = TokenCodec(SECRET, backend=backend)
+        codec._backend = CountingBackend(BACKENDS[backend]())
+        self.clock = FakeClock()
+        codec.cache.clock = self.clock
+        return codec
+
+    def test_cached_until_exp(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                codec = self.codec(backend)
+                token = codec.encode({"sub": "a@example.com", "exp": int(time.time()) + 30})
+                self.assertEqual(codec.decode(token)["sub"], "a@example.com")
+                self.clock.now = 25
+                codec.decode(token)
+                self.assertEqual(codec.backend.decodes, 1)
+                self.clock.now = 31
+                codec.decode(token)
+                self.assertEqual(codec.backend.decodes, 2, "the entry must expire with the token")
+
+    def test_expired_token_is_rejected_and_not_cached(self):
+        codec = self.codec()
+        token = codec.encode({"sub": "a@example.com", "exp": int(time.time()) - 5})
+        for _ in range(2):
+            with self.assertRaises(InvalidToken):
+                codec.decode(token)
+        self.assertEqual(len(codec.cache), 0)
+
+    def test_token_without_exp_is_not_cached(self):
+        codec = self.codec()
+        token = codec.encode({"sub": "a@example.com"})
+        codec.decode(token)
+        codec.decode(token)
+        self.assertEqual(codec.backend.decodes, 2)
+
+    def test_tampered_token_is_rejected(self):
+        codec = self.codec()
+        token = codec.encode({"sub": "a@example.com", "exp": int(time.time()) + 30})
+        codec.decode(token)
+        header, payload, signature = token.split(".")
+        with self.assertRaises(InvalidToken):
+            codec.decode(f"{header}.{payload}.{signature[:-2]}AA")
+        with self.assertRaises(InvalidToken):
+            TokenCodec(SECRET + "-rotated").decode(token)
+
+    def test_backends_read_each_other_tokens(self):
+        claims = {"sub": "a@example.com", "exp": int(time.time()) + 30}
+        token = TokenCodec(SECRET, backend="jose").encode(claims)
+        self.assertEqual(TokenCodec(SECRET, backend="pyjwt").decode(token)["sub"], "a@example.com")
+
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+
+class LoopWatchdogTest(unittest.IsolatedAsyncioTestCase):
+    """A blocking call on the loop is reported once, with the loop thread's stack"""
+
+    async def asyncSetUp(self):
+        self.monitor = LoopLagMonitor(interval=0.02)
+        self.monitor.start()
+        await asyncio.sleep(0.05)
+        self.watchdog = LoopWatchdog(self.monitor, threshold=0.05, check_interval=0.01)
+        self.watchdog.start()
+
+    async def asyncTearDown(self):
+        self.watchdog.stop()
+        await self.monitor.stop()
+
+    async def test_blocked_loop_is_reported_with_its_stack(self):
+        block_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.watchdog.blocks, 1, "one report per blocked wakeup")
+        report = self.watchdog.recent[-1]
+        self.assertIn("block_the_loop", report["stack"])
+        self.assertGreaterEqual(report["blocked_ms"], 50)
+
+    async def test_idle_loop_is_not_reported(self):
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.watchdog.blocks, 0)
+
+    async def test_zero_threshold_disables_it(self):
+        watchdog = LoopWatchdog(self.monitor, threshold=0)
+        watchdog.start()
+        self.assertIsNone(watchdog._thread)
+        self.assertFalse(watchdog.stats()["enabled"])
+
+
+if __name__ == "__main__":
+    unittest.main()